@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Time building an fsdb.OsFileDb for a whole (synthetic) tree and
+walking it as a fully expanded file tree view would.  Warm runs are
+always done.  Cold runs (with the kernel's caches dropped first) need
+--drop-caches and root privileges.  Use --tree to time another checkout
+(e.g. one made with "git worktree add") for comparison.'''
+
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+def make_tree(root, num_dirs=2000, num_files=100000, seed=4):
+    '''Create num_dirs randomly nested directories under root holding
+    num_files (empty) files between them'''
+    rand = random.Random(seed)
+    dir_paths = ['']
+    for index in range(num_dirs):
+        parent = rand.choice(dir_paths)
+        dir_path = os.path.join(parent, 'd{0}'.format(index)) if parent else 'd{0}'.format(index)
+        dir_paths.append(dir_path)
+        os.makedirs(os.path.join(root, dir_path))
+    for index in range(num_files):
+        dir_path = rand.choice(dir_paths)
+        open(os.path.join(root, dir_path, 'f{0}'.format(index)), 'w').close()
+
+def drop_caches():
+    subprocess.check_call(['sync'])
+    with open('/proc/sys/vm/drop_caches', 'w') as fobj:
+        fobj.write('3\n')
+
+def walk(file_db, dir_path=''):
+    '''Return the number of files found by visiting every directory'''
+    dirs, files = file_db.dir_contents(dir_path, show_hidden=True)
+    count = len(list(files))
+    for dir_data in list(dirs):
+        count += walk(file_db, os.path.join(dir_path, dir_data.name))
+    return count
+
+def time_run(fsdb, num_threads):
+    '''Return the time taken and the number of files found.  If
+    num_threads is None the directories are populated one at a time as
+    the walk reaches them.'''
+    start = time.time()
+    file_db = fsdb.OsFileDb()
+    if num_threads is not None:
+        fsdb.NUM_LISTING_THREADS = num_threads
+        fsdb._LISTING_POOL = None
+        file_db.populate_all()
+    count = walk(file_db)
+    return time.time() - start, count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--dir', help='create (or reuse) the tree here rather than in a temporary directory')
+    parser.add_argument('--tree', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='the checkout whose gwsmhg_pkg is timed')
+    parser.add_argument('--threads', type=int, nargs='*', default=[4, 8], help='the listing thread counts to try with populate_all()')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of runs of each kind')
+    parser.add_argument('--drop-caches', action='store_true', help='also do cold runs')
+    args = parser.parse_args()
+    sys.path.insert(0, args.tree)
+    from gwsmhg_pkg import fsdb
+    if args.dir:
+        root = os.path.abspath(args.dir)
+        is_temporary = False
+        if not os.path.isdir(root):
+            make_tree(root)
+    else:
+        root = tempfile.mkdtemp(prefix='fsdb_populate.')
+        is_temporary = True
+        make_tree(root)
+    os.chdir(root)
+    modes = [('serial', None)]
+    if hasattr(fsdb.OsFileDb, 'populate_all'):
+        modes += [('{0} threads'.format(num_threads), num_threads) for num_threads in args.threads]
+    temperatures = ['warm', 'cold'] if args.drop_caches else ['warm']
+    try:
+        for temperature in temperatures:
+            for label, num_threads in modes:
+                times = []
+                for _index in range(args.repeat):
+                    if temperature == 'cold':
+                        drop_caches()
+                    else:
+                        # make sure that the caches are warm
+                        walk(fsdb.OsFileDb())
+                    seconds, count = time_run(fsdb, num_threads)
+                    times.append(seconds)
+                print('{0:<5} {1:<10} {2:.2f}-{3:.2f}s ({4} files)'.format(temperature, label, min(times), max(times), count))
+    finally:
+        os.chdir(os.path.dirname(root))
+        if is_temporary:
+            shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Time gitbase85's encoding (to the lines of a git binary patch) and
+decoding of several megabytes of random data.  Use --tree to time
+another checkout (e.g. one made with "git worktree add") for
+comparison.'''
+
+import argparse
+import os
+import sys
+import time
+import __builtin__
+
+def best_time(function, repeat):
+    '''Return the result of function() and the shortest time it took'''
+    times = []
+    for _index in range(repeat):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return result, min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--tree', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='the checkout whose gwsmhg_pkg is timed')
+    parser.add_argument('--size', type=int, default=4, help='the amount of data (in MiB)')
+    parser.add_argument('--repeat', type=int, default=3, help='the number of runs of each operation')
+    args = parser.parse_args()
+    __builtin__.__dict__.setdefault('_', lambda text: text)
+    sys.path.insert(0, args.tree)
+    from gwsmhg_pkg import gitbase85
+    data = os.urandom(args.size * 1024 * 1024)
+    lines, encode_time = best_time(lambda: gitbase85.encode_to_lines(data), args.repeat)
+    decoded, decode_time = best_time(lambda: gitbase85.decode_lines(lines), args.repeat)
+    assert decoded == data
+    print('{0}MiB: encode_to_lines {1:.2f}s decode_lines {2:.2f}s'.format(args.size, encode_time, decode_time))
+
+if __name__ == '__main__':
+    main()
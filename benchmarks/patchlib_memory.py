@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Measure the memory used (in bytes per line) by patchlib's parsed form
+of a large patch.  The sizes of all objects reachable from the parsed
+patch are totalled with sys.getsizeof().  Use --tree to measure another
+checkout (e.g. one made with "git worktree add") for comparison.'''
+
+import argparse
+import os
+import random
+import sys
+import __builtin__
+
+def generate_patch(num_files=2000, hunks_per_file=10, seed=16):
+    '''Return the text of a unified diff patch with lines that average
+    about 40 bytes'''
+    rand = random.Random(seed)
+    words = ['alpha', 'beta', 'gamma', 'delta', 'epsilon', 'zeta', 'eta', 'theta', 'iota', 'kappa', '(x)', '=', '+=', 'return', 'if', 'for']
+    def code_line():
+        return ' ' * rand.choice([0, 4, 8]) + ' '.join(rand.choice(words) for _index in range(rand.randint(4, 10))) + '\n'
+    lines = []
+    for file_index in range(num_files):
+        path = 'dir{0}/file{1}.py'.format(file_index % 50, file_index)
+        lines.append('diff -r 000000000000 {0}\n'.format(path))
+        lines.append('--- a/{0}\n'.format(path))
+        lines.append('+++ b/{0}\n'.format(path))
+        before_line = 1
+        for _hunk_index in range(hunks_per_file):
+            before_line += rand.randint(5, 50)
+            context = [code_line() for _index in range(6)]
+            removed = [code_line() for _index in range(rand.randint(0, 3))]
+            added = [code_line() for _index in range(rand.randint(1, 4))]
+            lines.append('@@ -{0},{1} +{0},{2} @@\n'.format(before_line, 6 + len(removed), 6 + len(added)))
+            lines.extend(' ' + line for line in context[:3])
+            lines.extend('-' + line for line in removed)
+            lines.extend('+' + line for line in added)
+            lines.extend(' ' + line for line in context[3:])
+    return ''.join(lines)
+
+def deep_size(obj):
+    '''Return the total sys.getsizeof() of obj and everything reachable
+    from it (each object counted once)'''
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen or isinstance(item, type):
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        if hasattr(item, '__dict__'):
+            stack.append(item.__dict__)
+        for klass in type(item).__mro__:
+            for slot in klass.__dict__.get('__slots__', ()):
+                if hasattr(item, slot):
+                    stack.append(getattr(item, slot))
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('patch', nargs='?', help='the patch file to parse (a synthetic one is generated if omitted)')
+    parser.add_argument('--tree', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='the checkout whose gwsmhg_pkg is measured')
+    args = parser.parse_args()
+    __builtin__.__dict__.setdefault('_', lambda text: text)
+    sys.path.insert(0, args.tree)
+    from gwsmhg_pkg import patchlib
+    if args.patch:
+        with open(args.patch) as fobj:
+            text = fobj.read()
+    else:
+        text = generate_patch()
+    num_lines = text.count('\n')
+    print('{0} lines, {1:.1f}MB, text alone {2:.1f} bytes/line'.format(num_lines, len(text) / 1e6, float(len(text)) / num_lines))
+    for lazy in (True, False):
+        patch = patchlib.Patch.parse_text(text, lazy=lazy)
+        if not lazy:
+            # make sure that any deferred hunk parsing has been done
+            for diff_plus in patch.diff_pluses:
+                if diff_plus.diff is not None:
+                    diff_plus.diff.hunks
+        size = deep_size(patch)
+        print('{0:<10} {1:6.1f} bytes/line {2:6.1f}MB'.format('lazy' if lazy else 'full', float(size) / num_lines, size / 1e6))
+
+if __name__ == '__main__':
+    main()
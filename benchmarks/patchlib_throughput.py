@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Measure the throughput (in MB/s) of parsing a large patch with
+patchlib's Patch.parse_text() and Patch.parse_stream(), both eagerly and
+lazily.  Use --tree to time another checkout (e.g. one made with "git
+worktree add") for comparison.'''
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import __builtin__
+
+from patchlib_memory import generate_patch
+
+def best_time(function, repeat):
+    '''Return the shortest time that function() took'''
+    times = []
+    for _index in range(repeat):
+        start = time.time()
+        function()
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('patch', nargs='?', help='the patch file to parse (a synthetic one is generated if omitted)')
+    parser.add_argument('--tree', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), help='the checkout whose gwsmhg_pkg is timed')
+    parser.add_argument('--repeat', type=int, default=5, help='the number of runs of each kind')
+    args = parser.parse_args()
+    __builtin__.__dict__.setdefault('_', lambda text: text)
+    sys.path.insert(0, args.tree)
+    from gwsmhg_pkg import patchlib
+    if args.patch:
+        file_path = args.patch
+        is_temporary = False
+    else:
+        fdesc, file_path = tempfile.mkstemp(prefix='patchlib_throughput.', suffix='.patch')
+        is_temporary = True
+        with os.fdopen(fdesc, 'wb') as fobj:
+            fobj.write(generate_patch())
+    try:
+        with open(file_path) as fobj:
+            text = fobj.read()
+        megabytes = len(text) / 1e6
+        print('{0:.1f}MB, {1} lines'.format(megabytes, text.count('\n')))
+        def parse_stream(lazy):
+            with open(file_path) as fobj:
+                patchlib.Patch.parse_stream(fobj, lazy=lazy)
+        for lazy in (False, True):
+            label = 'lazy' if lazy else 'eager'
+            seconds = best_time(lambda: patchlib.Patch.parse_text(text, lazy=lazy), args.repeat)
+            print('parse_text   {0:<5} {1:6.1f}MB/s'.format(label, megabytes / seconds))
+            seconds = best_time(lambda: parse_stream(lazy), args.repeat)
+            print('parse_stream {0:<5} {1:6.1f}MB/s'.format(label, megabytes / seconds))
+    finally:
+        if is_temporary:
+            os.remove(file_path)
+
+if __name__ == '__main__':
+    main()
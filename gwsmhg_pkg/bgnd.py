@@ -0,0 +1,103 @@
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Run (data fetching) functions in worker threads and deliver their
+results to callbacks in the GTK main loop.
+
+The functions run in the background must not touch GTK.
+'''
+
+import sys
+import threading
+import Queue
+
+import gobject
+
+# python threads only get to run while the main loop is idle if this is done
+gobject.threads_init()
+
+NUM_WORKERS = 4
+
+class Job(object):
+    def __init__(self, key, function, args, callback, error_callback):
+        self.key = key
+        self.function = function
+        self.args = args
+        self.callback = callback
+        self.error_callback = error_callback
+        self.cancelled = False
+    def cancel(self):
+        self.cancelled = True
+
+class WorkerPool(object):
+    '''A pool of worker threads.  At most one job per key is current and
+    submitting a new job for a key supersedes (cancels) the existing one.
+    Keys (e.g. the widget that wants the data) must be hashable.'''
+    def __init__(self, num_workers=NUM_WORKERS):
+        self._queue = Queue.Queue()
+        self._current_jobs = {} # only accessed in the main thread
+        for _index in range(num_workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+    def submit(self, key, function, callback, args=(), error_callback=None):
+        '''Run function(*args) in the background and call callback(result)
+        in the main loop.  If function raises an exception it is passed to
+        error_callback (if given) or re-raised in the main loop.'''
+        self.cancel(key)
+        job = Job(key, function, args, callback, error_callback)
+        self._current_jobs[key] = job
+        self._queue.put(job)
+        return job
+    def cancel(self, key):
+        job = self._current_jobs.pop(key, None)
+        if job is not None:
+            job.cancel()
+    def is_pending(self, key):
+        return key in self._current_jobs
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job.cancelled:
+                continue
+            try:
+                result = job.function(*job.args)
+                exc_info = None
+            except Exception:
+                result = None
+                exc_info = sys.exc_info()
+            gobject.idle_add(self._deliver, job, result, exc_info)
+    def _deliver(self, job, result, exc_info):
+        if job.cancelled:
+            return False
+        del self._current_jobs[job.key]
+        if exc_info is None:
+            job.callback(result)
+        elif job.error_callback is not None:
+            job.error_callback(exc_info[1])
+        else:
+            raise exc_info[0], exc_info[1], exc_info[2]
+        return False
+
+POOL = WorkerPool()
+
+def submit(key, function, callback, args=(), error_callback=None):
+    return POOL.submit(key, function, callback, args=args, error_callback=error_callback)
+
+def cancel(key):
+    POOL.cancel(key)
+
+def is_pending(key):
+    return POOL.is_pending(key)
@@ -30,10 +30,18 @@ from . import actions
 from . import ws_actions
 from . import tlview
 
-def cs_table_column(model_descr, name):
+def _cs_column_properties(fixed_width):
+    properties = {'expand' : False, 'resizable' : True}
+    if fixed_width is not None:
+        # needed for views in fixed height mode
+        properties['sizing'] = gtk.TREE_VIEW_COLUMN_FIXED
+        properties['fixed-width'] = fixed_width
+    return properties
+
+def cs_table_column(model_descr, name, fixed_width=None):
     return tlview.ColumnSpec(
         title=name,
-        properties={'expand' : False, 'resizable' : True},
+        properties=_cs_column_properties(fixed_width),
         cells=[
             tlview.CellSpec(
                 cell_renderer_spec=tlview.CellRendererSpec(
@@ -68,12 +76,12 @@ def cs_description_crf(_column, cell, model, model_iter, user_data):
                 markup += ' <span background="%s"><b>%s</b></span>' % (colours[index], tag)
     cell.set_property('markup', markup)
 
-def cs_description_column(model_descr, extras):
+def cs_description_column(model_descr, extras, fixed_width=None):
     mcols = tuple(model_descr.col_index(x) for x in (_('Description'),) + extras)
     cols = tuple(_MARKUP_COLOURS[x] for x in extras)
     return tlview.ColumnSpec(
         title=_('Description'),
-        properties={'expand' : False, 'resizable' : True},
+        properties=_cs_column_properties(fixed_width),
         cells=[
             tlview.CellSpec(
                 cell_renderer_spec=tlview.CellRendererSpec(
@@ -267,20 +275,40 @@ CS_TABLE_TAG_UI_DESCR = \
 '''
 
 class HeadsTableView(ChangeSetTableView):
+    BGND_FETCH = True
     def __init__(self, busy_indicator=None, size_req=None):
         ChangeSetTableView.__init__(self, busy_indicator=busy_indicator, size_req=size_req)
         self.ui_manager.add_ui_from_string(CS_TABLE_EXEC_UI_DESCR)
         self.ui_manager.add_ui_from_string(CS_TABLE_REFRESH_UI_DESCR)
     def _fetch_contents(self):
-        try:
-            return ifce.SCM.get_heads_data()
-        except cmd_result.Failure as failure:
-            dialogue.report_failure(failure)
-            return []
+        return ifce.SCM.get_heads_data()
 
 class HeadsTable(table.TableWidget):
     View = HeadsTableView
 
+class LongChangeSetTableView(ChangeSetTableView):
+    '''A change set table view for tables that may have a very large
+    number of rows (e.g. history).  The model only supplies the values
+    that are actually displayed and, as fixed height mode is used, the
+    view doesn't need to measure every row.'''
+    class Model(tlview.NamedLazyListModel):
+        Row = ChangeSetTableView.Model.Row
+        types = ChangeSetTableView.Model.types
+    specification = tlview.ViewSpec(
+        properties=ChangeSetTableView.specification.properties,
+        selection_mode=gtk.SELECTION_SINGLE,
+        columns=[
+            cs_table_column(Model, _('Rev'), fixed_width=60),
+            cs_table_column(Model, _('Age'), fixed_width=120),
+            cs_description_column(Model, (_('Tags'), _('Branches')), fixed_width=480),
+            cs_table_column(Model, _('Author'), fixed_width=160),
+        ]
+    )
+    def __init__(self, busy_indicator=None, size_req=None):
+        ChangeSetTableView.__init__(self, busy_indicator=busy_indicator, size_req=size_req)
+        # all columns must have fixed sizing before this can be turned on
+        self.set_fixed_height_mode(True)
+
 class SearchableChangeSetTable(table.TableWidget):
     View = ChangeSetTableView
     def __init__(self, scroll_bar=True, busy_indicator=None, size_req=None, prefix=None, rev=True, **kwargs):
@@ -310,9 +338,10 @@ class SearchableChangeSetTable(table.TableWidget):
     def _fetch_rev(self, revarg):
         assert False, _("Must be defined in child")
 
-class HistoryTableView(ChangeSetTableView):
+class HistoryTableView(LongChangeSetTableView):
+    BGND_FETCH = True
     def __init__(self, busy_indicator=None, size_req=None):
-        ChangeSetTableView.__init__(self, busy_indicator=busy_indicator, size_req=size_req)
+        LongChangeSetTableView.__init__(self, busy_indicator=busy_indicator, size_req=size_req)
         self._default_max = 8192
         self._current_max = self._default_max
         self.action_groups[ws_actions.AC_IN_REPO].add_actions(
@@ -332,11 +361,7 @@ class HistoryTableView(ChangeSetTableView):
             return 0
         return int(self.model[-1][self.model.col_index(_('Rev'))])
     def _fetch_contents(self):
-        try:
-            return ifce.SCM.get_history_data(maxitems=self._current_max)
-        except cmd_result.Failure as failure:
-            dialogue.report_failure(failure)
-            return []
+        return ifce.SCM.get_history_data(maxitems=self._current_max)
     def _append_contents(self, torev=None):
         self.show_busy()
         oldest_rev = self.oldest_loaded_rev()
@@ -350,7 +375,6 @@ class HistoryTableView(ChangeSetTableView):
         self._current_max += count
         data = ifce.SCM.get_history_data(rev=start_rev, maxitems=count)
         self.model.append_contents(data)
-        self.view.columns_autosize()
         self._check_button_visibility()
         self.unshow_busy()
     def _check_button_visibility(self):
@@ -365,9 +389,12 @@ class HistoryTableView(ChangeSetTableView):
                 self._current_max = self._default_max
     def reset_contents_if_mapped(self, arg=None):
         self._current_max = self._default_max
-        ChangeSetTableView.reset_contents_if_mapped(self, arg)
-    def _set_contents(self):
-        ChangeSetTableView._set_contents(self)
+        LongChangeSetTableView.reset_contents_if_mapped(self, arg)
+    def _set_contents(self, contents=None):
+        LongChangeSetTableView._set_contents(self, contents)
+        self._check_button_visibility()
+    def _refresh_with_contents(self, contents):
+        LongChangeSetTableView._refresh_with_contents(self, contents)
         self._check_button_visibility()
     def _cs_next_tranche_acb(self, _action=None):
         self._append_contents()
@@ -457,6 +484,7 @@ TAG_TABLE_UI_DESCR = \
 '''
 
 class TagsTableView(ChangeSetTableView):
+    BGND_FETCH = True
     class Model(tlview.NamedListStore):
         Row = collections.namedtuple('TagRow', [_('Tag'), _('Scope'), _('Rev'), _('Branches'), _('Age'), _('Author'), _('Description')])
         types = Row(
@@ -512,16 +540,13 @@ class TagsTableView(ChangeSetTableView):
         MoveTagDialog(tag=tag).run()
         self.unshow_busy()
     def _fetch_contents(self):
-        try:
-            return ifce.SCM.get_tags_data()
-        except cmd_result.Failure as failure:
-            dialogue.report_failure(failure)
-            return []
+        return ifce.SCM.get_tags_data()
 
 class TagsTable(table.TableWidget):
     View = TagsTableView
 
 class BranchesTableView(ChangeSetTableView):
+    BGND_FETCH = True
     class Model(tlview.NamedListStore):
         Row = collections.namedtuple('BranchRow', [_('Branch'), _('Rev'), _('Tags'), _('Age'), _('Author'), _('Description')])
         types = Row(
@@ -554,11 +579,7 @@ class BranchesTableView(ChangeSetTableView):
         self.ui_manager.add_ui_from_string(CS_TABLE_REFRESH_UI_DESCR)
         self.ui_manager.add_ui_from_string(CS_TABLE_TAG_UI_DESCR)
     def _fetch_contents(self):
-        try:
-            return ifce.SCM.get_branches_data()
-        except cmd_result.Failure as failure:
-            dialogue.report_failure(failure)
-            return []
+        return ifce.SCM.get_branches_data()
 
 class BranchesTable(table.TableWidget):
     View = BranchesTableView
@@ -30,6 +30,8 @@ from . import table
 from . import actions
 from . import ifce
 from . import ws_event
+from . import ws_watcher
+from . import options
 
 SAVED_WKSPCE_FILE_NAME = os.sep.join([config_data.CONFIG_DIR_NAME, "workspaces"])
 SAVED_REPO_FILE_NAME = os.sep.join([config_data.CONFIG_DIR_NAME, "repositories"])
@@ -457,8 +459,13 @@ class EditorAllocationDialog(dialogue.Dialog):
             self._table.apply_changes()
         self.destroy()
 
+options.define('auto_update', 'use_inotify', options.Defn(options.str_to_bool, True, _('Use inotify (if available) to detect workspace changes instead of polling')))
+
+WS_WATCHER = None
+
 def auto_update_cb(_arg=None):
-    if dialogue.is_busy():
+    # polling is unnecessary if the workspace is being watched
+    if dialogue.is_busy() or WS_WATCHER is not None:
         return
     ws_event.notify_events(ws_event.AUTO_UPDATE)
 
@@ -474,6 +481,27 @@ AUTO_UPDATE = gutils.RefreshController(
 
 actions.CLASS_INDEP_AGS[actions.AC_DONT_CARE].add_action(AUTO_UPDATE.toggle_action)
 
+def _watched_events_cb(events):
+    if dialogue.is_busy():
+        return False
+    if AUTO_UPDATE.toggle_action.get_active():
+        ws_event.notify_events(events)
+    return True
+
+def _restart_ws_watcher_cb(_arg=None):
+    global WS_WATCHER
+    if WS_WATCHER is not None:
+        WS_WATCHER.close()
+        WS_WATCHER = None
+    if ifce.in_valid_repo and ws_watcher.AVAILABLE and options.get('auto_update', 'use_inotify'):
+        try:
+            WS_WATCHER = ws_watcher.Watcher(os.getcwd(), _watched_events_cb)
+        except ws_watcher.WatchError:
+            # fall back to polling
+            pass
+
+ws_event.add_notification_cb(ws_event.CHANGE_WD, _restart_ws_watcher_cb)
+
 def change_repository_cb(_widget, repo):
     dialogue.show_busy()
     result = ifce.chdir(repo)
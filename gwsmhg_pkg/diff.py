@@ -13,7 +13,6 @@
 ### along with this program; if not, write to the Free Software
 ### Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 
-import re
 import os
 
 import gtk
@@ -28,6 +27,7 @@ from . import textview
 from . import ifce
 from . import gutils
 from . import icons
+from . import bgnd
 
 class FileAndRefreshActions:
     def __init__(self):
@@ -97,7 +97,6 @@ class TextWidget(gtk.VBox):
                     self._entry.modify_base(state, gtk.gdk.color_parse("#00FF00"))
     class View(textview.View):
         class Buffer(textview.Buffer):
-            TWS_CHECK_CRE = re.compile('^(\+.*\S)(\s+\n)$')
             def __init__(self):
                 textview.Buffer.__init__(self)
                 self.index_tag = self.create_tag("INDEX", weight=pango.WEIGHT_BOLD, foreground="#0000AA", family="monospace")
@@ -114,16 +113,16 @@ class TextWidget(gtk.VBox):
                 self.unchanged_tag = self.create_tag("UNCHANGED", foreground="black", family="monospace")
             def _append_tagged_text(self, text, tag):
                 self.insert_with_tags(self.get_end_iter(), text, tag)
-            def _append_patch_line(self, line):
+            def _append_patch_line(self, line, tws_column=None):
+                '''Append the line (tagging any trailing white space found
+                at tws_column by patchlib.find_added_tws())'''
                 first_char = line[0]
                 if first_char == " ":
                     self._append_tagged_text(line, self.unchanged_tag)
                 elif first_char == "+":
-                    match = self.TWS_CHECK_CRE.match(line)
-                    if match:
-                        self._append_tagged_text(match.group(1), self.plus_tag)
-                        self._append_tagged_text(match.group(2), self.added_tws_tag)
-                        return len(match.group(1))
+                    if tws_column is not None:
+                        self._append_tagged_text(line[:tws_column], self.plus_tag)
+                        self._append_tagged_text(line[tws_column:], self.added_tws_tag)
                     else:
                         self._append_tagged_text(line, self.plus_tag)
                 elif first_char == "-":
@@ -147,7 +146,6 @@ class TextWidget(gtk.VBox):
                     self._append_tagged_text(line, self.rab_tag)
                 else:
                     self._append_tagged_text(line, self.index_tag)
-                return 0
         def __init__(self, width_in_chars=81, aspect_ratio=0.33, fdesc=None):
             textview.View.__init__(self, buffer=self.Buffer(), width_in_chars=width_in_chars, aspect_ratio=aspect_ratio, fdesc=fdesc)
             self.set_editable(False)
@@ -208,13 +206,11 @@ class TextWidget(gtk.VBox):
         old_count = len(self.tws_list)
         self.bfr.begin_not_undoable_action()
         self.bfr.set_text("")
-        self.tws_list = []
-        line_no = 0
-        for line in text.splitlines(True):
-            offset = self.bfr._append_patch_line(line)
-            if offset:
-                self.tws_list.append((line_no, offset - 2))
-            line_no += 1
+        # find all of the trailing white space in one pass over the text
+        tws_columns = dict(patchlib.find_added_tws(text))
+        for line_no, line in enumerate(patchlib.split_lines(text)):
+            self.bfr._append_patch_line(line, tws_columns.get(line_no))
+        self.tws_list = [(line_no, max(column - 2, 0)) for line_no, column in sorted(tws_columns.items())]
         self.bfr.end_not_undoable_action()
         new_count = len(self.tws_list)
         self.tws_display.set_value(new_count)
@@ -362,7 +358,10 @@ class DiffNotebook(gtk.Notebook):
         self.set_scrollable(True)
         self.popup_enable()
         self.diff_displays = {}
-        self.update()
+        self.connect("destroy", self._destroy_cb)
+        self.update_in_bgnd()
+    def _destroy_cb(self, _widget):
+        bgnd.cancel(self)
     @staticmethod
     def _make_file_label(filepath, file_icon):
         hbox = gtk.HBox()
@@ -405,8 +404,30 @@ class DiffNotebook(gtk.Notebook):
             self.remove_page(pnum)
         self.tws_display.set_value(num_tws_files)
     def update(self):
-        self.diff_pluses = self.get_diff_pluses()
+        bgnd.cancel(self)
+        self._set_diff_pluses(self.get_diff_pluses())
+    def update_in_bgnd(self):
+        # the current pages stay until the new diff arrives
+        bgnd.submit(self, self._fetch_diff_pluses, self._set_diff_pluses, error_callback=self._bgnd_fetch_failed_cb)
+    def _set_diff_pluses(self, diff_pluses):
+        self.diff_pluses = diff_pluses
         self._populate_pages()
+    def _bgnd_fetch_failed_cb(self, exception):
+        if not isinstance(exception, cmd_result.Failure):
+            raise exception
+        dialogue.report_failure(exception)
+        self._set_diff_pluses(patchlib.Patch.parse_text(exception.result.stdout).diff_pluses)
+    def _fetch_diff_text(self):
+        assert False, _("Must be defined in child")
+    def _fetch_diff_pluses(self):
+        # N.B. this is run in the background so mustn't touch GTK
+        return patchlib.Patch.parse_text(self._fetch_diff_text()).diff_pluses
+    def _get_diff_text(self):
+        try:
+            return self._fetch_diff_text()
+        except cmd_result.Failure as failure:
+            dialogue.report_failure(failure)
+            return failure.result.stdout
     def get_diff_pluses(self):
         diff_text = self._get_diff_text()
         epatch = patchlib.Patch.parse_text(diff_text)
@@ -430,14 +451,10 @@ class ScmDiffTextWidget(DiffNotebook, FileAndRefreshActions):
             # the diff between two revs is immutable so refresh is redundant
             self.a_name_list = ["diff_save", "diff_save_as"]
         self.diff_buttons = gutils.ActionButtonList([self._action_group], self.a_name_list)
-    def _get_diff_text(self):
-        try:
-            return ifce.SCM.get_diff_for_files(self._file_list, self._fromrev, self._torev)
-        except cmd_result.Failure as failure:
-            dialogue.report_failure(failure)
-            return failure.result.stdout
+    def _fetch_diff_text(self):
+        return ifce.SCM.get_diff_for_files(self._file_list, self._fromrev, self._torev)
     def _refresh_acb(self, _action):
-        self.update()
+        self.update_in_bgnd()
     def _get_text_to_save(self):
         return str(self)
 
@@ -509,14 +526,10 @@ class PmDiffTextWidget(DiffNotebook, FileAndRefreshActions):
             # the diff between two revs is immutable so refresh is redundant
             self.a_name_list = ["diff_save", "diff_save_as"]
         self.diff_buttons = gutils.ActionButtonList([self._action_group], self.a_name_list)
-    def _get_diff_text(self):
-        try:
-            return ifce.PM.get_diff_for_files(self._file_list, self._patch)
-        except cmd_result.Failure as failure:
-            dialogue.report_failure(failure)
-            return failure.result.stdout
+    def _fetch_diff_text(self):
+        return ifce.PM.get_diff_for_files(self._file_list, self._patch)
     def _refresh_acb(self, _action):
-        self.update()
+        self.update_in_bgnd()
     def _get_text_to_save(self):
         return str(self)
 
@@ -550,14 +563,10 @@ class IncomingDiffTextWidget(DiffNotebook, FileAndRefreshActions):
         FileAndRefreshActions.__init__(self)
         self.a_name_list = ["diff_save", "diff_save_as"]
         self.diff_buttons = gutils.ActionButtonList([self._action_group], self.a_name_list)
-    def _get_diff_text(self):
-        try:
-            return ifce.SCM.get_incoming_diff(self._rev, self._path)
-        except cmd_result.Failure as failure:
-            dialogue.report_failure(failure)
-            return failure.result.stdout
+    def _fetch_diff_text(self):
+        return ifce.SCM.get_incoming_diff(self._rev, self._path)
     def _refresh_acb(self, _action):
-        self.update()
+        self.update_in_bgnd()
     def _get_text_to_save(self):
         return str(self)
 
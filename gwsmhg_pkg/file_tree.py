@@ -38,6 +38,7 @@ from . import tortoise
 
 from . import patchlib
 from . import hg_mq_ifce
+from . import bgnd
 
 def _check_if_force(result):
     return dialogue.ask_force_or_cancel(result) == dialogue.Response.FORCE
@@ -98,6 +99,8 @@ class FileTreeView(tlview.TreeView, ws_actions.AGandUIManager, ws_event.Listener
                 view._populate(self.fs_path(dir_iter), dir_iter)
                 if self.iter_n_children(dir_iter) > 1:
                     self.remove_place_holder(dir_iter)
+                # its subdirectories are now candidates for prefetching
+                view.prefetch_in_bgnd()
         def on_row_collapsed_cb(self, _view, dir_iter, _dummy):
             self.insert_place_holder_if_needed(dir_iter)
         def update_iter_row_tuple(self, fsobj_iter, to_tuple):
@@ -251,12 +254,13 @@ class FileTreeView(tlview.TreeView, ws_actions.AGandUIManager, ws_event.Listener
         self.get_selection().set_select_function(self._dirs_not_selectable, full=True)
         self.add_notification_cb(ws_event.AUTO_UPDATE, self.auto_update)
         self.add_notification_cb(ws_event.CHANGE_WD, self.repopulate)
-        self.add_notification_cb(ws_event.FILE_CHANGES, self.update)
+        self.add_notification_cb(ws_event.FILE_CHANGES, self.update_in_bgnd)
+        self.connect("destroy", self._destroy_cb)
         # TODO: investigate whether repopulate() needs to be called here
         self.repopulate()
     def auto_update(self, _arg=None):
         if not self._file_db.is_current:
-            self.update()
+            self.update_in_bgnd()
     def populate_action_groups(self):
         self.action_groups[actions.AC_DONT_CARE].add_action(self.show_hidden_action)
         self.action_groups[actions.AC_DONT_CARE].add_actions(
@@ -346,7 +350,7 @@ class FileTreeView(tlview.TreeView, ws_actions.AGandUIManager, ws_event.Listener
         seln.unselect_all()
         for filepath in filepaths:
             seln.select_iter(self.get_iter_for_filepath(filepath))
-    def _update_dir(self, dirpath, parent_iter=None):
+    def _update_dir(self, dirpath, parent_iter=None, recursive=True):
         changed = False
         if parent_iter is None:
             child_iter = self.model.get_iter_first()
@@ -386,7 +390,8 @@ class FileTreeView(tlview.TreeView, ws_actions.AGandUIManager, ws_event.Listener
             changed |= self.model.get_value_named(child_iter, "icon") != row_tuple.icon
             self.model.update_iter_row_tuple(child_iter, row_tuple)
             if self._populate_all or self._row_expanded(child_iter):
-                changed |= self._update_dir(os.path.join(dirpath, name), child_iter)
+                if recursive:
+                    changed |= self._update_dir(os.path.join(dirpath, name), child_iter)
             else:
                 # make sure we don't leave bad data in children that were previously expanded
                 self.model.depopulate(child_iter)
@@ -422,17 +427,78 @@ class FileTreeView(tlview.TreeView, ws_actions.AGandUIManager, ws_event.Listener
     @staticmethod
     def _get_file_db():
         return fsdb.OsFileDb()
+    def _destroy_cb(self, _widget):
+        bgnd.cancel(self)
+        bgnd.cancel((self, 'prefetch'))
+    def prefetch_in_bgnd(self):
+        # so that expanding the directories that are likely to be expanded next doesn't block
+        if self._populate_all or self._file_db is None:
+            return
+        bgnd.submit((self, 'prefetch'), self._file_db.prefetch, lambda _count: None)
+    def _get_populated_file_db(self):
+        file_db = self._get_file_db()
+        if self._populate_all:
+            # list the whole tree up front (sibling directories concurrently)
+            file_db.populate_all()
+        return file_db
     def repopulate(self, _arg=None):
+        bgnd.cancel(self)
         self.show_busy()
-        self._file_db = self._get_file_db()
+        self._file_db = self._get_populated_file_db()
         self.model.clear()
         self._populate('', self.model.get_iter_first())
         self.unshow_busy()
+        self.prefetch_in_bgnd()
     def update(self, _arg=None):
+        bgnd.cancel(self)
         self.show_busy()
-        self._file_db = self._get_file_db()
+        self._file_db = self._get_populated_file_db()
         self._update_dir('', None)
         self.unshow_busy()
+        self.prefetch_in_bgnd()
+    def update_in_bgnd(self, _arg=None):
+        # the current display stays until the new file data arrives
+        bgnd.submit(self, self._get_file_db_update, self._update_with_file_db_update)
+    def _get_file_db_update(self):
+        # if the db can't be brought up to date incrementally get a new one
+        file_db = self._file_db
+        snapshot_data = None if file_db is None else file_db.fetch_snapshot_data()
+        if snapshot_data is None:
+            return (self._get_populated_file_db(), None)
+        return (file_db, snapshot_data)
+    def _update_with_file_db_update(self, file_db_update):
+        file_db, snapshot_data = file_db_update
+        if snapshot_data is None:
+            self._file_db = file_db
+            self._update_dir('', None)
+            self.prefetch_in_bgnd()
+        elif file_db is self._file_db:
+            for dirpath in file_db.apply_delta(snapshot_data):
+                self._update_displayed_dir(dirpath)
+    def _get_iter_for_displayed_dir(self, dirpath):
+        '''Return (True, dir_iter) for the row of the directory at dirpath
+        (None for the top level) or (False, None) if its contents aren't
+        being displayed'''
+        if not dirpath:
+            return (True, None)
+        dir_iter = None
+        for name in fsdb.split_path(dirpath):
+            if dir_iter is not None and not (self._populate_all or self._row_expanded(dir_iter)):
+                return (False, None)
+            child_iter = self.model.iter_children(dir_iter)
+            while child_iter is not None:
+                if self.model.get_value_named(child_iter, 'is_dir') and self.model.get_value_named(child_iter, 'name') == name:
+                    break
+                child_iter = self.model.iter_next(child_iter)
+            if child_iter is None:
+                return (False, None)
+            dir_iter = child_iter
+        return (self._populate_all or self._row_expanded(dir_iter), dir_iter)
+    def _update_displayed_dir(self, dirpath):
+        # only this directory's rows need updating (dirty subdirectories are done separately)
+        is_displayed, dir_iter = self._get_iter_for_displayed_dir(dirpath)
+        if is_displayed:
+            self._update_dir(dirpath, dir_iter, recursive=False)
     def get_selected_filepaths(self, expanded=False):
         store, selection = self.get_selection().get_selected_rows()
         filepath_list = [store.fs_path(store.get_iter(x)) for x in selection]
@@ -673,7 +739,7 @@ class ScmCwdFileTreeView(FileTreeView):
         self.hide_clean_action.set_menu_item_type(gtk.CheckMenuItem)
         self.hide_clean_action.set_tool_item_type(gtk.ToggleToolButton)
         FileTreeView.__init__(self, busy_indicator=busy_indicator, show_hidden=show_hidden)
-        self.add_notification_cb(ws_event.CHECKOUT|ws_event.FILE_CHANGES, self.update),
+        self.add_notification_cb(ws_event.CHECKOUT|ws_event.FILE_CHANGES, self.update_in_bgnd)
         if not ifce.SCM.get_extension_enabled("extdiff"):
             self.get_conditional_action("scm_extdiff_files_selection").set_visible(False)
             self.get_conditional_action("scm_extdiff_files_all").set_visible(False)
@@ -1239,7 +1305,7 @@ class TopPatchFileTreeView(GenericPatchFileTreeView):
             self.action_groups.get_action("pm_extdiff_files_all").set_visible(False)
         self.repopulate()
         self.add_notification_cb(ws_event.PATCH_PUSH|ws_event.PATCH_POP, self.repopulate)
-        self.add_notification_cb(ws_event.FILE_CHANGES|ws_event.PATCH_REFRESH, self.update)
+        self.add_notification_cb(ws_event.FILE_CHANGES|ws_event.PATCH_REFRESH, self.update_in_bgnd)
         self.init_action_states()
     def populate_action_groups(self):
         GenericPatchFileTreeView.populate_action_groups(self)
@@ -15,8 +15,21 @@
 
 import collections
 import os
+import time
 import hashlib
+import bisect
+import heapq
+import threading
 from itertools import ifilter
+from multiprocessing.pool import ThreadPool
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 class Relation(object):
     COPIED_FROM = '<<-'
@@ -25,6 +38,7 @@ class Relation(object):
     MOVED_TO = '->'
 
 RFD = collections.namedtuple('RFD', ['path', 'relation'])
+SnapshotData = collections.namedtuple('SnapshotData', ['db_signature', 'snapshot', 'db_digest'])
 Data = collections.namedtuple('Data', ['name', 'status', 'related_file_data'])
 Deco = collections.namedtuple('Deco', ['style', 'foreground'])
 
@@ -43,6 +57,57 @@ def split_path(path):
         parts.insert(0, tail)
     return parts
 
+# on some file systems modification times only have a resolution of a second
+_MTIME_RESOLUTION = 1.0
+
+def get_stat_signature(path):
+    try:
+        stat_data = os.stat(path)
+    except OSError:
+        return None
+    return (stat_data.st_ino, stat_data.st_size, stat_data.st_mtime)
+
+def list_dir_entries(dir_path):
+    '''Return a list of (name, is_dir) for the entries in dir_path (in
+    the same order as os.listdir()).  If scandir is available the file
+    system's entry types are used rather than stat()ing every entry.'''
+    if scandir is not None:
+        return [(entry.name, entry.is_dir()) for entry in scandir(dir_path)]
+    isdir = os.path.isdir
+    join = os.path.join
+    return [(name, isdir(join(dir_path, name))) for name in os.listdir(dir_path)]
+
+def _get_listing_data(dir_path):
+    # NB the time and signature must be taken before the listing
+    listed_at = time.time()
+    signature = get_stat_signature(dir_path)
+    try:
+        return (listed_at, signature, list_dir_entries(dir_path))
+    except OSError:
+        # let the directory report the problem when it's populated
+        return None
+
+# sibling directories are listed concurrently when whole trees are populated
+NUM_LISTING_THREADS = 4
+_LISTING_POOL = None
+_LISTING_POOL_LOCK = threading.Lock()
+
+# directories are populated in the background as well as the main thread
+# so their (quick) installation of listings is kept apart from snapshot
+# swaps in apply_delta() (the slow listing itself is done outside it)
+_POPULATE_LOCK = threading.Lock()
+
+# the most entries (files and subdirectories) that prefetch() will add
+# to a db (over all calls)
+PREFETCH_MAX_ENTRIES = 20000
+
+def _get_listing_pool():
+    global _LISTING_POOL
+    with _LISTING_POOL_LOCK:
+        if _LISTING_POOL is None:
+            _LISTING_POOL = ThreadPool(NUM_LISTING_THREADS)
+        return _LISTING_POOL
+
 def file_path_belongs_here(file_path, base_dir_path=None):
     return not os.path.relpath(file_path, os.curdir if base_dir_path is None else base_dir_path).startswith(os.pardir)
 
@@ -54,6 +119,13 @@ class NullFileDb:
         return True
     def dir_contents(self, dir_path, **kwargs):
         return ([], [])
+    def populate_all(self):
+        pass
+    def prefetch(self, max_entries=None):
+        return 0
+    def fetch_snapshot_data(self):
+        # incremental update isn't supported so the db must be rebuilt
+        return None
 
 class OsFileDb(NullFileDb):
     class FileDir(object):
@@ -66,9 +138,13 @@ class OsFileDb(NullFileDb):
             self._subdirs_data = []
             self.data = None if not name else Data(name, status if status is not False else self._get_initial_status(), None)
             self._dir_hash_digest = None
+            self._dir_signature = None
+            self._listed_at = None
+            # only one thread at a time lists (and populates) this directory
+            self._populate_lock = threading.Lock()
         @property
         def is_current(self):
-            if self._get_current_hash_digest() != self._dir_hash_digest:
+            if self._is_populated and not self._is_listing_current():
                 return False
             for subdir in self._subdirs.values():
                 if not subdir.is_current:
@@ -86,15 +162,44 @@ class OsFileDb(NullFileDb):
             for item in os.listdir(self._dir_path):
                 h.update(item)
             return h.digest()
-        def _populate(self):
-            h = hashlib.sha1()
-            for item in os.listdir(self._dir_path):
-                h.update(item)
-                dir_path = os.path.join(self._dir_path, item)
-                if os.path.isdir(dir_path):
+        def _is_listing_current(self):
+            # adding, removing or renaming entries changes the directory's
+            # signature so the listing only needs to be rehashed if a change
+            # could have happened within the mtime resolution of the listing
+            signature = get_stat_signature(self._dir_path)
+            if signature != self._dir_signature:
+                return False
+            if signature is not None and signature[2] + _MTIME_RESOLUTION > self._listed_at:
+                checked_at = time.time()
+                if self._get_current_hash_digest() != self._dir_hash_digest:
+                    return False
+                self._listed_at = checked_at
+            return True
+        @property
+        def has_changes(self):
+            return False
+        def _ensure_populated(self, listing_data=None):
+            if self._is_populated:
+                return
+            with self._populate_lock:
+                if self._is_populated:
+                    return
+                if listing_data is None:
+                    # NB the time and signature must be taken before the listing
+                    listing_data = (time.time(), get_stat_signature(self._dir_path), self._list_entries())
+                with _POPULATE_LOCK:
+                    self._listed_at, self._dir_signature, listing = listing_data
+                    self._dir_hash_digest = self._populate(listing)
+        def _list_entries(self):
+            return list_dir_entries(self._dir_path)
+        def _populate(self, listing):
+            # the same digest as hashing the names one at a time
+            h = hashlib.sha1(''.join([item for item, _is_dir in listing]))
+            for item, is_dir in listing:
+                if is_dir:
+                    dir_path = os.path.join(self._dir_path, item)
                     self._add_subdir(name=item, dir_path=dir_path)
-                else:
-                    self._add_file(name=item)
+            self._files_data.extend([Data(item, None, None) for item, is_dir in listing if not is_dir])
             self._files_data.sort()
             # presort this data for multiple access efficiency
             self._subdirs_data = sorted([s.data for s in self._subdirs.itervalues()])
@@ -108,8 +213,7 @@ class OsFileDb(NullFileDb):
                 return self._subdirs[dir_path]
             return self._subdirs[dir_path[:sep_index]].find_dir(dir_path[sep_index + 1:])
         def dirs_and_files(self, show_hidden=False, **kwargs):
-            if not self._is_populated:
-                self._dir_hash_digest = self._populate()
+            self._ensure_populated()
             # use iterators for efficiency and data integrity
             if show_hidden:
                 dirs = iter(self._subdirs_data)
@@ -121,9 +225,53 @@ class OsFileDb(NullFileDb):
     def __init__(self, **kwargs):
         NullFileDb.__init__(self)
         self.base_dir = self.FileDir(**kwargs)
+        self._prefetched_entries = 0
     @property
     def is_current(self):
         return self.base_dir.is_current
+    def populate_all(self):
+        '''Populate the whole tree a level at a time listing the (not yet
+        populated) directories at each level concurrently'''
+        pool = _get_listing_pool()
+        level = [self.base_dir]
+        while level:
+            unpopulated = [fdir for fdir in level if not fdir._is_populated]
+            listings_data = pool.map(_get_listing_data, [fdir._dir_path for fdir in unpopulated])
+            for fdir, listing_data in zip(unpopulated, listings_data):
+                fdir._ensure_populated(listing_data)
+            level = [subdir for fdir in level for subdir in fdir._subdirs.itervalues()]
+    def prefetch(self, max_entries=None):
+        '''Populate (e.g. in the background) the unpopulated directories
+        that are most likely to be expanded next (those with changes
+        first and then the least deeply nested) until about max_entries
+        entries have been added by this and earlier calls (a prefetch
+        is started after every expansion and update).  Return the number
+        of directories populated.'''
+        budget = PREFETCH_MAX_ENTRIES if max_entries is None else max_entries
+        if self._prefetched_entries >= budget:
+            return 0
+        candidates = []
+        def add_candidates(fdir, depth):
+            for name, subdir in fdir._subdirs.items():
+                if subdir._is_populated:
+                    add_candidates(subdir, depth + 1)
+                else:
+                    heapq.heappush(candidates, (not subdir.has_changes, name.startswith('.'), depth, subdir._dir_path, subdir))
+        add_candidates(self.base_dir, 1)
+        count = 0
+        while candidates and self._prefetched_entries < budget:
+            _has_no_changes, _is_hidden, depth, _dir_path, fdir = heapq.heappop(candidates)
+            # it may have been expanded since it became a candidate
+            if not fdir._is_populated:
+                try:
+                    fdir._ensure_populated()
+                except OSError:
+                    continue
+                count += 1
+                self._prefetched_entries += len(fdir._files_data) + len(fdir._subdirs)
+            for name, subdir in fdir._subdirs.items():
+                heapq.heappush(candidates, (not subdir.has_changes, name.startswith('.'), depth + 1, subdir._dir_path, subdir))
+        return count
     def dir_contents(self, dir_path='', show_hidden=False, **kwargs):
         tdir = self.base_dir.find_dir(dir_path)
         if not tdir:
@@ -141,12 +289,15 @@ class GenericWsFileDb(OsFileDb):
         def is_current(self):
             if not self._is_populated:
                 return self._get_current_status() == self.data.status
-            if self._get_current_hash_digest() != self._dir_hash_digest:
+            if not self._is_listing_current():
                 return False
             for subdir in self._subdirs.values():
                 if not subdir.is_current:
                     return False
             return True
+        @property
+        def has_changes(self):
+            return self.data is not None and self.data.status not in self.CLEAN_STATUS_SET
         def _add_subdir(self, name, dir_path=None, status=False, **kwargs):
             # NB: default status has been changed to False
             OsFileDb.FileDir._add_subdir(self, name=name, dir_path=dir_path, status=status, **kwargs)
@@ -158,7 +309,7 @@ class GenericWsFileDb(OsFileDb):
             h = hashlib.sha1()
             assert False, "_get_current_hash_digest() must be defined in child"
             return h.digest()
-        def _populate(self):
+        def _populate(self, listing):
             h = hashlib.sha1()
             assert False, "_populate() must be defined in child"
             self._is_populated = True
@@ -176,8 +327,7 @@ class GenericWsFileDb(OsFileDb):
         def _is_clean_file(self, fdata):
             return fdata.status in self.CLEAN_STATUS_SET
         def dirs_and_files(self, show_hidden=False, hide_clean=False):
-            if not self._is_populated:
-                self._dir_hash_digest = self._populate()
+            self._ensure_populated()
             if show_hidden:
                 if hide_clean:
                     dirs = ifilter((lambda x: x.status not in self.CLEAN_STATUS_SET), self._subdirs_data)
@@ -193,21 +343,109 @@ class GenericWsFileDb(OsFileDb):
                 files = ifilter((lambda x: not self._is_hidden_file(x)), self._files_data)
             return (dirs, files)
 
+def _normalized_dir_path(dir_path):
+    if dir_path is None:
+        return ''
+    if os.path.isabs(dir_path):
+        dir_path = os.path.relpath(dir_path)
+    dir_path = os.path.normpath(dir_path)
+    return '' if dir_path == os.curdir else dir_path
+
+# every path with a given prefix sorts before prefix + _AFTER_SEP
+_AFTER_SEP = chr(ord(os.sep) + 1)
+
+def _may_need_normalizing(file_path):
+    return file_path.startswith((os.curdir, os.sep)) or file_path.endswith(os.sep) or (os.sep + os.curdir) in file_path or (os.sep + os.sep) in file_path
+
+class _SnapshotIndex(object):
+    '''The (normalized) file paths in a snapshot's data in sorted order
+    (so that the files within a directory are a contiguous range found by
+    bisection) with a parallel list of their statuses'''
+    def __init__(self, file_status_data):
+        self.file_status_data = file_status_data
+        # SCMs report normalized relative paths so normalize only if needed
+        self._file_paths = {}
+        norm_paths = []
+        for file_path in file_status_data:
+            if _may_need_normalizing(file_path):
+                norm_path = _normalized_dir_path(file_path)
+                # files outside the workspace don't belong in any directory
+                if not norm_path or norm_path == os.pardir or norm_path.startswith(os.pardir + os.sep):
+                    continue
+                self._file_paths[norm_path] = file_path
+                norm_paths.append(norm_path)
+            else:
+                norm_paths.append(file_path)
+        norm_paths.sort()
+        self.norm_paths = norm_paths
+        self.statuses = [file_status_data[self.get_file_path(norm_path)][0] for norm_path in norm_paths]
+    def get_file_path(self, norm_path):
+        return self._file_paths.get(norm_path, norm_path)
+    def get_range(self, prefix, lo=0, hi=None):
+        if hi is None:
+            hi = len(self.norm_paths)
+        if not prefix:
+            return (lo, hi)
+        return (bisect.bisect_left(self.norm_paths, prefix + os.sep, lo, hi), bisect.bisect_left(self.norm_paths, prefix + _AFTER_SEP, lo, hi))
+
 class Snapshot(object):
-    def __init__(self, file_status_data, relevant_keys=None):
-        self._file_status_data = file_status_data
-        self._relevant_keys = file_status_data.keys() if relevant_keys is None else relevant_keys
-        self._status_set = frozenset(file_status_data[key][0] for key in self._relevant_keys)
+    '''The file status data for a directory (and its subdirectories).
+    Narrowing to a subdirectory is a bisection of the parent's range of
+    a shared sorted index so building a tree doesn't rescan every file
+    for every directory.'''
+    def __init__(self, file_status_data, _index=None, _prefix='', _lo=0, _hi=None):
+        self._index = _SnapshotIndex(file_status_data) if _index is None else _index
+        self._prefix = _prefix
+        self._lo = _lo
+        self._hi = len(self._index.norm_paths) if _hi is None else _hi
+        self._status_set = None
     @property
     def status_set(self):
+        if self._status_set is None:
+            self._status_set = frozenset(self._index.statuses[self._lo:self._hi])
         return self._status_set
     def iterate_data(self):
-        for file_path in self._relevant_keys:
-            status, related_file_data = self._file_status_data[file_path]
+        file_status_data = self._index.file_status_data
+        for norm_path in self._index.norm_paths[self._lo:self._hi]:
+            file_path = self._index.get_file_path(norm_path)
+            status, related_file_data = file_status_data[file_path]
             yield (file_path, status, related_file_data)
+    def iterate_contents(self):
+        '''Yield (name, data) for the directory's immediate contents where
+        data is None for subdirectories and (status, related_file_data)
+        for files.  Each subdirectory's files are skipped by bisection.'''
+        norm_paths = self._index.norm_paths
+        file_status_data = self._index.file_status_data
+        start = len(self._prefix) + 1 if self._prefix else 0
+        index = self._lo
+        while index < self._hi:
+            norm_path = norm_paths[index]
+            sep_index = norm_path.find(os.sep, start)
+            if sep_index == -1:
+                yield (norm_path[start:], file_status_data[self._index.get_file_path(norm_path)])
+                index += 1
+            else:
+                yield (norm_path[start:sep_index], None)
+                index = bisect.bisect_left(norm_paths, norm_path[:sep_index] + _AFTER_SEP, index, self._hi)
+    def get_changed_file_paths(self, old_snapshot):
+        '''Return the (normalized) paths of the files whose data differs
+        between old_snapshot and this one'''
+        new_data = self._index.file_status_data
+        old_data = old_snapshot._index.file_status_data
+        changed = [file_path for file_path, data in new_data.iteritems() if old_data.get(file_path) != data]
+        changed += [file_path for file_path in old_data if file_path not in new_data]
+        norm_paths = []
+        for file_path in changed:
+            if _may_need_normalizing(file_path):
+                file_path = _normalized_dir_path(file_path)
+                if not file_path or file_path == os.pardir or file_path.startswith(os.pardir + os.sep):
+                    continue
+            norm_paths.append(file_path)
+        return norm_paths
     def narrowed_for_subdir(self, dir_path):
-        relevant_keys = [file_path for file_path in self._relevant_keys if file_path_belongs_here(file_path, dir_path)]
-        return self.__class__(self._file_status_data, relevant_keys)
+        prefix = _normalized_dir_path(dir_path)
+        lo, hi = self._index.get_range(prefix, self._lo, self._hi)
+        return self.__class__(None, self._index, prefix, lo, hi)
 
 class GenericSnapshotWsFileDb(GenericWsFileDb):
     class FileDir(GenericWsFileDb.FileDir):
@@ -236,48 +474,138 @@ class GenericSnapshotWsFileDb(GenericWsFileDb):
             for item in os.listdir(self._dir_path):
                 h.update(item)
             return h.digest()
-        def _populate(self):
+        def _list_entries(self):
+            # directories that only exist in the SCM's data (e.g. removed) have no listing
+            return list_dir_entries(self._dir_path) if self._exists else []
+        def _populate(self, listing):
             h = hashlib.sha1()
             files_dict = {}
-            for item in os.listdir(self._dir_path):
-                h.update(item)
-                dir_path = os.path.join(self._dir_path, item)
-                if os.path.isdir(dir_path):
+            h.update(''.join([item for item, _is_dir in listing]))
+            for item, is_dir in listing:
+                if is_dir:
+                    dir_path = os.path.join(self._dir_path, item)
                     self._add_subdir(name=item, dir_path=dir_path)
                 else:
                     files_dict[item] = Data(name=item, status=self.DEFAULT_FILE_STATUS, related_file_data=None)
-            for file_path, status, rfd in self._file_status_snapshot.iterate_data():
-                subdir, name = os.path.split(os.path.relpath(file_path, self._dir_path))
-                if subdir:
-                    while subdir:
-                        base_sub_dir = subdir
-                        subdir = os.path.dirname(subdir)
-                    if base_sub_dir not in self._subdirs:
-                        self._add_sub_dir(name=base_subdir, status=False)
+            for name, file_data in self._file_status_snapshot.iterate_contents():
+                if file_data is None:
+                    # e.g. a directory whose files have all been removed
+                    if name not in self._subdirs:
+                        self._add_subdir(name=name)
                 else:
-                    if rfd:
-                        rfd = RFD(path=os.path.relpath(rfd.path, self._dir_path), relation=rfd.relation)
-                    files_dict[name] = Data(name=name, status=status, related_file_data=rfd)
+                    files_dict[name] = self._get_file_data(name, file_data)
             # presort this data for multiple access efficiency
             self._files_data = sorted(files_dict.itervalues())
             self._subdirs_data = sorted([s.data for s in self._subdirs.itervalues()])
             self._is_populated = True
             return h.digest()
+        def _get_file_data(self, name, file_data):
+            status, rfd = file_data
+            if rfd:
+                rfd = RFD(path=os.path.relpath(rfd.path, self._dir_path), relation=rfd.relation)
+            return Data(name=name, status=status, related_file_data=rfd)
+        def _apply_delta(self, parent_file_status_snapshot, rel_path, changes, dirty_dir_paths):
+            '''Switch to the new snapshot and update the data for changed
+            files and subdirectories (changes maps directory paths to the
+            names of their changed entries).  The paths of directories whose
+            contents changed are added to dirty_dir_paths.  Return whether
+            this directory's own data changed.'''
+            self._file_status_snapshot = parent_file_status_snapshot.narrowed_for_subdir(self._dir_path)
+            changed_names = changes.get(rel_path)
+            if self._is_populated:
+                is_dirty = False
+                if changed_names:
+                    contents = dict(self._file_status_snapshot.iterate_contents())
+                    files_dict = dict((fdata.name, fdata) for fdata in self._files_data)
+                    for name in changed_names:
+                        if name in self._subdirs:
+                            continue
+                        if name in contents:
+                            if contents[name] is None:
+                                self._add_subdir(name=name)
+                            else:
+                                files_dict[name] = self._get_file_data(name, contents[name])
+                        elif os.path.exists(os.path.join(self._dir_path, name)):
+                            files_dict[name] = Data(name=name, status=self.DEFAULT_FILE_STATUS, related_file_data=None)
+                        else:
+                            files_dict.pop(name, None)
+                    files_data = sorted(files_dict.itervalues())
+                    if files_data != self._files_data:
+                        self._files_data = files_data
+                        is_dirty = True
+                # every existing subdirectory has to switch to the new snapshot
+                for name, subdir in self._subdirs.items():
+                    subdir._apply_delta(self._file_status_snapshot, os.path.join(rel_path, name), changes, dirty_dir_paths)
+                subdirs_data = sorted([s.data for s in self._subdirs.itervalues()])
+                if subdirs_data != self._subdirs_data:
+                    self._subdirs_data = subdirs_data
+                    is_dirty = True
+                if is_dirty:
+                    dirty_dir_paths.append(rel_path)
+            if changed_names and self.data is not None:
+                status = self._get_initial_status()
+                if status != self.data.status:
+                    self.data = Data(self.data.name, status, None)
+                    return True
+            return False
     def __init__(self, **kwargs):
-        h = hashlib.sha1()
-        self._file_status_snapshot = self._extract_file_status_snapshot(self._get_file_data_text(h))
-        self._db_digest = h.digest()
+        self._db_signature, self._file_status_snapshot, self._db_digest = self._get_snapshot_data()
         GenericWsFileDb.__init__(self, parent_file_status_snapshot=self._file_status_snapshot)
+    def _get_snapshot_data(self):
+        h = hashlib.sha1()
+        db_signature = self._get_db_signature()
+        snapshot = self._extract_file_status_snapshot(self._get_file_data_text(h))
+        return SnapshotData(db_signature, snapshot, h.digest())
+    def fetch_snapshot_data(self):
+        '''Return the SCM's current file status data for apply_delta() or
+        None if directory listings have changed and the db must be rebuilt.
+        This doesn't alter the db so it may be run in the background.'''
+        if not self.base_dir.is_current:
+            return None
+        return self._get_snapshot_data()
+    def apply_delta(self, new_snapshot_data):
+        '''Bring the db up to date with new_snapshot_data (from
+        fetch_snapshot_data()) by updating only the directories containing
+        files whose status has changed.  Return the paths of the (already
+        populated) directories whose contents have changed in top down
+        order.'''
+        db_signature, new_snapshot, db_digest = new_snapshot_data
+        if db_digest == self._db_digest:
+            self._db_signature = db_signature
+            return []
+        changes = {}
+        for norm_path in new_snapshot.get_changed_file_paths(self._file_status_snapshot):
+            dir_path, name = os.path.split(norm_path)
+            while True:
+                changes.setdefault(dir_path, set()).add(name)
+                if not dir_path:
+                    break
+                dir_path, name = os.path.split(dir_path)
+        dirty_dir_paths = []
+        # don't let a prefetch populate directories from the old snapshot meanwhile
+        with _POPULATE_LOCK:
+            self.base_dir._apply_delta(new_snapshot, '', changes, dirty_dir_paths)
+            self._db_signature, self._file_status_snapshot, self._db_digest = new_snapshot_data
+        dirty_dir_paths.sort(key=lambda dir_path: dir_path.count(os.sep) if dir_path else -1)
+        return dirty_dir_paths
     # NB the fetching of data is done in two steps to allow efficient "is_current" computation
     def _get_file_data_text(self, h):
         assert False, "_get_file_data_text() must be defined in child"
+    def _get_db_signature(self):
+        # children should return (cheaply obtained) data, e.g. the stat
+        # signatures of the SCM's state files, that changes with status
+        return None
     def _extract_file_status_snapshot(self, file_data_text):
         assert False, "_extract_file_status_snapshot() must be defined in child"
     @property
     def is_current(self):
+        # do the cheap checks first
+        if self._get_db_signature() != self._db_signature or not self.base_dir.is_current:
+            return False
+        # but only the SCM can tell if the contents of files have changed
         h = hashlib.sha1()
         self._get_file_data_text(h)
-        return h.digest() == self._db_digest and self.base_dir.is_current
+        return h.digest() == self._db_digest
 
 class GenericChangeFileDb(object):
     class FileDir(object):
@@ -338,6 +666,14 @@ class GenericChangeFileDb(object):
         h = hashlib.sha1()
         self._get_patch_data_text(h)
         return h.digest() == self._db_hash_digest
+    def fetch_snapshot_data(self):
+        # incremental update isn't supported so the db must be rebuilt
+        return None
+    def populate_all(self):
+        # the whole tree is built from the change data
+        pass
+    def prefetch(self, max_entries=None):
+        return 0
     def dir_contents(self, dirpath='', hide_clean=False, **kwargs):
         tdir = self._base_dir.find_dir(dirpath)
         if not tdir:
@@ -21,6 +21,8 @@ import pango
 from . import fsdb
 from . import utils
 from . import patchlib
+from . import patch_cache
+from . import hg_dirstate
 
 FSTATUS_MODIFIED = 'M'
 FSTATUS_ADDED = 'A'
@@ -52,6 +54,13 @@ def get_qparent():
     result = runext.run_cmd(["hg", "log", "--template", "{rev}", "-rqparent"])
     return result.stdout if result.ecode == 0 else None
 
+# the parent of the patch stack if patches are applied otherwise the
+# working directory's parent (so that this can be evaluated by the same
+# "hg status" invocation that uses it)
+_WS_BASE_REVSET = 'limit(present(qparent) + ., 1)'
+_MERGE_STATE_FILE = os.path.join('.hg', 'merge', 'state')
+_DIRSTATE_FILE = os.path.join('.hg', 'dirstate')
+
 def iterate_hg_file_data(patch_status_text, resolve_list_text=""):
     unresolved_file_set = set(line[2:] for line in resolve_list_text.splitlines() if line[0] == FSTATUS_UNRESOLVED)
     lines = iter(patch_status_text.splitlines())
@@ -95,14 +104,19 @@ class WsFileDb(fsdb.GenericSnapshotWsFileDb):
             elif FSTATUS_NOT_TRACKED in self._file_status_snapshot.status_set:
                 return FSTATUS_NOT_TRACKED
             return None
-    def __init__(self, **kwargs):
-        qparent = get_qparent()
-        self._cmd_rev = ["--rev", qparent] if qparent else []
-        fsdb.GenericSnapshotWsFileDb.__init__(self)
+    def _get_db_signature(self):
+        return (fsdb.get_stat_signature(_DIRSTATE_FILE), fsdb.get_stat_signature(_MERGE_STATE_FILE))
     def _get_file_data_text(self, h):
-        file_data_text = runext.run_cmd(["hg", "status", "-marduiC"] + self._cmd_rev).stdout
+        # the dirstate can't be used (None) if patches are applied or there's a merge
+        file_data_text = hg_dirstate.get_status_text()
+        if file_data_text is None:
+            file_data_text = runext.run_cmd(["hg", "status", "-marduiC", "--rev", _WS_BASE_REVSET]).stdout
         h.update(file_data_text)
-        unresolved_file_text = runext.run_cmd(["hg", "resolve", "--list"]).stdout
+        # there can only be unresolved files if there's a merge state
+        if os.path.exists(_MERGE_STATE_FILE):
+            unresolved_file_text = runext.run_cmd(["hg", "resolve", "--list"]).stdout
+        else:
+            unresolved_file_text = ""
         h.update(unresolved_file_text)
         return (file_data_text, unresolved_file_text)
     @staticmethod
@@ -162,10 +176,10 @@ PATCHLIB_TO_STATUS_MAP = {
     patchlib.FilePathPlus.EXTANT: FSTATUS_MODIFIED
 }
 
-def iterate_patchlib_file_data(patch_text):
-    if not patch_text:
+def iterate_patchlib_file_data(patch):
+    if patch is None:
         return
-    for fdata in patchlib.Patch.parse_text(patch_text).iterate_file_paths_plus(1):
+    for fdata in patch.get_file_paths_plus(1):
         yield (fdata.path, PATCHLIB_TO_STATUS_MAP[fdata.status], fdata.expath)
 
 class PatchFileDb(fsdb.GenericChangeFileDb):
@@ -173,7 +187,10 @@ class PatchFileDb(fsdb.GenericChangeFileDb):
     def __init__(self, patch_name):
         self._patch_name = patch_name
         self._is_applied = self._get_current_is_applied()
-        self._patch_file_path = os.path.join(".hg", "patches", patch_name)
+        # NB not imported at the top as ifce imports this module (via hg_mq_ifce)
+        from . import ifce
+        # this follows the current patch queue
+        self._patch_file_path = ifce.PM.get_patch_file_name(patch_name)
         fsdb.GenericChangeFileDb.__init__(self)
     @property
     def is_current(self):
@@ -181,7 +198,14 @@ class PatchFileDb(fsdb.GenericChangeFileDb):
             # somebody's popped or pushed externally
             return False
         h = hashlib.sha1()
-        self._get_patch_data_text(h)
+        if self._is_applied:
+            self._get_patch_data_text(h)
+        else:
+            # the patch's digest is all that's needed so don't parse it
+            try:
+                h.update(patch_cache.get_digest(self._patch_file_path))
+            except (IOError, OSError):
+                pass
         return h.digest() == self._db_hash_digest
     def _get_current_is_applied(self):
         result = runext.run_cmd(["hg", "qapplied"])
@@ -190,7 +214,13 @@ class PatchFileDb(fsdb.GenericChangeFileDb):
         if self._is_applied:
             patch_status_text = runext.run_cmd(["hg", "status", "-mardC", "--change", self._patch_name]).stdout
         else:
-            patch_status_text = utils.get_file_contents(self._patch_file_path)
+            # the (shared) parsed patch is only read
+            try:
+                digest, patch = patch_cache.get_digest_and_patch(self._patch_file_path)
+            except (IOError, OSError):
+                return None
+            h.update(digest)
+            return patch
         h.update(patch_status_text)
         return patch_status_text
     def _iterate_file_data(self, pdt):
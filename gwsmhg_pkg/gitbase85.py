@@ -16,7 +16,10 @@
 '''Encode/decode binary bytes to/from text strings using git's coding'''
 
 import collections
+import itertools
 import re
+import string
+import struct
 
 class Error(Exception): pass
 class ParseError(Error): pass
@@ -29,6 +32,14 @@ for index in range(len(ENCODE)):
     DECODE[ENCODE[index]] = index
 assert len(DECODE) == 85
 
+# Look up tables so that each 4 byte word is handled with a couple of divmod()s
+# and characters are converted to their values with a single str.translate()
+_ENCODE_PAIRS = [hi + lo for hi in ENCODE for lo in ENCODE]
+_INVALID = '\xff'
+_DECODE_TABLE = string.maketrans(ENCODE + ''.join(chr(i) for i in range(256) if chr(i) not in DECODE),
+    ''.join(chr(i) for i in range(85)) + _INVALID * (256 - 85))
+_85_3 = 85 * 85 * 85
+
 Encoding = collections.namedtuple('Encoding', ['string', 'size'])
 
 def is_consistent(encoding):
@@ -37,54 +48,35 @@ def is_consistent(encoding):
     max_bytes = (len(encoding.string) / 5) * 4
     return (max_bytes >= encoding.size) and (max_bytes - encoding.size < 4)
 
+def _encode_string(data):
+    '''Return the encoding of data (a str or bytearray) with the last
+    group padded with zeroes'''
+    num_words = (len(data) + 3) // 4
+    padded = bytes(data) + '\0' * (num_words * 4 - len(data))
+    pairs = _ENCODE_PAIRS
+    words = struct.unpack('>%dI' % num_words, padded)
+    return ''.join([pairs[word // _85_3] + pairs[word % _85_3 // 85] + ENCODE[word % 85] for word in words])
+
 def encode(data):
-    index = 0
-    estring = ''
-    size = len(data)
-    while index < size:
-        acc = 0
-        for cnt in (24, 16, 8, 0):
-            acc |= ord(data[index]) << cnt
-            index += 1
-            if index == size:
-                break
-        snippet = ''
-        for _cnt in range(5):
-            val = acc % 85
-            acc /= 85
-            snippet = ENCODE[val] + snippet
-        estring += snippet
-    return Encoding(estring, size)
+    return Encoding(_encode_string(data), len(data))
 
 _MAX_VAL = 0xFFFFFFFF
 
+def _decode_string(estring):
+    '''Return the bytes encoded in estring (whose length must be a multiple
+    of 5) including those that pad the last group'''
+    values = bytearray(estring.translate(_DECODE_TABLE))
+    if _INVALID in values:
+        raise ParseError(_('Illegal git base 85 character'))
+    groups = iter(values)
+    words = [(((a * 85 + b) * 85 + c) * 85 + d) * 85 + e for a, b, c, d, e in itertools.izip(groups, groups, groups, groups, groups)]
+    if words and max(words) > _MAX_VAL:
+        raise RangerError(_('{0} too big.').format(max(words)))
+    return struct.pack('>%dI' % len(words), *words)
+
 def decode(encoding):
     assert is_consistent(encoding)
-    data = bytearray(encoding.size)
-    dindex = 0
-    sindex = 0
-    while dindex < encoding.size:
-        acc = 0
-        for _cnt in range(5):
-            try:
-                acc = acc * 85 + DECODE[encoding.string[sindex]]
-            except KeyError:
-                raise ParseError(_('Illegal git base 85 character'))
-            sindex += 1
-        if acc > _MAX_VAL:
-            raise RangeError(_('{0} too big.').format(acc))
-        for _cnt in range(4):
-            if dindex == encoding.size:
-                break
-            acc = (acc << 8) | (acc >> 24)
-            data[dindex] = acc % 256
-            dindex += 1
-    return data
-
-# test over a range of data sizes
-_TESTDATA = _('uioyf2oyqo;3nhi8uydjauyo98ua 54\000jhkh\034hh;kjjh')
-for i in range(10):
-    assert decode(encode(_TESTDATA[i:])) == _TESTDATA[i:]
+    return bytearray(_decode_string(encoding.string)[:encoding.size])
 
 # Now encode/decode into/from text lines
 # Each 5-byte sequence of base-85 encodes up to 4 bytes,
@@ -93,38 +85,78 @@ for i in range(10):
 # to 52 bytes max.  The length byte 'A'-'Z' corresponds
 # to 1-26 bytes, and 'a'-'z' corresponds to 27-52 bytes.
 MAX_BYTES_PER_LINE = 52
+_SIZE_CHARS = string.ascii_uppercase + string.ascii_lowercase
+_CHAR_SIZES = dict((char, index + 1) for index, char in enumerate(_SIZE_CHARS))
+
 def encode_size(size):
     assert size <= MAX_BYTES_PER_LINE
-    return chr((size + ord('A') - 1) if size <=26 else (size + ord('a') - 26 - 1))
+    return _SIZE_CHARS[size - 1]
 
 def decode_size(char):
-    if 'A' <= char and char <= 'Z':
-        return ord(char) - ord('A') + 1
-    elif 'a' <= char and char <= 'z':
-        return ord(char) - ord('a') + 27
-    raise ValueError(_('decode_size: argument must be in [a-zA-Z]'))
+    try:
+        return _CHAR_SIZES[char]
+    except KeyError:
+        raise ValueError(_('decode_size: argument must be in [a-zA-Z]'))
 
-def encode_to_lines(data, max_line_length=1 + (MAX_BYTES_PER_LINE / 4) * 5):
+def iterate_encoded_lines(data, max_line_length=1 + (MAX_BYTES_PER_LINE / 4) * 5):
+    '''Generate the lines encoding data'''
     assert max_line_length > 5
     bytes_per_line = min(((max_line_length - 1) / 5) * 4, MAX_BYTES_PER_LINE)
-    index = 0
-    lines = []
-    while index < len(data):
-        encoding = encode(data[index:index + bytes_per_line])
-        lines.append('{0}{1}\n'.format(encode_size(encoding.size), encoding.string))
-        index += bytes_per_line
-    return lines
+    # lines (other than the last) hold whole groups so encode in one go
+    chunk_size = bytes_per_line * 1024
+    for chunk_start in range(0, len(data), chunk_size):
+        chunk = data[chunk_start:chunk_start + chunk_size]
+        estring = _encode_string(chunk)
+        chars_per_line = (bytes_per_line / 4) * 5
+        for index in range(0, len(chunk), bytes_per_line):
+            size = min(bytes_per_line, len(chunk) - index)
+            sindex = (index / 4) * 5
+            yield '{0}{1}\n'.format(_SIZE_CHARS[size - 1], estring[sindex:sindex + chars_per_line])
+
+def encode_to_lines(data, max_line_length=1 + (MAX_BYTES_PER_LINE / 4) * 5):
+    return list(iterate_encoded_lines(data, max_line_length))
 
 def decode_line(line):
     return decode(Encoding(line[1:].rstrip(), decode_size(line[0])))
 
+_LINES_PER_CHUNK = 1024
+
 def decode_lines(lines):
-    data = bytes()
-    for line in lines:
-        data += decode_line(line)
+    '''Return a bytearray containing the data encoded in lines (any
+    iterable).  Lines are decoded a chunk at a time.'''
+    data = bytearray()
+    lines = iter(lines)
+    while True:
+        chunk = list(itertools.islice(lines, _LINES_PER_CHUNK))
+        if not chunk:
+            break
+        sizes = []
+        strings = []
+        for line in chunk:
+            estring = line[1:].rstrip()
+            size = decode_size(line[0])
+            assert is_consistent(Encoding(estring, size))
+            sizes.append(size)
+            strings.append(estring)
+        decoded = _decode_string(''.join(strings))
+        dindex = 0
+        for size, estring in zip(sizes, strings):
+            data += decoded[dindex:dindex + size]
+            dindex += (len(estring) / 5) * 4
     return data
 
 LINE_CRE = re.compile('^([a-zA-Z])(([0-9a-zA-Z' + re.sub('-', '', ENCODE[62:]) + '-]{5})+)$')
 
-assert decode_lines(encode_to_lines(_TESTDATA * 10)) == _TESTDATA * 10
-
+def _self_test():
+    # test over a range of data sizes
+    test_data = 'uioyf2oyqo;3nhi8uydjauyo98ua 54\000jhkh\034hh;kjjh'
+    for i in range(10):
+        assert decode(encode(test_data[i:])) == test_data[i:]
+    for i in range(10):
+        assert decode_lines(encode_to_lines(test_data[i:] * 100)) == test_data[i:] * 100
+    assert decode_lines([]) == ''
+
+if __name__ == '__main__':
+    import __builtin__
+    __builtin__.__dict__.setdefault('_', lambda text: text)
+    _self_test()
@@ -0,0 +1,183 @@
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Run hg commands via a persistent Mercurial command server
+("hg serve --cmdserver pipe") rather than a new process per command'''
+
+import os
+import struct
+import subprocess
+import cStringIO
+import threading
+
+from . import cmd_result
+
+class ServerError(Exception): pass
+
+_HDR_FMT = '>cI'
+_HDR_SIZE = struct.calcsize(_HDR_FMT)
+_SERVER_CMD = ['hg', 'serve', '--cmdserver', 'pipe', '--config', 'ui.interactive=False']
+
+# commands that must not be run inside the (shared) server process
+_EXCLUDED_SUBCMDS = frozenset(['serve', 'init', 'clone'])
+
+def is_suitable(cmd):
+    '''Can the command (as a list of arguments) be run via the server?'''
+    if len(cmd) < 2 or cmd[0] != 'hg':
+        return False
+    # --cwd would change the server's working directory for all later commands
+    return cmd[1] not in _EXCLUDED_SUBCMDS and '--cwd' not in cmd
+
+class CmdServer(object):
+    def __init__(self, wd):
+        self.wd = wd
+        self._devnull = open(os.devnull, 'w')
+        try:
+            self._sub = subprocess.Popen(_SERVER_CMD, cwd=wd,
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=self._devnull, close_fds=os.name == 'posix')
+        except OSError as edata:
+            self._devnull.close()
+            raise ServerError(edata.strerror)
+        try:
+            channel, hello = self._read_message()
+        except ServerError:
+            self.close()
+            raise
+        capabilities = []
+        for line in hello.splitlines():
+            if line.startswith('capabilities:'):
+                capabilities = line.split()[1:]
+        if channel != 'o' or 'runcommand' not in capabilities:
+            self.close()
+            raise ServerError(_('hg command server does not support "runcommand"'))
+    def is_alive(self):
+        return self._sub is not None and self._sub.poll() is None
+    def close(self):
+        if self._sub is None:
+            return
+        try:
+            self._sub.stdin.close()
+            self._sub.wait()
+        except (IOError, OSError):
+            pass
+        self._sub = None
+        self._devnull.close()
+    def _read(self, size):
+        data = self._sub.stdout.read(size)
+        if len(data) != size:
+            raise ServerError(_('hg command server closed its output'))
+        return data
+    def _read_message(self):
+        channel, length = struct.unpack(_HDR_FMT, self._read(_HDR_SIZE))
+        if channel in 'IL':
+            # input requests carry the maximum size wanted rather than data
+            return channel, length
+        return channel, self._read(length)
+    def _write(self, data):
+        try:
+            self._sub.stdin.write(data)
+            self._sub.stdin.flush()
+        except (IOError, OSError) as edata:
+            raise ServerError(str(edata))
+    def run_command(self, args, input_text=None):
+        '''Run the hg command whose arguments (excluding "hg") are in args
+        and return a cmd_result.Result.  ServerError is raised if the exchange
+        with the server breaks down.
+        '''
+        instream = cStringIO.StringIO(input_text or '')
+        argstr = '\0'.join(args)
+        self._write('runcommand\n' + struct.pack('>I', len(argstr)) + argstr)
+        outd = []
+        errd = []
+        while True:
+            channel, data = self._read_message()
+            if channel == 'o':
+                outd.append(data)
+            elif channel == 'e':
+                errd.append(data)
+            elif channel == 'r':
+                ecode = struct.unpack('>i', data)[0]
+                return cmd_result.Result(ecode=ecode, stdout=''.join(outd), stderr=''.join(errd))
+            elif channel == 'I':
+                self._write_input(instream.read(data))
+            elif channel == 'L':
+                self._write_input(instream.readline(data))
+            elif channel.isupper():
+                # required channels that we don't understand are fatal
+                raise ServerError(_('hg command server: unexpected channel "{0}"').format(channel))
+    def _write_input(self, data):
+        self._write(struct.pack('>I', len(data)) + data)
+
+_SERVER = None
+_FAILED_WD = None
+# commands may be run from background threads (see bgnd) but the server
+# can only handle one at a time
+_LOCK = threading.RLock()
+
+def get_server():
+    '''Return a live command server for the current working directory
+    starting one if necessary or None if that isn't possible'''
+    global _SERVER, _FAILED_WD
+    with _LOCK:
+        wd = os.getcwd()
+        if _SERVER is not None:
+            if _SERVER.wd == wd and _SERVER.is_alive():
+                return _SERVER
+            _SERVER.close()
+            _SERVER = None
+        if wd == _FAILED_WD:
+            return None
+        try:
+            _SERVER = CmdServer(wd)
+            _FAILED_WD = None
+        except ServerError:
+            _FAILED_WD = wd
+        return _SERVER
+
+def run_cmd(cmd, input_text=None):
+    '''Run cmd via the command server.  Return None if the server isn't
+    available (or, in the main thread, is busy) so that the caller can
+    fall back to running a subprocess.'''
+    global _SERVER
+    # the GUI mustn't wait for a (possibly long) background command
+    if threading.current_thread().name == 'MainThread':
+        if not _LOCK.acquire(False):
+            return None
+    else:
+        _LOCK.acquire()
+    try:
+        server = get_server()
+        if server is None:
+            return None
+        try:
+            return server.run_command(cmd[1:], input_text)
+        except ServerError as edata:
+            # the command may have been partially executed so it's not safe
+            # to run it again: report the failure instead
+            server.close()
+            _SERVER = None
+            return cmd_result.Result(ecode=cmd_result.ERROR, stdout='', stderr=str(edata) + '\n')
+    finally:
+        _LOCK.release()
+
+def reset():
+    '''Shut down any running server and forget past failures'''
+    global _SERVER, _FAILED_WD
+    with _LOCK:
+        if _SERVER is not None:
+            _SERVER.close()
+            _SERVER = None
+        _FAILED_WD = None
@@ -0,0 +1,291 @@
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Work out the status of the files in a workspace from hg's (version 1)
+dirstate file and the files' sizes and modification times so that hg
+only has to be asked about files whose status can't be settled that way
+(and about new files which may or may not be ignored)'''
+
+import os
+import stat
+import struct
+import tempfile
+import threading
+import collections
+from multiprocessing.pool import ThreadPool
+
+from . import runext
+from . import cmd_result
+from . import options
+
+options.define('hg', 'dirstate_status', options.Defn(options.str_to_bool, False, _('Work out workspace file status from hg\'s dirstate (only asking hg about ambiguous and new files)')))
+
+_HG_DIR = '.hg'
+_DIRSTATE_FILE = os.path.join(_HG_DIR, 'dirstate')
+_REQUIRES_FILE = os.path.join(_HG_DIR, 'requires')
+_MERGE_STATE_FILE = os.path.join(_HG_DIR, 'merge', 'state')
+# files that can change what hg ignores
+_IGNORE_CONFIG_FILES = ['.hgignore', os.path.join(_HG_DIR, 'hgrc'), os.path.expanduser('~/.hgrc'), '/etc/mercurial/hgrc']
+
+_NULL_ID = '\0' * 20
+_ENTRY = struct.Struct('>cllll')
+# hg only records the low 31 bits of sizes and modification times
+_RANGE_MASK = 0x7fffffff
+
+# the order in which "hg status" lists files
+_STATUS_ORDER = 'MAR!?IC'
+
+# lstat() releases the GIL so this helps when it is slow (e.g. network file systems)
+NUM_STAT_THREADS = 4
+
+DirState = collections.namedtuple('DirState', ['parents', 'entries', 'copies'])
+
+def read_dirstate(file_path=_DIRSTATE_FILE):
+    '''Return the parsed contents of a version 1 dirstate file.  The
+    entries are (state, mode, size, mtime) tuples keyed by file path.'''
+    with open(file_path, 'rb') as fobj:
+        data = fobj.read()
+    if len(data) < 40:
+        raise ValueError('{0}: truncated dirstate'.format(file_path))
+    parents = (data[:20], data[20:40])
+    entries = {}
+    copies = {}
+    unpack_from = _ENTRY.unpack_from
+    index = 40
+    while index < len(data):
+        state, mode, size, mtime, length = unpack_from(data, index)
+        index += _ENTRY.size
+        name = data[index:index + length]
+        index += length
+        if '\0' in name:
+            name, source = name.split('\0')
+            copies[name] = source
+        entries[name] = (state, mode, size, mtime)
+    return DirState(parents, entries, copies)
+
+def _get_stat_signature(path):
+    try:
+        stat_data = os.stat(path)
+    except OSError:
+        return None
+    return (stat_data.st_ino, stat_data.st_size, stat_data.st_mtime)
+
+_QUEUE_FILES = None
+
+def _patches_are_applied():
+    # then hg status is relative to the queue's parent not the dirstate's
+    global _QUEUE_FILES
+    if _QUEUE_FILES is None:
+        # NB not imported at the top as it imports this module (via fsdb_hg_mq)
+        from . import hg_mq_ifce
+        _QUEUE_FILES = hg_mq_ifce._QueueFiles()
+    return len(_QUEUE_FILES.get_applied()) > 0
+
+def _dirstate_is_usable():
+    if not os.path.isfile(_DIRSTATE_FILE) or os.path.exists(_MERGE_STATE_FILE):
+        return False
+    try:
+        with open(_REQUIRES_FILE) as fobj:
+            if 'dirstate-v2' in fobj.read().split():
+                return False
+    except IOError:
+        pass
+    return not _patches_are_applied()
+
+def _list_dir(dir_path):
+    '''Return lists of (path, stat data) for the files and the paths of
+    the subdirectories (other than nested repositories) in dir_path.
+    Like the dirstate's keys, the paths are separated by '/' whatever
+    the platform.'''
+    files = []
+    subdirs = []
+    try:
+        names = os.listdir(dir_path if dir_path else os.curdir)
+    except OSError:
+        return files, subdirs
+    if dir_path:
+        prefix = dir_path + '/'
+    else:
+        prefix = ''
+        names = [name for name in names if name != _HG_DIR]
+    lstat = os.lstat
+    for name in names:
+        path = prefix + name
+        try:
+            stat_data = lstat(path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(stat_data.st_mode):
+            if not os.path.isdir(os.path.join(path, _HG_DIR)):
+                subdirs.append(path)
+        else:
+            files.append((path, stat_data))
+    return files, subdirs
+
+def _walk_workspace(pool):
+    '''Return a dictionary of the stat data of all files in the workspace.
+    Each level of directories is listed (and its contents lstat()ed) in
+    parallel.'''
+    file_stats = {}
+    dir_paths = ['']
+    while dir_paths:
+        next_dir_paths = []
+        for files, subdirs in pool.map(_list_dir, dir_paths, chunksize=16):
+            file_stats.update(files)
+            next_dir_paths.extend(subdirs)
+        dir_paths = next_dir_paths
+    return file_stats
+
+def _get_tracked_file_status(entry, stat_data, has_copy, dirstate_mtime):
+    '''Return the status of a tracked file or None if it can't be decided
+    without looking at its contents (the same rules as hg's)'''
+    state, mode, size, mtime = entry
+    if state == 'r':
+        return 'R'
+    if stat_data is None:
+        return '!'
+    if state == 'a':
+        return 'A'
+    if state == 'm' or size == -2 or has_copy:
+        return 'M'
+    # a negative size means the entry needs looking up so its size and
+    # mode aren't reliable either
+    if size >= 0:
+        st_size = stat_data.st_size
+        if size != st_size and size != st_size & _RANGE_MASK:
+            return 'M'
+        st_mode = stat_data.st_mode
+        if (mode ^ st_mode) & 0100 or stat.S_ISLNK(mode) != stat.S_ISLNK(st_mode):
+            return 'M'
+    st_mtime = int(stat_data.st_mtime)
+    if mtime != st_mtime and mtime != st_mtime & _RANGE_MASK:
+        return None
+    # the file may have been changed in the same second as it was recorded
+    if st_mtime >= dirstate_mtime:
+        return None
+    return 'C'
+
+def _parse_status_text(text):
+    statuses = {}
+    origins = {}
+    file_path = None
+    for line in text.splitlines():
+        if line[0] == ' ':
+            origins[file_path] = line[2:]
+        else:
+            file_path = line[2:]
+            statuses[file_path] = line[0]
+    return statuses, origins
+
+class StatusEngine(object):
+    '''Produce the output of "hg status -marduiC" for a workspace from its
+    dirstate.  The ignored or unknown status of untracked files is
+    remembered (until hg's ignore configuration changes) so that hg is
+    only run when there are ambiguous or new files.'''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._ignore_signature = None
+        self._untracked = {}
+    def _get_hg_statuses(self, file_paths):
+        if not file_paths:
+            return {}, {}
+        fd, list_file_path = tempfile.mkstemp(dir=_HG_DIR, prefix='gwsmhg.status.')
+        try:
+            with os.fdopen(fd, 'wb') as fobj:
+                fobj.write('\0'.join('path:' + file_path for file_path in file_paths))
+            result = runext.run_cmd(['hg', 'status', '-marduiC', 'listfile0:' + list_file_path])
+        finally:
+            os.remove(list_file_path)
+        if result.ecode != 0:
+            raise cmd_result.Failure(result)
+        return _parse_status_text(result.stdout)
+    def get_status_text(self):
+        '''Return the text that "hg status -marduiC" would produce or None
+        if the workspace's state can't be worked out from its dirstate'''
+        if not _dirstate_is_usable():
+            return None
+        with self._lock:
+            dirstate_mtime = int(os.path.getmtime(_DIRSTATE_FILE))
+            dirstate = read_dirstate()
+            if dirstate.parents[1] != _NULL_ID:
+                return None
+            ignore_signature = [_get_stat_signature(file_path) for file_path in _IGNORE_CONFIG_FILES]
+            if ignore_signature != self._ignore_signature:
+                self._untracked = {}
+                self._ignore_signature = ignore_signature
+            if self._pool is None:
+                self._pool = ThreadPool(NUM_STAT_THREADS)
+            file_stats = _walk_workspace(self._pool)
+            statuses = {}
+            origins = {}
+            ask_hg = []
+            copies = dirstate.copies
+            pop_stat_data = file_stats.pop
+            for file_path, entry in dirstate.entries.iteritems():
+                status = _get_tracked_file_status(entry, pop_stat_data(file_path, None), file_path in copies, dirstate_mtime)
+                if status is None:
+                    ask_hg.append(file_path)
+                else:
+                    statuses[file_path] = status
+                    if status == 'A' and file_path in copies:
+                        origins[file_path] = copies[file_path]
+            # what's left are the untracked files
+            untracked = {}
+            for file_path in file_stats:
+                status = self._untracked.get(file_path)
+                if status is None:
+                    ask_hg.append(file_path)
+                else:
+                    untracked[file_path] = status
+            hg_statuses, hg_origins = self._get_hg_statuses(ask_hg)
+            for file_path, status in hg_statuses.iteritems():
+                if file_path in file_stats and file_path not in dirstate.entries:
+                    untracked[file_path] = status
+            self._untracked = untracked
+            statuses.update(untracked)
+            statuses.update(hg_statuses)
+            origins.update(hg_origins)
+        file_paths_by_status = dict((status, []) for status in _STATUS_ORDER)
+        for file_path, status in statuses.iteritems():
+            file_paths_by_status[status].append(file_path)
+        lines = []
+        for status in _STATUS_ORDER:
+            for file_path in sorted(file_paths_by_status[status]):
+                lines.append(status + ' ' + file_path + '\n')
+                if file_path in origins:
+                    lines.append('  ' + origins[file_path] + '\n')
+        return ''.join(lines)
+
+_ENGINES = {}
+_ENGINES_LOCK = threading.Lock()
+
+def get_status_text():
+    '''Return the "hg status -marduiC" text for the current workspace via
+    its status engine or None if the option isn't set or the dirstate
+    can't be used (or read)'''
+    if not options.get('hg', 'dirstate_status'):
+        return None
+    root = os.getcwd()
+    with _ENGINES_LOCK:
+        if root not in _ENGINES:
+            _ENGINES[root] = StatusEngine()
+        engine = _ENGINES[root]
+    try:
+        return engine.get_status_text()
+    except (cmd_result.Failure, ValueError, struct.error, IOError, OSError):
+        # e.g. a dirstate that's corrupt or was rewritten while being read
+        # so leave it to the caller to ask hg
+        return None
@@ -25,7 +25,9 @@ from . import const
 from . import fsdb
 from . import fsdb_hg_mq
 from . import patchlib
+from . import patch_cache
 from . import runext
+from . import history_cache
 
 newlines_not_allowed_in_cmd = os.name == 'nt' or os.name == 'dos'
 
@@ -463,17 +465,13 @@ class SCMInterface(BaseInterface):
             plist.append(pdata)
         return plist
     def get_history_data(self, rev=None, maxitems=None):
-        if not self.get_root():
+        root = self.get_root()
+        if not root:
             return []
-        cmd = 'hg log --template "%s"' % self.cs_table_template
-        if maxitems:
-            if rev is not None:
-                rev2 = max(int(rev) - maxitems + 1, 0)
-                cmd += ' --rev %d:%d' % (int(rev), rev2)
-            else:
-                cmd += ' -l %d' % maxitems
-        elif rev is not None:
-            cmd += ' --rev %s' % rev
+        if rev is None or maxitems:
+            # a range of revisions so the cache can be used
+            return history_cache.get_cache(root).get_data(rev=rev, maxitems=maxitems)
+        cmd = 'hg log --template "%s" --rev %s' % (self.cs_table_template, rev)
         result = runext.run_cmd(cmd)
         if result.ecode != 0:
             raise cmd_result.Failure(result)
@@ -818,22 +816,85 @@ to the [extensions] section of your ~.hgrc file.  e.g.
 hgext.mq=
 '''
 
-_qguard_re = re.compile("^\s*([+-].*)\s*$")
+PatchData = collections.namedtuple('PatchData', ['name', 'state', 'guards'])
 
-def _extract_name_and_guards(string):
-    name, gstring = string.split(':', 1)
-    match = _qguard_re.match(gstring)
-    if match:
-        return name, match.group(1).split()
-    else:
-        return name, []
+# the same as mq uses to find the guards in a series file line's comment
+_series_guard_re = re.compile(r'\s?#([-+][^-+# \t\r\n\f][^# \t\r\n\f]*)')
 
-PatchData = collections.namedtuple('PatchData', ['name', 'state', 'guards'])
+def _parse_series(text):
+    series = []
+    for line in text.splitlines():
+        hash_index = line.find('#')
+        if hash_index == 0:
+            continue
+        elif hash_index == -1:
+            name, comment = line.strip(), ''
+        else:
+            name, comment = line[:hash_index].strip(), line[hash_index:]
+        if name:
+            series.append((name, _series_guard_re.findall(comment)))
+    return series
+
+def _parse_status(text):
+    return [line.split(':', 1)[1] for line in text.splitlines() if ':' in line]
+
+def _parse_guards(text):
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def _stat_signature(file_path):
+    try:
+        stat_data = os.stat(file_path)
+    except OSError:
+        return None
+    # mq rewrites these files (via rename) rather than editing them
+    return (stat_data.st_ino, stat_data.st_size, stat_data.st_mtime)
+
+class _QueueFiles(object):
+    '''Read the current patch queue's series, status and guards files
+    (rather than running hg qseries etc.) and only re-parse a file when
+    its stat signature changes'''
+    _PARSERS = {'series' : _parse_series, 'status' : _parse_status, 'guards' : _parse_guards}
+    def __init__(self):
+        self._cache = {}
+    @staticmethod
+    def get_patches_dir(hg_dir='.hg'):
+        try:
+            with open(os.path.join(hg_dir, 'patches.queue')) as fobj:
+                queue = fobj.read().strip()
+        except IOError:
+            queue = ''
+        return os.path.join(hg_dir, 'patches-' + queue if queue else 'patches')
+    def get_signature(self):
+        patches_dir = self.get_patches_dir()
+        return tuple([patches_dir] + [_stat_signature(os.path.join(patches_dir, name)) for name in sorted(self._PARSERS)])
+    def _get(self, name):
+        file_path = os.path.join(os.path.abspath(self.get_patches_dir()), name)
+        signature = _stat_signature(file_path)
+        cached = self._cache.get(file_path, None)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        text = ''
+        if signature is not None:
+            try:
+                with open(file_path, 'r') as fobj:
+                    text = fobj.read()
+            except IOError:
+                pass
+        data = self._PARSERS[name](text)
+        self._cache[file_path] = (signature, data)
+        return data
+    def get_series(self):
+        return self._get('series')
+    def get_applied(self):
+        return self._get('status')
+    def get_selected_guards(self):
+        return self._get('guards')
 
 class PMInterface(BaseInterface):
     def __init__(self):
         BaseInterface.__init__(self, "MQ")
         self._ws_update_mgr = _WsUpdateStateMgr()
+        self._queue_files = _QueueFiles()
         self.not_enabled_response = cmd_result.Result(cmd_result.ERROR, ENABLE_MQ_MSG, "")
         self._is_enabled = False
         self._enabled_checked_at = None
@@ -887,43 +948,29 @@ class PMInterface(BaseInterface):
             return False
         return (self.get_top_patch() is not None) or \
             self._ws_update_mgr.is_in_progress()
-    def get_all_patches_hash_digest(self):
-        import hashlib
-        h = hashlib.sha1()
-        h.update(runext.run_cmd('hg qguard -l').stdout)
-        h.update(runext.run_cmd('hg qselect').stdout)
-        return h.digest()
-    def get_all_patches_data(self, hashd=None):
+    def get_all_patches_signature(self):
+        '''Return a value that changes if the patch series, their guards,
+        which patches are applied or the selected guards change'''
+        return self._queue_files.get_signature()
+    def get_all_patches_data(self):
         output = []
         if not self.get_enabled():
             return output
-        result = runext.run_cmd('hg qguard -l')
-        if hashd:
-            hashd.update(result.stdout)
-        patch_plus_guard_list = result.stdout.splitlines()
-        applied_patches = self.get_applied_patches()
-        if len(applied_patches) > 0:
-            top_patch = applied_patches[-1]
-            for ppg in patch_plus_guard_list:
-                name, guards = _extract_name_and_guards(ppg)
-                if name in applied_patches:
-                    if name == top_patch:
-                        state = const.TOP_PATCH
-                    else:
-                        state = const.APPLIED
-                else:
-                    state = const.NOT_APPLIED
-                output.append(PatchData(name, state, guards))
-        else:
-            for ppg in patch_plus_guard_list:
-                name, guards = _extract_name_and_guards(ppg)
-                output.append(PatchData(name, const.NOT_APPLIED, guards))
+        applied_patches = self._queue_files.get_applied()
+        top_patch = applied_patches[-1] if applied_patches else None
+        for name, guards in self._queue_files.get_series():
+            if name == top_patch:
+                state = const.TOP_PATCH
+            elif name in applied_patches:
+                state = const.APPLIED
+            else:
+                state = const.NOT_APPLIED
+            output.append(PatchData(name, state, guards))
         return output
     def get_applied_patches(self):
         if not self.get_enabled():
             return []
-        result = runext.run_cmd('hg qapplied')
-        return result.stdout.splitlines() if result.ecode == 0 else []
+        return list(self._queue_files.get_applied())
     def get_unapplied_patches(self):
         if not self.get_enabled():
             return []
@@ -944,13 +991,8 @@ class PMInterface(BaseInterface):
             return []
         match = self._qguard_re.match(result.stdout.strip())
         return match.group(1).split() if match else []
-    def get_selected_guards(self, hashd=None):
-        result = runext.run_cmd('hg qselect')
-        if hashd:
-            hashd.update(result.stdout)
-        if result.ecode != 0 or result.stdout.strip() == "no active guards":
-            return []
-        return result.stdout.split()
+    def get_selected_guards(self):
+        return list(self._queue_files.get_selected_guards())
     def get_top_patch(self):
         result = runext.run_cmd('hg qtop')
         return result.stdout.strip() if result.ecode == 0 else None
@@ -1069,7 +1111,12 @@ class PMInterface(BaseInterface):
                 self._ws_update_mgr.set_state('merged')
         return result
     def get_patch_file_name(self, patch):
-        return os.path.join(os.getcwd(), '.hg', 'patches', patch)
+        return os.path.join(os.getcwd(), self._queue_files.get_patches_dir(), patch)
+    def get_patch_summaries(self, patches):
+        '''Return a list of patchlib.PatchSummary (or None if the patch's
+        file can't be parsed) for the named patches'''
+        store = patch_cache.get_summary_store(os.path.join(os.getcwd(), '.hg'))
+        return store.parse_series([self.get_patch_file_name(patch) for patch in patches])
     def get_patch_description(self, patch):
         if patch:
             pfn = self.get_patch_file_name(patch)
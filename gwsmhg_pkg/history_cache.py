@@ -0,0 +1,199 @@
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Keep a persistent (per repository) cache of the change set data
+displayed in history tables so that only new change sets need to be
+fetched from hg'''
+
+import os
+import re
+import time
+import marshal
+import threading
+
+from . import runext
+from . import cmd_result
+
+_FORMAT_VERSION = 1
+_CACHE_FILE_NAME = 'gwsmhg.history.cache'
+
+# only the immutable parts of a change set are cached ("age" and tags
+# aren't) and a ':' separated description has to come last
+_CS_TEMPLATE = '{rev}:{node}:{date|hgdate}:{branches}:{author|person}:{desc|firstline}\\n'
+_PROBE_TEMPLATE = '{rev}:{node}\\n'
+# tag names may contain spaces so match the "rev:node" at the end
+_TAGS_RE = re.compile('^(.*?)\s+(-?\d+):([0-9a-f]+)$')
+
+_AGE_SCALES = [
+    ('year', 3600 * 24 * 365),
+    ('month', 3600 * 24 * 30),
+    ('week', 3600 * 24 * 7),
+    ('day', 3600 * 24),
+    ('hour', 3600),
+    ('minute', 60),
+    ('second', 1),
+]
+
+def age(secs, tzoffset, now=None):
+    '''Return the same text as hg's "age" template filter'''
+    def fmt(name, count):
+        return '%d %s' % (count, name if count == 1 else name + 's')
+    if now is None:
+        now = time.time()
+    future = secs > now
+    delta = max(1, int(secs - now if future else now - secs))
+    if future:
+        if delta > _AGE_SCALES[0][1] * 30:
+            return 'in the distant future'
+    elif delta > _AGE_SCALES[0][1] * 2:
+        return time.strftime('%Y-%m-%d', time.gmtime(secs - tzoffset))
+    for name, scale in _AGE_SCALES:
+        count = delta // scale
+        if count >= 2 or scale == 1:
+            return '%s from now' % fmt(name, count) if future else '%s ago' % fmt(name, count)
+
+def _parse_cs_lines(text):
+    for line in text.splitlines():
+        rev, node, date, branches, author, descr = line.split(':', 5)
+        secs, tzoffset = date.split()
+        yield int(rev), (node, float(secs), int(tzoffset), branches, author, descr)
+
+class HistoryCache(object):
+    '''Change set data for a contiguous range of revisions (which is
+    extended as required) with entries of None for hidden revisions'''
+    def __init__(self, root):
+        self._file_path = os.path.join(root, '.hg', _CACHE_FILE_NAME)
+        self._lock = threading.RLock()
+        self._base_rev = 0
+        self._entries = []
+        self._load()
+    def _load(self):
+        try:
+            with open(self._file_path, 'rb') as fobj:
+                version, base_rev, entries = marshal.load(fobj)
+        except (IOError, EOFError, ValueError, TypeError):
+            return
+        if version == _FORMAT_VERSION:
+            self._base_rev = base_rev
+            self._entries = entries
+    def _save(self):
+        tmp_file_path = self._file_path + '.tmp'
+        try:
+            with open(tmp_file_path, 'wb') as fobj:
+                marshal.dump((_FORMAT_VERSION, self._base_rev, self._entries), fobj)
+            os.rename(tmp_file_path, self._file_path)
+        except (IOError, OSError):
+            pass
+    @property
+    def _top_rev(self):
+        return self._base_rev + len(self._entries) - 1
+    def _get_tip_and_validate(self):
+        '''Discard any cached entries that no longer match the repository
+        (e.g. after a strip or "hg qrefresh") and return the tip's revision.
+        Entries are checked at exponentially increasing distances from the
+        top so this takes a single hg invocation.'''
+        probe_revs = []
+        index = len(self._entries) - 1
+        step = 1
+        while index >= 0:
+            if self._entries[index] is not None:
+                probe_revs.append(self._base_rev + index)
+            index -= step
+            step *= 2
+        revset = ' + '.join(['tip'] + ['present(%d)' % rev for rev in probe_revs])
+        result = runext.run_cmd(['hg', 'log', '--template', _PROBE_TEMPLATE, '-r', revset])
+        if result.ecode != 0:
+            raise cmd_result.Failure(result)
+        nodes = {}
+        for line in result.stdout.splitlines():
+            rev, node = line.split(':')
+            nodes[int(rev)] = node
+        tip_rev = max(nodes) if nodes else -1
+        for rev in probe_revs:
+            if nodes.get(rev) == self._entries[rev - self._base_rev][0]:
+                del self._entries[rev - self._base_rev + 1:]
+                break
+        else:
+            self._entries = []
+        return tip_rev
+    def _fetch(self, hi_rev, lo_rev):
+        '''Fetch the (missing) entries from hi_rev down to lo_rev'''
+        result = runext.run_cmd(['hg', 'log', '--template', _CS_TEMPLATE, '-r', '%d:%d' % (hi_rev, lo_rev)])
+        if result.ecode != 0:
+            raise cmd_result.Failure(result)
+        fetched = [None] * (hi_rev - lo_rev + 1)
+        for rev, entry in _parse_cs_lines(result.stdout):
+            fetched[rev - lo_rev] = entry
+        if not self._entries:
+            self._base_rev = lo_rev
+            self._entries = fetched
+        elif lo_rev > self._top_rev:
+            self._entries.extend(fetched)
+        else:
+            self._entries[0:0] = fetched
+            self._base_rev = lo_rev
+    @staticmethod
+    def _get_tags_map():
+        result = runext.run_cmd(['hg', 'tags'])
+        if result.ecode != 0:
+            raise cmd_result.Failure(result)
+        tags_map = {}
+        for line in result.stdout.splitlines():
+            match = _TAGS_RE.match(line)
+            if match:
+                tags_map.setdefault(int(match.group(2)), []).append(match.group(1))
+        return tags_map
+    def get_data(self, rev=None, maxitems=None):
+        '''Return table rows for maxitems (all if None) revisions
+        starting at rev (or the tip if None) and working back'''
+        with self._lock:
+            tip_rev = self._get_tip_and_validate()
+            if tip_rev < 0:
+                return []
+            hi_rev = tip_rev if rev is None else min(int(rev), tip_rev)
+            lo_rev = 0 if not maxitems else max(hi_rev - maxitems + 1, 0)
+            changed = False
+            if self._entries and self._top_rev < tip_rev:
+                self._fetch(tip_rev, self._top_rev + 1)
+                changed = True
+            if not self._entries:
+                self._fetch(hi_rev, lo_rev)
+                changed = True
+            elif lo_rev < self._base_rev:
+                self._fetch(self._base_rev - 1, lo_rev)
+                changed = True
+            if changed:
+                self._save()
+            tags_map = self._get_tags_map()
+            now = time.time()
+            plist = []
+            for rev in range(hi_rev, lo_rev - 1, -1):
+                entry = self._entries[rev - self._base_rev]
+                if entry is None:
+                    continue
+                node, secs, tzoffset, branches, author, descr = entry
+                # in the order that "hg tags" lists them
+                tags = ' '.join(tags_map.get(rev, []))
+                plist.append([rev, node, age(secs, tzoffset, now), tags, branches, author, descr])
+            return plist
+
+_CACHES = {}
+_CACHES_LOCK = threading.Lock()
+
+def get_cache(root):
+    with _CACHES_LOCK:
+        if root not in _CACHES:
+            _CACHES[root] = HistoryCache(root)
+        return _CACHES[root]
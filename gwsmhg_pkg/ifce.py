@@ -18,6 +18,7 @@ in_valid_repo = False
 import os
 
 from . import hg_mq_ifce
+from . import hg_cmdserver
 
 from . import cmd_result
 from . import utils
@@ -61,11 +62,12 @@ def init(log_chdir=False):
     return result
 
 def close():
-    pass
+    hg_cmdserver.reset()
 
 def chdir(newdir=None):
     global in_valid_repo
     old_wd = os.getcwd()
+    hg_cmdserver.reset()
     retval = cmd_result.Result(cmd_result.OK, "", "")
     if newdir:
         try:
@@ -0,0 +1,223 @@
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Cache parsed patch files (in memory) and summaries of them (on disk)
+so that the same patch file isn't parsed over and over again'''
+
+import os
+import time
+import hashlib
+import marshal
+import threading
+import collections
+
+from . import patchlib
+
+# on some file systems modification times only have a resolution of a second
+_MTIME_RESOLUTION = 1.0
+
+def _get_stat_signature(path):
+    stat_data = os.stat(path)
+    return (stat_data.st_ino, stat_data.st_size, stat_data.st_mtime)
+
+_Entry = collections.namedtuple('_Entry', ['signature', 'checked_at', 'digest', 'patch', 'size'])
+
+class PatchCache(object):
+    '''A least recently used cache of patchlib.Patch objects parsed from
+    files.  Entries are valid while the file's stat signature is unchanged
+    and (when that's ambiguous or has changed) while the file's contents
+    have the same digest.  The patches returned are shared and MUST NOT be
+    modified.'''
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._entries = collections.OrderedDict()
+        self._total_bytes = 0
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+    def __len__(self):
+        return len(self._entries)
+    def _lookup(self, path, signature, now):
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return None, None
+        # NB the entry is accounted for again if it's put back
+        self._total_bytes -= entry.size
+        if entry.signature == signature and signature[2] + _MTIME_RESOLUTION <= entry.checked_at:
+            self._reinsert(path, entry)
+            return entry, None
+        # the file may have been rewritten (e.g. "hg qrefresh") without change
+        with open(path, 'rb') as fobj:
+            text = fobj.read()
+        if hashlib.sha1(text).digest() == entry.digest:
+            entry = entry._replace(signature=signature, checked_at=now)
+            self._reinsert(path, entry)
+            return entry, None
+        return None, text
+    def _reinsert(self, path, entry):
+        # as most recently used
+        self._entries[path] = entry
+        self._total_bytes += entry.size
+    def _insert(self, path, entry):
+        # patches that would hog the cache aren't kept
+        if entry.size > self.max_bytes // 4:
+            return
+        self._entries[path] = entry
+        self._total_bytes += entry.size
+        while self._total_bytes > self.max_bytes:
+            _path, old_entry = self._entries.popitem(last=False)
+            self._total_bytes -= old_entry.size
+            self.evictions += 1
+    def _get_entry(self, path):
+        with self._lock:
+            now = time.time()
+            signature = _get_stat_signature(path)
+            entry, text = self._lookup(path, signature, now)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            self.misses += 1
+            if text is None:
+                with open(path, 'rb') as fobj:
+                    text = fobj.read()
+            patch = patchlib.Patch.parse_text(text, lazy=True)
+            entry = _Entry(signature, now, hashlib.sha1(text).digest(), patch, len(text))
+            self._insert(path, entry)
+            return entry
+    def would_keep(self, path):
+        '''Would the patch in the file at path be kept in the cache?'''
+        try:
+            return os.path.getsize(path) <= self.max_bytes // 4
+        except OSError:
+            return False
+    def get_patch(self, path):
+        '''Return the (shared) Patch parsed from the file at path.
+        IOError and OSError are passed on.'''
+        return self._get_entry(path).patch
+    def get_digest_and_patch(self, path):
+        '''Return the digest of the contents of the file at path and the
+        (shared) Patch parsed from it'''
+        entry = self._get_entry(path)
+        return entry.digest, entry.patch
+    def get_digest(self, path):
+        '''Return the digest of the contents of the file at path (without
+        parsing it if it isn't in the cache)'''
+        with self._lock:
+            entry, text = self._lookup(path, _get_stat_signature(path), time.time())
+            if entry is not None:
+                return entry.digest
+        if text is None:
+            with open(path, 'rb') as fobj:
+                text = fobj.read()
+        return hashlib.sha1(text).digest()
+    def forget(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self._total_bytes -= entry.size
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+    def get_stats(self):
+        '''Return a dictionary of the cache's counters'''
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                entries=len(self._entries), total_bytes=self._total_bytes)
+
+CACHE = PatchCache()
+
+def get_patch(path):
+    return CACHE.get_patch(path)
+
+def get_digest_and_patch(path):
+    return CACHE.get_digest_and_patch(path)
+
+def get_digest(path):
+    return CACHE.get_digest(path)
+
+def forget(path):
+    CACHE.forget(path)
+
+_FORMAT_VERSION = 1
+_SUMMARY_FILE_NAME = 'gwsmhg.patch.summaries'
+
+def _summary_to_data(summary):
+    fpps = tuple((fpp.path, fpp.status, fpp.expath) for fpp in summary.file_paths_plus)
+    return (fpps, summary.diffstat, summary.tws_count, summary.hash_digest)
+
+def _summary_fm_data(data):
+    fpps, diffstat, tws_count, hash_digest = data
+    file_paths_plus = [patchlib.FilePathPlus(*fpp) for fpp in fpps]
+    return patchlib.PatchSummary(file_paths_plus, diffstat, tws_count, hash_digest)
+
+class SummaryStore(dict):
+    '''A persistent (per repository) version of the cache used by
+    patchlib.parse_series() so that a series of patches doesn't have to
+    be parsed again when the application is restarted'''
+    def __init__(self, hg_dir):
+        dict.__init__(self)
+        self._file_path = os.path.join(hg_dir, _SUMMARY_FILE_NAME)
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._load()
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._dirty = True
+    def _load(self):
+        try:
+            with open(self._file_path, 'rb') as fobj:
+                version, entries = marshal.load(fobj)
+        except (IOError, EOFError, ValueError, TypeError):
+            return
+        if version != _FORMAT_VERSION:
+            return
+        for path, (signature, data) in entries.items():
+            dict.__setitem__(self, path, (signature, _summary_fm_data(data)))
+    def save(self):
+        '''Write the summaries to disk if they've changed'''
+        with self._lock:
+            if not self._dirty:
+                return
+            # forget patches that have since been deleted
+            entries = dict((path, (signature, _summary_to_data(summary))) for path, (signature, summary) in self.items() if os.path.exists(path))
+            tmp_file_path = self._file_path + '.tmp'
+            try:
+                with open(tmp_file_path, 'wb') as fobj:
+                    marshal.dump((_FORMAT_VERSION, entries), fobj)
+                os.rename(tmp_file_path, self._file_path)
+                self._dirty = False
+            except (IOError, OSError):
+                pass
+    def parse_series(self, filepaths, strip_level=1):
+        '''Return patchlib.parse_series(filepaths, strip_level) using and
+        updating the stored summaries'''
+        with self._lock:
+            summaries = patchlib.parse_series(filepaths, strip_level, cache=self)
+            self.save()
+            return summaries
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+def get_summary_store(hg_dir):
+    with _STORES_LOCK:
+        if hg_dir not in _STORES:
+            _STORES[hg_dir] = SummaryStore(hg_dir)
+        return _STORES[hg_dir]
@@ -17,7 +17,6 @@ import collections
 import os
 import tempfile
 import re
-import hashlib
 
 import gtk
 import gobject
@@ -40,6 +39,7 @@ from . import actions
 from . import ws_actions
 from . import table
 from . import patch_view
+from . import bgnd
 
 def _markup_applied_patch(patch_name, guards, selected):
     markup = patch_name
@@ -72,6 +72,11 @@ def _markup_unapplied_patch(patch_name, guards, selected):
     markup = '<span foreground="darkgrey" style="italic">' + amarkup + '</span>'
     return (markup, appliable)
 
+def _markup_tws(markup, summary):
+    if summary is None or not summary.tws_count:
+        return markup
+    return markup + ' <span foreground="red">(%d TWS)</span>' % summary.tws_count
+
 def _patch_status_icon(status):
     if status != const.NOT_APPLIED:
         return icons.STOCK_APPLIED
@@ -242,7 +247,7 @@ class ListView(table.TableView):
     '''
     def __init__(self, busy_indicator=None, size_req=None):
         self.last_import_dir = None
-        self._hash_data = None
+        self._patches_signature = None
         table.TableView.__init__(self, busy_indicator=busy_indicator, size_req=size_req)
         # This callback is needed to process applied/unapplied status
         self.get_selection().connect('changed', self._selection_changed_cb)
@@ -369,30 +374,51 @@ class ListView(table.TableView):
     def _update_list_cb(self, _arg=None):
         self.refresh_contents()
     def _auto_update_list_cb(self, _arg=None):
-        if not self._hash_data or (self._hash_data.digest() != ifce.PM.get_all_patches_hash_digest()):
+        if self._patches_signature != ifce.PM.get_all_patches_signature():
             self.refresh_contents()
-    def _fetch_contents(self):
-        self._hash_data = hashlib.sha1()
-        patch_data_list = ifce.PM.get_all_patches_data(self._hash_data)
-        selected = ifce.PM.get_selected_guards(self._hash_data)
+    def _get_contents_and_condns(self, with_summaries=True):
+        # NB this doesn't touch GTK so that it can be run in the background
+        # taken first so that changes made while fetching aren't missed
+        self._patches_signature = ifce.PM.get_all_patches_signature()
+        patch_data_list = ifce.PM.get_all_patches_data()
+        selected = ifce.PM.get_selected_guards()
+        if with_summaries:
+            # these are cached so only changed patch files get parsed
+            summaries = ifce.PM.get_patch_summaries([patch_data.name for patch_data in patch_data_list])
+        else:
+            summaries = [None] * len(patch_data_list)
         unapplied_count = 0
         applied_count = 0
         contents = []
-        for patch_data in patch_data_list:
+        for patch_data, summary in zip(patch_data_list, summaries):
             icon = _patch_status_icon(patch_data.state)
             if patch_data.state is not const.NOT_APPLIED:
                 markup, dummy = _markup_applied_patch(patch_data.name, patch_data.guards, selected)
-                contents.append([patch_data.name, icon, markup])
+                contents.append([patch_data.name, icon, _markup_tws(markup, summary)])
                 applied_count += 1
             else:
                 markup, appliable = _markup_unapplied_patch(patch_data.name, patch_data.guards, selected)
-                contents.append([patch_data.name, icon, markup])
+                contents.append([patch_data.name, icon, _markup_tws(markup, summary)])
                 if appliable:
                     unapplied_count += 1
         condns = get_pushable_condns(unapplied_count)
         condns |= get_ws_update_condns(applied_count, unapplied_count)
+        return (contents, condns)
+    def _fetch_contents(self):
+        # parsing the patches (to flag trailing white space) is left to
+        # the background refresh started by set_contents()
+        contents, condns = self._get_contents_and_condns(with_summaries=False)
         self.action_groups.update_condns(condns)
         return contents
+    def set_contents(self):
+        table.TableView.set_contents(self)
+        self.refresh_contents()
+    def refresh_contents(self):
+        bgnd.submit(self, self._get_contents_and_condns, self._refresh_with_contents_and_condns, error_callback=self._bgnd_fetch_failed_cb)
+    def _refresh_with_contents_and_condns(self, contents_and_condns):
+        contents, condns = contents_and_condns
+        self._refresh_with_contents(contents)
+        self.action_groups.update_condns(condns)
     def repopulate_list(self):
         self.set_contents()
         condns = get_applied_condns(self.get_selection())
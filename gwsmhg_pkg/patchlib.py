@@ -21,6 +21,15 @@ import os
 import email
 import zlib
 import hashlib
+import multiprocessing
+import array
+import sys
+import subprocess
+import threading
+import cPickle
+import select
+import struct
+import time
 
 from . import gitbase85
 
@@ -72,9 +81,86 @@ def get_common_path(filelist):
     # rather than file path oriented (which is strange)
     return os.path.dirname(os.path.commonprefix(filelist))
 
-def _trim_trailing_ws(line):
-    '''Return the given line with any trailing white space removed'''
-    return re.sub('[ \t]+$', '', line)
+# Trailing white space (TWS) on added lines is found by searching whole
+# (multi line) texts for white space followed by a line end (which is
+# rare) rather than by examining each line
+_TWS_SPAN = collections.namedtuple('_TWS_SPAN', ['line_start', 'ws_start', 'ws_end'])
+_UNIFIED_ADDED_PREFIXES = ('+',)
+_CONTEXT_ADDED_PREFIXES = ('+ ', '! ')
+_UNIFIED_HUNK_AFTER_START_CRE = re.compile('@@\s+-\d+(,\d+)?\s+\+(\d+)')
+_UNIFIED_NOT_AFTER_LINE_CRE = re.compile('^[-\\\\]', re.M)
+
+def _find_added_tws(text, prefixes=_UNIFIED_ADDED_PREFIXES):
+    '''Return a list of _TWS_SPAN (in order) for the lines in text that
+    start with one of prefixes and end with white space'''
+    ws_ends = []
+    for tail in (' \n', '\t\n'):
+        index = text.find(tail)
+        while index != -1:
+            ws_ends.append(index + 1)
+            index = text.find(tail, index + 2)
+    if text.endswith((' ', '\t')):
+        ws_ends.append(len(text))
+    ws_ends.sort()
+    spans = []
+    keep_length = len(prefixes[0])
+    for ws_end in ws_ends:
+        line_start = text.rfind('\n', 0, ws_end) + 1
+        if not text.startswith(prefixes, line_start):
+            continue
+        ws_start = max(line_start + len(text[line_start:ws_end].rstrip(' \t')), line_start + keep_length)
+        if ws_start < ws_end:
+            spans.append(_TWS_SPAN(line_start, ws_start, ws_end))
+    return spans
+
+def _iter_added_tws(text, prefixes=_UNIFIED_ADDED_PREFIXES):
+    '''Generate (line index, _TWS_SPAN) for the added lines in text with TWS'''
+    line_index = 0
+    counted_to = 0
+    for span in _find_added_tws(text, prefixes):
+        line_index += text.count('\n', counted_to, span.line_start)
+        counted_to = span.line_start
+        yield (line_index, span)
+
+def _remove_tws(text, spans):
+    '''Return text with the white space in the (ordered) spans removed'''
+    pieces = []
+    kept_to = 0
+    for span in spans:
+        pieces.append(text[kept_to:span.ws_start])
+        kept_to = span.ws_end
+    pieces.append(text[kept_to:])
+    return ''.join(pieces)
+
+def _scan_unified_tws(text):
+    '''Return a list of ("after" line number, _TWS_SPAN) for the added lines
+    with TWS in text containing one or more unified diff hunks'''
+    results = []
+    hunk_starts_at = None
+    for span in _find_added_tws(text):
+        starts_at = text.rfind('\n@@', 0, span.line_start) + 1
+        if starts_at != hunk_starts_at:
+            hunk_starts_at = starts_at
+            after_start = int(_UNIFIED_HUNK_AFTER_START_CRE.match(text, starts_at).group(2))
+            after_count = 0
+            counted_to = text.find('\n', starts_at) + 1
+        num_lines = text.count('\n', counted_to, span.line_start)
+        num_not_after = len(_UNIFIED_NOT_AFTER_LINE_CRE.findall(text, counted_to, span.line_start))
+        after_count += num_lines - num_not_after + 1
+        counted_to = span.ws_end + 1
+        results.append((after_start + after_count - 1, span))
+    return results
+
+def _count_unified_stats(text):
+    '''Return the DiffStat.Stats for text containing unified diff hunks
+    (which always start with a "@@" line)'''
+    return DiffStat.Stats([text.count('\n+'), text.count('\n-'), 0, 0])
+
+def find_added_tws(text, context=False):
+    '''Return a list of (line index, column) pairs locating the trailing
+    white space on the added lines in the (unified or context) diff text'''
+    prefixes = _CONTEXT_ADDED_PREFIXES if context else _UNIFIED_ADDED_PREFIXES
+    return [(line_index, span.ws_start - span.line_start) for line_index, span in _iter_added_tws(text, prefixes)]
 
 class DiffStat(object):
     '''Class to encapsulate diffstat related code'''
@@ -90,6 +176,8 @@ class DiffStat(object):
     FSTATS_CRE = re.compile("^#? (\S+)\s*\|((binary)|(\s*(\d+)(\s+\+*-*\!*)?))$")
     BLANK_LINE_CRE = re.compile("^\s*$")
     DIVIDER_LINE_CRE = re.compile("^---$")
+    # the first characters of lines that can start a summary
+    SUMMARY_START_CHARS = frozenset('-# \t\r\n\f\v')
     @staticmethod
     def list_summary_starts_at(lines, index):
         '''Return True if lines[index] is the start of a valid "list" diffstat summary'''
@@ -108,33 +196,31 @@ class DiffStat(object):
         return False
     class Stats(object):
         '''Class to hold diffstat statistics.'''
-        def __init__(self):
-            self._counts = {}
-            for key in DiffStat._ORDERED_KEYS:
-                self._counts[key] = 0
-            assert len(self._counts) == len(DiffStat._ORDERED_KEYS)
+        __slots__ = ('_counts',)
+        _KEY_INDEX = dict((key, index) for index, key in enumerate(['inserted', 'deleted', 'modified', 'unchanged']))
+        def __init__(self, counts=None):
+            # counts are in the order of DiffStat._ORDERED_KEYS
+            self._counts = array.array('l', counts if counts is not None else [0] * len(DiffStat._ORDERED_KEYS))
         def __add__(self, other):
-            result = DiffStat.Stats()
-            for key in DiffStat._ORDERED_KEYS:
-                result._counts[key] = self._counts[key] + other._counts[key]
-            return result
+            return DiffStat.Stats([mine + theirs for mine, theirs in zip(self._counts, other._counts)])
         def __len__(self):
             return len(self._counts)
         def __getitem__(self, key):
             if isinstance(key, int):
                 key = DiffStat._ORDERED_KEYS[key]
-            return self._counts[key]
+            return self._counts[self._KEY_INDEX[key]]
         def get_total(self):
-            return sum(list(self))
+            return sum(self._counts)
         def get_total_changes(self):
-            return sum([self._counts[key] for key in ['inserted', 'deleted', 'modified']])
+            return sum([self[key] for key in ['inserted', 'deleted', 'modified']])
         def incr(self, key):
-            self._counts[key] += 1
-            return self._counts[key]
+            index = self._KEY_INDEX[key]
+            self._counts[index] += 1
+            return self._counts[index]
         def as_string(self, joiner=', ', prefix=', '):
             strings = []
             for key in DiffStat._ORDERED_KEYS:
-                num = self._counts[key]
+                num = self[key]
                 if num:
                     strings.append(DiffStat._FMT_DATA[key].format(num, '' if num == 1 else 's'))
             if strings:
@@ -144,11 +230,12 @@ class DiffStat(object):
         def as_bar(self, scale=lambda x: x):
             string = ''
             for key in DiffStat._ORDERED_KEYS:
-                count = scale(self._counts[key])
+                count = scale(self[key])
                 char = DiffStat._FMT_DATA[key][-2]
                 string += char * count
             return string
     class PathStats(object):
+        __slots__ = ('path', 'diff_stats')
         def __init__(self, path, diff_stats):
             self.path = path
             self.diff_stats = diff_stats
@@ -178,53 +265,97 @@ class DiffStat(object):
         def list_format_string(self, quiet=False, comment=False, trim_names=False, max_width=80):
             if len(self) == 0 and quiet:
                 return ''
-            string = ''
             if trim_names:
                 common_path = get_common_path([x.path for x in self])
                 offset = len(common_path)
             else:
                 offset = 0
             num_files = len(self)
-            summation = DiffStat.Stats()
+            # each file's total is needed twice so only get them once
+            totals = [x.diff_stats.get_total() for x in self]
+            summation = DiffStat.Stats([sum(counts) for counts in zip(*[x.diff_stats._counts for x in self])] if num_files else None)
+            parts = []
             if num_files > 0:
-                len_longest_name = max([len(x.path) for x in self]) - offset
-                fstr = '%s {0}{1} |{2:5} {3}\n' % ('#' if comment else '')
-                largest_total = max(max([x.diff_stats.get_total() for x in self]), 1)
+                names = [x.path[offset:] for x in self]
+                len_longest_name = max(len(name) for name in names)
+                fstr = '%s {0:<{1}} |{2:5} {3}\n' % ('#' if comment else '')
+                largest_total = max(max(totals), 1)
                 avail_width = max(0, max_width - (len_longest_name + 9))
                 if comment:
                     avail_width -= 1
                 scale = lambda x: (x * avail_width) / largest_total
-                for stats in self:
-                    summation += stats.diff_stats
-                    total = stats.diff_stats.get_total()
-                    name = stats.path[offset:]
-                    spaces = ' ' * (len_longest_name - len(name))
-                    string += fstr.format(name, spaces, total, stats.diff_stats.as_bar(scale))
+                for name, total, stats in zip(names, totals, self):
+                    parts.append(fstr.format(name, len_longest_name, total, stats.diff_stats.as_bar(scale)))
             if num_files > 0 or not quiet:
                 if comment:
-                    string += '#'
-                string += ' {0} file{1} changed'.format(num_files, '' if num_files == 1 else 's')
-                string += summation.as_string()
-                string += '\n'
-            return string
+                    parts.append('#')
+                parts.append(' {0} file{1} changed'.format(num_files, '' if num_files == 1 else 's'))
+                parts.append(summation.as_string())
+                parts.append('\n')
+            return ''.join(parts)
+
+_NEWLINE_LINE_CRE = re.compile('[^\n]*\n|[^\n]+')
+
+def split_lines(text):
+    '''Split text into lines (with their ends) at newlines only'''
+    return _NEWLINE_LINE_CRE.findall(text)
 
 class _Lines(object):
+    '''A sequence of lines held as a single string (rather than a list
+    of strings) as that takes a fraction of the memory.  The list is
+    regenerated when the lines property is accessed.'''
+    __slots__ = ('_text', '_line_ends')
     def __init__(self, contents=None):
+        self._line_ends = None
         if contents is None:
-            self.lines = list()
+            self._text = ''
         elif isinstance(contents, str):
+            self._text = ''
             self.lines = contents.splitlines(True)
         else:
-            self.lines = list(contents)
+            self.lines = contents
+    @property
+    def lines(self):
+        if self._line_ends is None:
+            return split_lines(self._text)
+        text = self._text
+        return [text[start:end] for start, end in zip([0] + self._line_ends.tolist(), self._line_ends)]
+    @lines.setter
+    def lines(self, lines):
+        lines = list(lines)
+        self._text = ''.join(lines)
+        # the ends only need to be kept if splitting at newlines won't reproduce
+        # the lines (i.e. a line other than the last ended with another separator)
+        num_newlines = self._text.count('\n')
+        if not lines or num_newlines == len(lines) - (0 if lines[-1].endswith('\n') else 1):
+            self._line_ends = None
+        else:
+            self._line_ends = array.array('l')
+            end = 0
+            for line in lines:
+                end += len(line)
+                self._line_ends.append(end)
     def __str__(self):
-        return ''.join(self.lines)
+        return self._text
+    def _replace_text(self, text):
+        if self._line_ends is None:
+            self._text = text
+        else:
+            self.lines = split_lines(text)
     def append(self, data):
         if isinstance(data, str):
-            self.lines += data.splitlines(True)
-        else:
-            self.lines += list(data)
+            data = data.splitlines(True)
+        data = list(data)
+        if self._line_ends is None and self._text.endswith('\n') or not self._text:
+            # avoid splitting and rejoining what's already here
+            extra = _Lines(data)
+            if extra._line_ends is None:
+                self._text += extra._text
+                return
+        self.lines = self.lines + data
 
 class Header(object):
+    __slots__ = ('comment_lines', 'description_lines', 'diffstat_lines')
     def __init__(self, text=''):
         lines = text.splitlines(True)
         descr_starts_at = 0
@@ -236,7 +367,7 @@ class Header(object):
         diffstat_starts_at = None
         index = descr_starts_at
         while index < len(lines):
-            if DiffStat.list_summary_starts_at(lines, index):
+            if lines[index][0] in DiffStat.SUMMARY_START_CHARS and DiffStat.list_summary_starts_at(lines, index):
                 diffstat_starts_at = index
                 break
             index += 1
@@ -289,6 +420,7 @@ def _file_data_consistent_with_strip_one(pair):
         return False
 
 class FilePathPlus(object):
+    __slots__ = ('path', 'status', 'expath')
     ADDED = '+'
     EXTANT = ' '
     DELETED = '-'
@@ -314,11 +446,14 @@ class FilePathPlus(object):
         return FilePathPlus(path=path, status=status, expath=None)
 
 class Preamble(_Lines):
+    __slots__ = ('preamble_type', 'file_data', 'extras')
     subtypes = list()
     @staticmethod
     def get_preamble_at(lines, index, raise_if_malformed, exclude_subtypes_in=set()):
+        line = lines[index]
         for subtype in Preamble.subtypes:
-            if subtype in exclude_subtypes_in:
+            # only try the parsers that could possibly match
+            if subtype in exclude_subtypes_in or not line.startswith(subtype.PREFIX):
                 continue
             preamble, next_index = subtype.get_preamble_at(lines, index, raise_if_malformed)
             if preamble is not None:
@@ -359,6 +494,8 @@ class Preamble(_Lines):
         return None
 
 class GitPreamble(Preamble):
+    __slots__ = ()
+    PREFIX = 'diff'
     DIFF_CRE = re.compile("^diff\s+--git\s+({0})\s+({1})$".format(_PATH_RE_STR, _PATH_RE_STR))
     EXTRAS_CRES = {
         'old mode' : re.compile('^(old mode)\s+(\d*)$'),
@@ -416,6 +553,8 @@ class GitPreamble(Preamble):
 Preamble.subtypes.append(GitPreamble)
 
 class DiffPreamble(Preamble):
+    __slots__ = ()
+    PREFIX = 'diff'
     CRE = re.compile('^diff(\s.+)\s+({0})\s+({1})$'.format(_PATH_RE_STR, _PATH_RE_STR))
     @staticmethod
     def get_preamble_at(lines, index, raise_if_malformed):
@@ -435,6 +574,8 @@ class DiffPreamble(Preamble):
 Preamble.subtypes.append(DiffPreamble)
 
 class IndexPreamble(Preamble):
+    __slots__ = ()
+    PREFIX = 'Index:'
     FILE_RCE = re.compile("^Index:\s+({0})(.*)$".format(_PATH_RE_STR))
     SEP_RCE = re.compile("^==*$")
     @staticmethod
@@ -525,6 +666,7 @@ class Preambles(list):
         return None
 
 class DiffHunk(_Lines):
+    __slots__ = ('before', 'after')
     def __init__(self, lines, before, after):
         _Lines.__init__(self, lines)
         self.before = before
@@ -537,6 +679,7 @@ class DiffHunk(_Lines):
         return list()
 
 class Diff(object):
+    __slots__ = ('header', 'diff_type', 'file_data', '_hunk_lines', '_hunks', '_diffstat')
     subtypes = list()
     @staticmethod
     def _get_file_data_at(cre, lines, index):
@@ -546,7 +689,7 @@ class Diff(object):
         filepath = match.group(2) if match.group(2) else match.group(3)
         return (_FILE_AND_TS(filepath, match.group(4)), index + 1)
     @staticmethod
-    def _get_diff_at(subtype, lines, start_index, raise_if_malformed=False):
+    def _get_diff_at(subtype, lines, start_index, raise_if_malformed=False, lazy=False):
         '''generic function that works for unified and context diffs'''
         if len(lines) - start_index < 2:
             return (None, start_index)
@@ -561,21 +704,40 @@ class Diff(object):
                 raise ParseError(_('Missing unified diff after file data.'), index)
             else:
                 return (None, start_index)
+        hunks_start_index = index
+        num_hunks = 0
         while index < len(lines):
-            hunk, index = subtype.get_hunk_at(lines, index)
-            if hunk is None:
-                break
-            hunks.append(hunk)
-        if len(hunks) == 0:
+            if lazy:
+                # just find where the hunk ends (it's parsed if/when needed)
+                next_index = subtype.skip_hunk_at(lines, index)
+                if next_index == index:
+                    break
+                index = next_index
+            else:
+                hunk, index = subtype.get_hunk_at(lines, index)
+                if hunk is None:
+                    break
+                hunks.append(hunk)
+            num_hunks += 1
+        if num_hunks == 0:
             if raise_if_malformed:
                 raise ParseError(_('Expected unified diff hunks not found.'), index)
             else:
                 return (None, start_index)
-        return (subtype(lines[start_index:start_index + 2], _PAIR(before_file_data, after_file_data), hunks), index)
+        file_data = _PAIR(before_file_data, after_file_data)
+        if lazy:
+            return (subtype(lines[start_index:start_index + 2], file_data, None, hunk_lines=lines[hunks_start_index:index]), index)
+        return (subtype(lines[start_index:start_index + 2], file_data, hunks), index)
     @staticmethod
-    def get_diff_at(lines, index, raise_if_malformed):
+    def get_diff_at(lines, index, raise_if_malformed, lazy=False):
+        if index >= len(lines):
+            return (None, index)
+        line = lines[index]
         for subtype in Diff.subtypes:
-            diff, next_index = subtype.get_diff_at(lines, index, raise_if_malformed)
+            # only try the parsers that could possibly match
+            if not line.startswith(subtype.PREFIX):
+                continue
+            diff, next_index = subtype.get_diff_at(lines, index, raise_if_malformed, lazy)
             if diff is not None:
                 return (diff, next_index)
         return (None, index)
@@ -590,13 +752,36 @@ class Diff(object):
     def parse_text(text):
         '''Parse text and return a valid DiffPlus or raise exception'''
         return Diff.parse_lines(text.splitlines(True))
-    def __init__(self, diff_type, lines, file_data, hunks):
+    def __init__(self, diff_type, lines, file_data, hunks, hunk_lines=None):
         self.header = _Lines(lines)
         self.diff_type = diff_type
         self.file_data = file_data
-        self.hunks = list() if hunks is None else hunks
+        # if we're given the hunks' lines they aren't parsed until needed
+        self._hunk_lines = None if hunk_lines is None else _Lines(hunk_lines)
+        self._hunks = list() if hunks is None and hunk_lines is None else hunks
+        # removing trailing white space doesn't change these
+        self._diffstat = None
+    @property
+    def hunks(self):
+        if self._hunks is None:
+            hunks = list()
+            index = 0
+            hunk_lines = self._hunk_lines.lines
+            while index < len(hunk_lines):
+                hunk, index = self.get_hunk_at(hunk_lines, index)
+                hunks.append(hunk)
+            self._hunks = hunks
+            self._hunk_lines = None
+        return self._hunks
+    @hunks.setter
+    def hunks(self, hunks):
+        self._hunks = hunks
+        self._hunk_lines = None
+        self._diffstat = None
     def __str__(self):
-        return str(self.header) + ''.join([str(hunk) for hunk in self.hunks])
+        if self._hunks is None:
+            return str(self.header) + str(self._hunk_lines)
+        return str(self.header) + ''.join([str(hunk) for hunk in self._hunks])
     def fix_trailing_whitespace(self):
         bad_lines = list()
         for hunk in self.hunks:
@@ -607,11 +792,16 @@ class Diff(object):
         for hunk in self.hunks:
             bad_lines += hunk.report_trailing_whitespace()
         return bad_lines
-    def get_diffstat_stats(self):
+    def _get_diffstat_stats(self):
         stats = DiffStat.Stats()
         for hunk in self.hunks:
             stats += hunk.get_diffstat_stats()
         return stats
+    def get_diffstat_stats(self):
+        if self._diffstat is None:
+            self._diffstat = self._get_diffstat_stats()
+        # a copy so that the cached stats can't be changed
+        return DiffStat.Stats(self._diffstat._counts)
     def get_file_path(self, strip_level=0):
         strip = gen_strip_level_function(strip_level)
         if isinstance(self.file_data, str):
@@ -630,40 +820,24 @@ class Diff(object):
             return None
 
 class UnifiedDiffHunk(DiffHunk):
+    __slots__ = ()
     def __init__(self, lines, before, after):
         DiffHunk.__init__(self, lines, before, after)
     def _process_tws(self, fix=False):
-        bad_lines = list()
-        after_count = 0
-        for index in range(len(self.lines)):
-            if self.lines[index].startswith('+'):
-                after_count += 1
-                repl_line = _trim_trailing_ws(self.lines[index])
-                if len(repl_line) != len(self.lines[index]):
-                    bad_lines.append(str(self.after.start + after_count - 1))
-                    if fix:
-                        self.lines[index] = repl_line
-            elif self.lines[index].startswith(' '):
-                after_count += 1
-            elif DEBUG and not self.lines[index].startswith('-'):
-                raise Bug('Unexpected end of unified diff hunk.')
-        return bad_lines
+        found = _scan_unified_tws(self._text)
+        if fix and found:
+            self._replace_text(_remove_tws(self._text, [span for _lineno, span in found]))
+        return [str(lineno) for lineno, _span in found]
     def get_diffstat_stats(self):
-        stats = DiffStat.Stats()
-        for index in range(len(self.lines)):
-            if self.lines[index].startswith('-'):
-                stats.incr('deleted')
-            elif self.lines[index].startswith('+'):
-                stats.incr('inserted')
-            elif DEBUG and not self.lines[index].startswith(' '):
-                raise Bug('Unexpected end of unified diff hunk.')
-        return stats
+        return _count_unified_stats(self._text)
     def fix_trailing_whitespace(self):
         return self._process_tws(fix=True)
     def report_trailing_whitespace(self):
         return self._process_tws(fix=False)
 
 class UnifiedDiff(Diff):
+    __slots__ = ()
+    PREFIX = '--- '
     BEFORE_FILE_CRE = re.compile('^--- ({0})(\s+{1})?(.*)$'.format(_PATH_RE_STR, _EITHER_TS_RE_STR))
     AFTER_FILE_CRE = re.compile('^\+\+\+ ({0})(\s+{1})?(.*)$'.format(_PATH_RE_STR, _EITHER_TS_RE_STR))
     HUNK_DATA_CRE = re.compile("^@@\s+-(\d+)(,(\d+))?\s+\+(\d+)(,(\d+))?\s+@@\s*(.*)$")
@@ -674,73 +848,97 @@ class UnifiedDiff(Diff):
     def get_after_file_data_at(lines, index):
         return Diff._get_file_data_at(UnifiedDiff.AFTER_FILE_CRE, lines, index)
     @staticmethod
-    def get_hunk_at(lines, index):
-        match = UnifiedDiff.HUNK_DATA_CRE.match(lines[index])
-        if not match:
-            return (None, index)
-        start_index = index
+    def _get_hunk_end(lines, index, match):
         before_length = int(match.group(3)) if match.group(3) is not None else 1
         after_length = int(match.group(6)) if match.group(6) is not None else 1
         index += 1
         before_count = after_count = 0
         try:
             while before_count < before_length or after_count < after_length:
-                if lines[index].startswith('-'):
+                # classify the line by its first character
+                first_char = lines[index][0]
+                if first_char == ' ':
                     before_count += 1
-                elif lines[index].startswith('+'):
                     after_count += 1
-                elif lines[index].startswith(' '):
+                elif first_char == '-':
                     before_count += 1
+                elif first_char == '+':
                     after_count += 1
-                elif not lines[index].startswith('\\'):
+                elif first_char != '\\':
                     raise ParseError(_('Unexpected end of unified diff hunk.'), index)
                 index += 1
             if index < len(lines) and lines[index].startswith('\\'):
                 index += 1
         except IndexError:
             raise ParseError(_('Unexpected end of patch text.'))
-        before_chunk = _CHUNK(int(match.group(1)), before_length)
-        after_chunk = _CHUNK(int(match.group(4)), after_length)
-        return (UnifiedDiffHunk(lines[start_index:index], before_chunk, after_chunk), index)
+        return index
+    @staticmethod
+    def skip_hunk_at(lines, index):
+        match = UnifiedDiff.HUNK_DATA_CRE.match(lines[index])
+        return UnifiedDiff._get_hunk_end(lines, index, match) if match else index
+    @staticmethod
+    def get_hunk_at(lines, index):
+        match = UnifiedDiff.HUNK_DATA_CRE.match(lines[index])
+        if not match:
+            return (None, index)
+        end_index = UnifiedDiff._get_hunk_end(lines, index, match)
+        before_chunk = _CHUNK(int(match.group(1)), int(match.group(3)) if match.group(3) is not None else 1)
+        after_chunk = _CHUNK(int(match.group(4)), int(match.group(6)) if match.group(6) is not None else 1)
+        return (UnifiedDiffHunk(lines[index:end_index], before_chunk, after_chunk), end_index)
     @staticmethod
-    def get_diff_at(lines, start_index, raise_if_malformed=False):
-        return Diff._get_diff_at(UnifiedDiff, lines, start_index, raise_if_malformed)
-    def __init__(self, lines, file_data, hunks):
-        Diff.__init__(self, 'unified', lines, file_data, hunks)
+    def get_diff_at(lines, start_index, raise_if_malformed=False, lazy=False):
+        return Diff._get_diff_at(UnifiedDiff, lines, start_index, raise_if_malformed, lazy)
+    def __init__(self, lines, file_data, hunks, hunk_lines=None):
+        Diff.__init__(self, 'unified', lines, file_data, hunks, hunk_lines)
+    def _get_diffstat_stats(self):
+        if self._hunks is None:
+            return _count_unified_stats(str(self._hunk_lines))
+        return Diff._get_diffstat_stats(self)
+    def _process_tws(self, fix=False):
+        # unparsed hunks are scanned (and fixed) as a whole
+        text = str(self._hunk_lines)
+        found = _scan_unified_tws(text)
+        if fix and found:
+            self._hunk_lines._replace_text(_remove_tws(text, [span for _lineno, span in found]))
+        return [str(lineno) for lineno, _span in found]
+    def fix_trailing_whitespace(self):
+        if self._hunks is None:
+            return self._process_tws(fix=True)
+        return Diff.fix_trailing_whitespace(self)
+    def report_trailing_whitespace(self):
+        if self._hunks is None:
+            return self._process_tws(fix=False)
+        return Diff.report_trailing_whitespace(self)
 
 Diff.subtypes.append(UnifiedDiff)
 
 class ContextDiffHunk(DiffHunk):
+    __slots__ = ()
     def __init__(self, lines, before, after):
         DiffHunk.__init__(self, lines, before, after)
     def _process_tws(self, fix=False):
-        bad_lines = list()
-        for index in range(self.after.offset + 1, self.after.offset + self.after.numlines):
-            if self.lines[index].startswith('+ ') or self.lines[index].startswith('! '):
-                repl_line = self.lines[index][:2] + _trim_trailing_ws(self.lines[index][2:])
-                after_count = index - (self.after.offset + 1)
-                if len(repl_line) != len(self.lines[index]):
-                    bad_lines.append(str(self.after.start + after_count))
-                    if fix:
-                        self.lines[index] = repl_line
-            elif DEBUG and not self.lines[index].startswith('  '):
-                raise Bug('Unexpected end of context diff hunk.')
-        return bad_lines
+        first_index = self.after.offset + 1
+        # "! " lines in the "before" part don't count
+        found = [(index, span) for index, span in _iter_added_tws(self._text, _CONTEXT_ADDED_PREFIXES) if index >= first_index]
+        if fix and found:
+            self._replace_text(_remove_tws(self._text, [span for _index, span in found]))
+        return [str(self.after.start + index - first_index) for index, _span in found]
     def get_diffstat_stats(self):
         stats = DiffStat.Stats()
+        lines = self.lines
         for index in range(self.before.offset + 1, self.before.offset + self.before.numlines):
-            if self.lines[index].startswith('- '):
+            if lines[index].startswith('- '):
                 stats.incr('deleted')
-            elif self.lines[index].startswith('! '):
+            elif lines[index].startswith('! '):
                 stats.incr('modified')
-            elif DEBUG and not self.lines[index].startswith('  '):
+            elif DEBUG and not lines[index].startswith('  '):
                 raise Bug('Unexpected end of context diff "before" hunk.')
         for index in range(self.after.offset + 1, self.after.offset + self.after.numlines):
-            if self.lines[index].startswith('+ '):
+            if lines[index].startswith('+ '):
                 stats.incr('inserted')
-            elif self.lines[index].startswith('! '):
+            elif lines[index].startswith('! '):
                 stats.incr('modified')
-            elif DEBUG and not self.lines[index].startswith('  '):
+            elif DEBUG and not lines[index].startswith('  '):
                 raise Bug('Unexpected end of context diff "after" hunk.')
         return stats
     def fix_trailing_whitespace(self):
@@ -749,6 +947,8 @@ class ContextDiffHunk(DiffHunk):
         return self._process_tws(fix=False)
 
 class ContextDiff(Diff):
+    __slots__ = ()
+    PREFIX = '*** '
     BEFORE_FILE_CRE = re.compile('^\*\*\* ({0})(\s+{1})?$'.format(_PATH_RE_STR, _EITHER_TS_RE_STR))
     AFTER_FILE_CRE = re.compile('^--- ({0})(\s+{1})?$'.format(_PATH_RE_STR, _EITHER_TS_RE_STR))
     HUNK_START_CRE = re.compile('^\*{15}\s*(.*)$')
@@ -809,7 +1009,8 @@ class ContextDiff(Diff):
                 if after_chunk is None:
                     raise ParseError(_('Failed to find context diff "after" hunk.'), index)
             while after_count < after_chunk.length:
-                if not lines[index].startswith(('! ', '+ ', '  ')):
+                # a hunk that only deletes lines has no "after" lines and may be the last of its lines
+                if index >= len(lines) or not lines[index].startswith(('! ', '+ ', '  ')):
                     if after_count == 0:
                         break
                     raise ParseError(_('Unexpected end of context diff hunk.'), index)
@@ -824,20 +1025,33 @@ class ContextDiff(Diff):
         after_hunk = _HUNK(after_start_index - start_index, after_chunk.start, after_chunk.length, index - after_start_index)
         return (ContextDiffHunk(lines[start_index:index], before_hunk, after_hunk), index)
     @staticmethod
-    def get_diff_at(lines, start_index, raise_if_malformed=False):
-        return Diff._get_diff_at(ContextDiff, lines, start_index, raise_if_malformed)
-    def __init__(self, lines, file_data, hunks):
-        Diff.__init__(self, 'context', lines, file_data, hunks)
+    def skip_hunk_at(lines, index):
+        return ContextDiff.get_hunk_at(lines, index)[1]
+    @staticmethod
+    def get_diff_at(lines, start_index, raise_if_malformed=False, lazy=False):
+        return Diff._get_diff_at(ContextDiff, lines, start_index, raise_if_malformed, lazy)
+    def __init__(self, lines, file_data, hunks, hunk_lines=None):
+        Diff.__init__(self, 'context', lines, file_data, hunks, hunk_lines)
 
 Diff.subtypes.append(ContextDiff)
 
 class GitBinaryDiffData(_Lines):
+    __slots__ = ('method', 'size_raw', '_data_zipped')
     LITERAL, DELTA = ('literal', 'delta')
-    def __init__(self, lines, method, size_raw, data_zipped):
+    def __init__(self, lines, method, size_raw, data_zipped=None):
         _Lines.__init__(self, lines)
         self.method = method
         self.size_raw = size_raw
-        self.data_zipped = data_zipped
+        # if data_zipped isn't supplied the lines are decoded when it's needed
+        self._data_zipped = data_zipped
+    @property
+    def data_zipped(self):
+        if self._data_zipped is None:
+            data_lines = self.lines[1:]
+            if data_lines and GitBinaryDiff.BLANK_LINE_CRE.match(data_lines[-1]):
+                data_lines = data_lines[:-1]
+            self._data_zipped = GitBinaryDiff.decode_data(data_lines, self.size_raw)
+        return self._data_zipped
     @property
     def size_zipped(self):
         return len(self.data_zipped)
@@ -846,12 +1060,24 @@ class GitBinaryDiffData(_Lines):
         return zlib.decompress(bytes(self.data_zipped))
 
 class GitBinaryDiff(Diff):
+    __slots__ = ('forward', 'reverse')
+    PREFIX = 'GIT binary patch'
     START_CRE = re.compile('^GIT binary patch$')
     DATA_START_CRE = re.compile('^(literal|delta) (\d+)$')
     DATA_LINE_CRE = gitbase85.LINE_CRE
     BLANK_LINE_CRE = re.compile("^\s*$")
     @staticmethod
-    def get_data_at(lines, start_index):
+    def decode_data(data_lines, size, lineno=None):
+        try:
+            data_zipped = gitbase85.decode_lines(data_lines)
+        except AssertionError:
+            raise DataError('Inconsistent git binary patch data.', lineno=lineno)
+        raw_size = len(zlib.decompress(bytes(data_zipped)))
+        if raw_size != size:
+            raise DataError(_('Git binary patch expected {0} bytes. Got {1} bytes.'.format(size, raw_size)), lineno=lineno)
+        return data_zipped
+    @staticmethod
+    def get_data_at(lines, start_index, lazy=False):
         smatch = False if start_index >= len(lines) else GitBinaryDiff.DATA_START_CRE.match(lines[start_index])
         if not smatch:
             return (None, start_index)
@@ -868,22 +1094,18 @@ class GitBinaryDiff(Diff):
         else:
             has_blank = False
         dlines = lines[start_index:index]
-        try:
-            data_zipped = gitbase85.decode_lines(lines[start_index + 1:end_data])
-        except AssertionError:
-            raise DataError('Inconsistent git binary patch data.', lineno=start_index)
-        raw_size = len(zlib.decompress(bytes(data_zipped)))
-        if raw_size != size:
-            raise DataError(_('Git binary patch expected {0} bytes. Got {1} bytes.'.format(size, raw_size)), lineno=start_index)
-        return (GitBinaryDiffData(dlines, method, raw_size, data_zipped), index)
+        if lazy:
+            return (GitBinaryDiffData(dlines, method, size), index)
+        data_zipped = GitBinaryDiff.decode_data(lines[start_index + 1:end_data], size, lineno=start_index)
+        return (GitBinaryDiffData(dlines, method, size, data_zipped), index)
     @staticmethod
-    def get_diff_at(lines, start_index, raise_if_malformed=True):
+    def get_diff_at(lines, start_index, raise_if_malformed=True, lazy=False):
         if not GitBinaryDiff.START_CRE.match(lines[start_index]):
             return (None, start_index)
-        forward, index = GitBinaryDiff.get_data_at(lines, start_index + 1)
+        forward, index = GitBinaryDiff.get_data_at(lines, start_index + 1, lazy)
         if forward is None and raise_if_malformed:
             raise ParseError(_('No content in GIT binary patch text.'))
-        reverse, index = GitBinaryDiff.get_data_at(lines, index)
+        reverse, index = GitBinaryDiff.get_data_at(lines, index, lazy)
         return (GitBinaryDiff(lines[start_index:index], forward, reverse), index)
     def __init__(self, lines, forward, reverse):
         Diff.__init__(self, 'git_binary', lines, None, None)
@@ -895,15 +1117,19 @@ Diff.subtypes.append(GitBinaryDiff)
 class DiffPlus(object):
     '''Class to hold diff (headerless) information relavent to a single file.
     Includes (optional) preambles and trailing junk such as quilt's separators.'''
+    # the line starting a diff plus must start with one of these
+    START_PREFIXES = tuple(set(subtype.PREFIX for subtype in Preamble.subtypes + Diff.subtypes))
     @staticmethod
-    def get_diff_plus_at(lines, start_index, raise_if_malformed=False):
+    def get_diff_plus_at(lines, start_index, raise_if_malformed=False, lazy=False):
+        if start_index >= len(lines) or not lines[start_index].startswith(DiffPlus.START_PREFIXES):
+            return (None, start_index)
         preambles, index = Preambles.get_preambles_at(lines, start_index, raise_if_malformed)
         if index >= len(lines):
             if preambles:
                 return (DiffPlus(preambles, None), index)
             else:
                 return (None, start_index)
-        diff_data, index = Diff.get_diff_at(lines, index, raise_if_malformed)
+        diff_data, index = Diff.get_diff_at(lines, index, raise_if_malformed, lazy)
         if not diff_data:
             if preambles:
                 return (DiffPlus(preambles, None), index)
@@ -964,12 +1190,108 @@ class DiffPlus(object):
         h.update(str(self))
         return h.digest()
 
+class _LineWindow(object):
+    '''A sequence of the lines read (on demand) from a file object or an
+    mmap (anything with a readline() method) for use by the parsers.
+    Only the lines from the last point "forgotten" up to one beyond the
+    highest index accessed are held in memory.'''
+    def __init__(self, source):
+        self._readline = source.readline
+        self._base = 0
+        self._lines = list()
+        self._base_offset = 0
+        self._end_offset = 0
+        self._high = -1
+        self._eof = False
+    def _load_to(self, index):
+        while not self._eof and self._base + len(self._lines) <= index:
+            line = self._readline()
+            if line:
+                self._lines.append(line)
+                self._end_offset += len(line)
+            else:
+                self._eof = True
+    def offset_of(self, index):
+        '''Return the offset in the source of the start of the line at
+        index (or of the end of the source if index is the number of lines)'''
+        if index < self._base:
+            raise Bug('Line {0} has already been discarded.'.format(index))
+        self._load_to(index)
+        if index == self._base + len(self._lines):
+            return self._end_offset
+        return self._base_offset + sum(len(line) for line in self._lines[:index - self._base])
+    def __len__(self):
+        # the parsers only ever look one line beyond where they've been
+        self._load_to(self._high + 1)
+        return self._base + len(self._lines)
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start = self._base if key.start is None else key.start
+            self._load_to(self._high + 1 if key.stop is None else key.stop - 1)
+            stop = self._base + len(self._lines) if key.stop is None else key.stop
+            if start < self._base:
+                raise Bug('Line {0} has already been discarded.'.format(start))
+            return self._lines[start - self._base:stop - self._base]
+        if key < self._base:
+            raise Bug('Line {0} has already been discarded.'.format(key))
+        self._load_to(key)
+        self._high = max(self._high, key)
+        try:
+            return self._lines[key - self._base]
+        except IndexError:
+            raise IndexError(key)
+    def forget_before(self, index):
+        if index > self._base:
+            self._base_offset = self.offset_of(index)
+            del self._lines[:index - self._base]
+            self._base = index
+
+def iterate_diff_plus_spans(source, header_lines=None, lazy=False):
+    '''Parse the patch read from source (a file object or an mmap) and
+    yield (DiffPlus, start offset, end offset) for its diffs one at a
+    time (as soon as it's certain that they're complete).  The offsets
+    delimit the diff's text (including any trailing junk) in source.
+    The lines preceding the first diff are appended to header_lines (if
+    not None).  If lazy is True the diffs' hunks aren't parsed until
+    they're needed.'''
+    lines = _LineWindow(source)
+    index = 0
+    last_diff_plus = None
+    while index < len(lines):
+        diff_plus, next_index = DiffPlus.get_diff_plus_at(lines, index, last_diff_plus is not None, lazy)
+        if diff_plus:
+            starts_at = lines.offset_of(index)
+            if last_diff_plus:
+                yield (last_diff_plus, last_starts_at, starts_at)
+            last_diff_plus = diff_plus
+            last_starts_at = starts_at
+            index = next_index
+        else:
+            if last_diff_plus:
+                last_diff_plus.trailing_junk.append(lines[index])
+            elif header_lines is not None:
+                header_lines.append(lines[index])
+            index += 1
+        lines.forget_before(index)
+    if last_diff_plus:
+        yield (last_diff_plus, last_starts_at, lines.offset_of(index))
+
+def iterate_diff_pluses(source, header_lines=None, lazy=False):
+    '''Parse the patch read from source (a file object or an mmap) and
+    yield its DiffPlus objects one at a time (as soon as it's certain
+    that they're complete).  The lines preceding the first diff are
+    appended to header_lines (if not None).  If lazy is True the diffs'
+    hunks aren't parsed until they're needed.'''
+    for diff_plus, _starts_at, _ends_at in iterate_diff_plus_spans(source, header_lines, lazy):
+        yield diff_plus
+
 class Patch(object):
     '''Class to hold patch information relavent to multiple files with
     an optional header (or a single file with a header).'''
     @staticmethod
-    def parse_lines(lines, num_strip_levels=0):
-        '''Parse list of lines and return a Patch instance'''
+    def parse_lines(lines, num_strip_levels=0, lazy=False):
+        '''Parse list of lines and return a Patch instance.  If lazy is
+        True the diffs' hunks aren't parsed until they're needed'''
         diff_starts_at = None
         diff_pluses = list()
         index = 0
@@ -977,7 +1299,7 @@ class Patch(object):
         while index < len(lines):
             raise_if_malformed = diff_starts_at is not None
             starts_at = index
-            diff_plus, index = DiffPlus.get_diff_plus_at(lines, index, raise_if_malformed)
+            diff_plus, index = DiffPlus.get_diff_plus_at(lines, index, raise_if_malformed, lazy)
             if diff_plus:
                 if diff_starts_at is None:
                     diff_starts_at = starts_at
@@ -992,9 +1314,18 @@ class Patch(object):
         patch.set_header(''.join(lines[0:diff_starts_at]))
         return patch
     @staticmethod
-    def parse_text(text, num_strip_levels=0):
+    def parse_text(text, num_strip_levels=0, lazy=False):
         '''Parse text and return a Patch instance.'''
-        return Patch.parse_lines(text.splitlines(True), num_strip_levels=num_strip_levels)
+        return Patch.parse_lines(text.splitlines(True), num_strip_levels=num_strip_levels, lazy=lazy)
+    @staticmethod
+    def parse_stream(source, num_strip_levels=0, lazy=False):
+        '''Parse the patch read from source (a file object or an mmap)
+        without first reading it all into memory and return a Patch instance.'''
+        header_lines = list()
+        patch = Patch(num_strip_levels=num_strip_levels)
+        patch.diff_pluses = list(iterate_diff_pluses(source, header_lines, lazy))
+        patch.set_header(''.join(header_lines))
+        return patch
     @staticmethod
     def parse_email_text(text, num_strip_levels=0):
         '''Parse email text and return a Patch instance.'''
@@ -1013,7 +1344,8 @@ class Patch(object):
     @staticmethod
     def parse_text_file(filepath, num_strip_levels=0):
         '''Parse a text file and return a Patch instance.'''
-        patch = Patch.parse_text(open(filepath).read(), num_strip_levels=num_strip_levels)
+        with open(filepath) as fobj:
+            patch = Patch.parse_stream(fobj, num_strip_levels=num_strip_levels)
         patch.source_name = filepath
         return patch
     @staticmethod
@@ -1125,3 +1457,208 @@ class Patch(object):
         h = hashlib.sha1()
         h.update(str(self))
         return h.digest()
+
+# Lightweight (and picklable) summary of a patch file's contents
+# (diffstat is a tuple of (path, inserted, deleted, modified, unchanged) tuples)
+PatchSummary = collections.namedtuple('PatchSummary', ['file_paths_plus', 'diffstat', 'tws_count', 'hash_digest'])
+
+def summarize_patch_file(filepath, strip_level=1):
+    '''Parse the patch file and return a PatchSummary of its contents'''
+    with open(filepath) as fobj:
+        patch = Patch.parse_stream(fobj, num_strip_levels=strip_level, lazy=True)
+    diffstat = tuple((path_stats.path,) + tuple(path_stats.diff_stats) for path_stats in patch.get_diffstat_stats())
+    tws_count = sum(len(report.tws_lines) for report in patch.report_trailing_whitespace())
+    return PatchSummary(patch.get_file_paths_plus(), diffstat, tws_count, patch.get_hash_digest())
+
+def _summarize_patch_file_or_none(args):
+    # run in worker processes so exceptions (which may not pickle) are absorbed
+    try:
+        return summarize_patch_file(*args)
+    except (IOError, ParseError, TooMayStripLevels):
+        return None
+
+def _run_summary_worker():
+    '''Read pickled lists of summarize_patch_file() arguments from stdin
+    and write the pickled lists of results to stdout until EOF'''
+    while True:
+        try:
+            args_list = cPickle.load(sys.stdin)
+        except EOFError:
+            return
+        data = cPickle.dumps([_summarize_patch_file_or_none(args) for args in args_list], cPickle.HIGHEST_PROTOCOL)
+        sys.stdout.write(_WORKER_REPLY_LENGTH.pack(len(data)) + data)
+        sys.stdout.flush()
+
+# a worker's replies are length prefixed so that they can be read with a time limit
+_WORKER_REPLY_LENGTH = struct.Struct('>I')
+# a worker that takes longer than this (seconds) to reply is killed
+WORKER_TIMEOUT = 60.0
+# a frozen (e.g. py2exe) application's sys.executable isn't a python
+# interpreter and waiting for pipes with select() only works on POSIX
+_CAN_USE_WORKERS = os.name == 'posix' and not getattr(sys, 'frozen', False)
+
+# the workers are started with exec() as forking (e.g. for a
+# multiprocessing.Pool) isn't safe in a multithreaded GUI process
+_WORKER_CODE = '''import sys, __builtin__
+__builtin__.__dict__.setdefault('_', lambda text: text)
+sys.path.insert(0, {0!r})
+from {1} import patchlib
+patchlib._run_summary_worker()
+'''
+
+class _SummaryWorker(object):
+    def __init__(self):
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        code = _WORKER_CODE.format(os.path.dirname(package_dir), __name__.rpartition('.')[0])
+        self._sub = subprocess.Popen([sys.executable, '-u', '-c', code],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, close_fds=os.name == 'posix')
+    def send(self, args_list):
+        cPickle.dump(args_list, self._sub.stdin, cPickle.HIGHEST_PROTOCOL)
+        self._sub.stdin.flush()
+    def _read(self, size, deadline):
+        fdesc = self._sub.stdout.fileno()
+        chunks = []
+        while size > 0:
+            timeout = deadline - time.time()
+            if timeout <= 0 or not select.select([fdesc], [], [], timeout)[0]:
+                raise EOFError('worker timed out')
+            data = os.read(fdesc, size)
+            if not data:
+                raise EOFError('worker closed its output')
+            chunks.append(data)
+            size -= len(data)
+        return ''.join(chunks)
+    def receive(self, timeout=None):
+        deadline = time.time() + (WORKER_TIMEOUT if timeout is None else timeout)
+        length = _WORKER_REPLY_LENGTH.unpack(self._read(_WORKER_REPLY_LENGTH.size, deadline))[0]
+        return cPickle.loads(self._read(length, deadline))
+    def close(self):
+        try:
+            self._sub.stdin.close()
+            self._sub.wait()
+        except (IOError, OSError):
+            pass
+    def kill(self):
+        try:
+            self._sub.kill()
+            self._sub.wait()
+        except OSError:
+            pass
+
+# the workers live as long as the application so they only start up once
+_WORKERS = []
+_WORKERS_LOCK = threading.Lock()
+
+def _summarize_in_workers(args, processes=None):
+    '''Return the _summarize_patch_file_or_none() results for args using
+    (up to processes) worker processes'''
+    with _WORKERS_LOCK:
+        wanted = min(len(args), processes if processes else multiprocessing.cpu_count())
+        while len(_WORKERS) < wanted:
+            try:
+                _WORKERS.append(_SummaryWorker())
+            except OSError:
+                break
+        workers = _WORKERS[:wanted]
+        if not workers:
+            return [_summarize_patch_file_or_none(arg) for arg in args]
+        # worker i gets every len(workers)th file starting at the i'th
+        stride = len(workers)
+        results = [None] * len(args)
+        sent = []
+        for index, worker in enumerate(workers):
+            try:
+                worker.send(args[index::stride])
+                sent.append(True)
+            except (IOError, OSError):
+                sent.append(False)
+        for index, worker in enumerate(workers):
+            try:
+                if not sent[index]:
+                    raise EOFError
+                results[index::stride] = worker.receive()
+            except (IOError, OSError, EOFError, select.error, cPickle.UnpicklingError):
+                # a dead (or stuck) worker is replaced next time and its
+                # share done here
+                worker.kill()
+                _WORKERS.remove(worker)
+                results[index::stride] = [_summarize_patch_file_or_none(arg) for arg in args[index::stride]]
+        return results
+
+# worker processes aren't worth the overhead for less than this
+_MIN_PARALLEL_PATCHES = 8
+_SUMMARY_CACHE = {}
+
+def parse_series(filepaths, strip_level=1, processes=None, cache=None):
+    '''Return a list of PatchSummary (or None if a file can't be read or
+    parsed) for the listed patch files.  Files that have changed (or not
+    been seen) since last time are parsed concurrently by a pool of
+    (long lived) processes (number of CPUs if processes is None).  cache
+    (a dict) may be supplied to replace the module's summary cache.'''
+    if cache is None:
+        cache = _SUMMARY_CACHE
+    signatures = []
+    for filepath in filepaths:
+        try:
+            stat_data = os.stat(filepath)
+            signatures.append((stat_data.st_ino, stat_data.st_size, stat_data.st_mtime, strip_level))
+        except OSError:
+            signatures.append(None)
+    summaries = [None] * len(filepaths)
+    todo = []
+    for index, filepath in enumerate(filepaths):
+        if signatures[index] is None:
+            continue
+        cached = cache.get(filepath, None)
+        if cached is not None and cached[0] == signatures[index]:
+            summaries[index] = cached[1]
+        else:
+            todo.append(index)
+    if len(todo) < _MIN_PARALLEL_PATCHES or not _CAN_USE_WORKERS:
+        results = [_summarize_patch_file_or_none((filepaths[index], strip_level)) for index in todo]
+    else:
+        # the workers' working directories may not be ours
+        results = _summarize_in_workers([(os.path.abspath(filepaths[index]), strip_level) for index in todo], processes)
+    for index, summary in zip(todo, results):
+        summaries[index] = summary
+        if summary is not None:
+            cache[filepaths[index]] = (signatures[index], summary)
+    return summaries
+
+def _self_test():
+    # a context diff hunk that only deletes lines has no "after" lines so
+    # a lazily stored copy of it ends with its "after" header
+    text = ''.join([
+        'diff -rc a/del.txt b/del.txt\n',
+        '*** a/del.txt\n',
+        '--- b/del.txt\n',
+        '***************\n',
+        '*** 1,5 ****\n',
+        '  one\n',
+        '- two\n',
+        '- three\n',
+        '  four\n',
+        '  five\n',
+        '--- 1,3 ----\n',
+        'diff -rc a/mod.txt b/mod.txt\n',
+        '*** a/mod.txt\n',
+        '--- b/mod.txt\n',
+        '***************\n',
+        '*** 1,2 ****\n',
+        '  alpha\n',
+        '! beta\n',
+        '--- 1,2 ----\n',
+        '  alpha\n',
+        '! gamma\n',
+    ])
+    eager = Patch.parse_text(text)
+    lazy = Patch.parse_text(text, lazy=True)
+    assert str(lazy) == str(eager) == text
+    eager_stats = [(item.path, tuple(item.diff_stats)) for item in eager.get_diffstat_stats()]
+    lazy_stats = [(item.path, tuple(item.diff_stats)) for item in lazy.get_diffstat_stats()]
+    assert lazy_stats == eager_stats == [('b/del.txt', (0, 2, 0, 0)), ('b/mod.txt', (0, 0, 2, 0))]
+
+if __name__ == '__main__':
+    import __builtin__
+    __builtin__.__dict__.setdefault('_', lambda text: text)
+    _self_test()
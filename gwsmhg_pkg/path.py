@@ -263,16 +263,13 @@ INCOMING_TABLE_UI_DESCR = \
 '''
 
 class IncomingTable(change_set.SearchableChangeSetTable):
-    class View(change_set.SearchableChangeSetTable.View):
+    class View(change_set.LongChangeSetTableView):
+        BGND_FETCH = True
         def __init__(self, path, busy_indicator=None, size_req=None):
             self._path = path
-            change_set.SearchableChangeSetTable.View.__init__(self, busy_indicator=busy_indicator, size_req=size_req)
+            change_set.LongChangeSetTableView.__init__(self, busy_indicator=busy_indicator, size_req=size_req)
         def _fetch_contents(self):
-            try:
-                return ifce.SCM.get_incoming_table_data(self._path)
-            except cmd_result.Failure as failure:
-                dialogue.report_failure(failure)
-                return []
+            return ifce.SCM.get_incoming_table_data(self._path)
     def __init__(self, path=None, busy_indicator=None):
         self._path = path
         change_set.SearchableChangeSetTable.__init__(self, busy_indicator=busy_indicator,
@@ -317,16 +314,13 @@ OUTGOING_TABLE_UI_DESCR = \
 '''
 
 class OutgoingTable(change_set.SearchableChangeSetTable):
-    class View(change_set.SearchableChangeSetTable.View):
+    class View(change_set.LongChangeSetTableView):
+        BGND_FETCH = True
         def __init__(self, busy_indicator=None, size_req=None, path=None):
             self._path = path
-            change_set.SearchableChangeSetTable.View.__init__(self, busy_indicator=busy_indicator, size_req=size_req)
+            change_set.LongChangeSetTableView.__init__(self, busy_indicator=busy_indicator, size_req=size_req)
         def _fetch_contents(self):
-            try:
-                return ifce.SCM.get_outgoing_table_data(self._path)
-            except cmd_result.Failure as failure:
-                dialogue.report_failure(failure)
-                return []
+            return ifce.SCM.get_outgoing_table_data(self._path)
     def __init__(self, path=None, busy_indicator=None):
         self._path = path
         change_set.SearchableChangeSetTable.__init__(self, busy_indicator=busy_indicator,
@@ -20,9 +20,12 @@
 import re
 import os.path
 import tempfile
+import mmap
+import copy
 
 from . import utils
 from . import patchlib
+from . import patch_cache
 
 def get_patch_descr_fm_text(text):
     obj = patchlib.Patch.parse_text(text)
@@ -30,17 +33,20 @@ def get_patch_descr_fm_text(text):
 
 def get_patch_descr(path):
     try:
-        buf = utils.get_file_contents(path)
-    except IOError:
+        return patch_cache.get_patch(path).get_description()
+    except (IOError, OSError):
         return ''
-    return get_patch_descr_fm_text(buf)
 
 def get_epatch(path):
+    '''Return a Patch for the file at path that the caller may set the
+    state of and the validity of its diff_pluses (but not modify)'''
     try:
-        buf = utils.get_file_contents(path)
-    except IOError:
+        cached = patch_cache.get_patch(path)
+    except (IOError, OSError):
         return None
-    return patchlib.Patch.parse_text(buf)
+    epatch = copy.copy(cached)
+    epatch.diff_pluses = [copy.copy(diff_plus) for diff_plus in cached.diff_pluses]
+    return epatch
 
 def get_patch_hdr_fm_text(text, omit_diffstat=False):
     obj = patchlib.Patch.parse_text(text)
@@ -51,10 +57,13 @@ def get_patch_hdr_fm_text(text, omit_diffstat=False):
 
 def get_patch_hdr(path, omit_diffstat=False):
     try:
-        buf = utils.get_file_contents(path)
-    except IOError:
+        patch = patch_cache.get_patch(path)
+    except (IOError, OSError):
         return ''
-    return get_patch_hdr_fm_text(buf, omit_diffstat)
+    if omit_diffstat:
+        return get_patch_hdr_fm_text(str(patch.get_header()), omit_diffstat)
+    hdr = patch.get_header()
+    return '' if hdr is None else str(hdr)
 
 def get_patch_diff_fm_text(text, file_list=None, strip_level=0):
     obj = patchlib.Patch.parse_text(text)
@@ -64,8 +73,45 @@ def get_patch_diff_fm_text(text, file_list=None, strip_level=0):
         num_strip_level = int(strip_level)
         return ''.join([str(x) for x in obj.diff_pluses if x.get_file_path(num_strip_level) in file_list])
 
+def _iterate_patch_file_diff_pluses(path, decompress=False):
+    with utils.open_file_source(path, decompress) as source:
+        # hunks are only parsed if they're used
+        for diff_plus in patchlib.iterate_diff_pluses(source, lazy=True):
+            yield diff_plus
+
+def iterate_patch_file_diff_buffers(path, decompress=False):
+    '''Yield (diff_plus, text) for each diff in the patch file at path
+    where text is the diff's text (including trailing junk).  When the
+    file can be memory mapped text is a buffer into the mapping (rather
+    than a copy) and is only valid until the next item is requested.'''
+    with utils.open_file_source(path, decompress) as source:
+        mapped = isinstance(source, mmap.mmap)
+        for diff_plus, starts_at, ends_at in patchlib.iterate_diff_plus_spans(source, lazy=True):
+            if mapped:
+                yield diff_plus, buffer(source, starts_at, ends_at - starts_at)
+            else:
+                yield diff_plus, str(diff_plus)
+
+def _iterate_cached_diff_pluses(path):
+    # patches too big to be cached are streamed rather than read in whole
+    if patch_cache.CACHE.would_keep(path):
+        return iter(patch_cache.get_patch(path).diff_pluses)
+    return _iterate_patch_file_diff_pluses(path)
+
 def get_patch_diff(path, file_list=None, strip_level=0):
-    return get_patch_diff_fm_text(utils.get_file_contents(path), file_list, strip_level)
+    if patch_cache.CACHE.would_keep(path):
+        diff_pluses = patch_cache.get_patch(path).diff_pluses
+        if not file_list:
+            return ''.join([str(x) for x in diff_pluses])
+        num_strip_level = int(strip_level)
+        return ''.join([str(x) for x in diff_pluses if x.get_file_path(num_strip_level) in file_list])
+    # copy big patches' diffs straight out of the file (without regenerating them)
+    num_strip_level = int(strip_level)
+    parts = []
+    for diff_plus, text in iterate_patch_file_diff_buffers(path):
+        if not file_list or diff_plus.get_file_path(num_strip_level) in file_list:
+            parts.append(str(text))
+    return ''.join(parts)
 
 def _write_via_temp(path, text):
     tmpdir = os.path.dirname(path)
@@ -92,6 +138,7 @@ def set_patch_descr(path, text):
     else:
         patch_obj = patchlib.Patch()
     patch_obj.set_description(text)
+    patch_cache.forget(path)
     return _write_via_temp(path, str(patch_obj))
 
 def set_patch_hdr(path, text, omit_diffstat=False):
@@ -105,15 +152,16 @@ def set_patch_hdr(path, text, omit_diffstat=False):
         hdr = dummy.get_header()
         text = '' if hdr is None else str(hdr)
     patch_obj.set_header(text)
+    patch_cache.forget(path)
     return _write_via_temp(path, str(patch_obj))
 
 def get_patch_files(path, strip_level=1):
-    obj = patchlib.Patch.parse_text(utils.get_file_contents(path))
-    return obj.get_file_paths(int(strip_level))
+    num_strip_level = int(strip_level)
+    return [x.get_file_path(num_strip_level) for x in _iterate_cached_diff_pluses(path)]
 
 def get_patch_files_plus(path, strip_level=1):
-    obj = patchlib.Patch.parse_text(utils.get_file_contents(path))
-    return obj.get_file_paths_plus(int(strip_level))
+    num_strip_level = int(strip_level)
+    return [x.get_file_path_plus(num_strip_level) for x in _iterate_cached_diff_pluses(path)]
 
 def apply_patch_text(text, indir=None, patch_args=''):
     from pyquilt_pkg import customization
@@ -21,26 +21,93 @@ import subprocess
 import shlex
 import gobject
 import gtk
-import select
+import errno
+import threading
 
 from . import cmd_result
+from . import options
+from . import hg_cmdserver
+
+options.define('hg', 'cmd_server', options.Defn(options.str_to_bool, False, _('Run hg commands (other than those shown in the console) via a persistent command server ("hg serve --cmdserver pipe")')))
+
+def _use_cmd_server(cmd):
+    return hg_cmdserver.is_suitable(cmd) and options.get('hg', 'cmd_server')
 
 def run_cmd(cmd, input_text=None):
     '''Run the given external command and return the results'''
     if isinstance(cmd, str):
         cmd = shlex.split(cmd)
+    if _use_cmd_server(cmd):
+        result = hg_cmdserver.run_cmd(cmd, input_text)
+        if result is not None:
+            return result
     is_posix = os.name == 'posix'
-    if is_posix:
+    # signal handlers can only be changed in the main thread and this may
+    # be running in a background worker (see bgnd)
+    set_sigpipe = is_posix and threading.current_thread().name == 'MainThread'
+    if set_sigpipe:
         savedsh = signal.getsignal(signal.SIGPIPE)
         signal.signal(signal.SIGPIPE, signal.SIG_DFL)
     sub = subprocess.Popen(cmd,
         stdin=subprocess.PIPE, stdout=subprocess.PIPE,
         stderr=subprocess.PIPE, close_fds=is_posix, bufsize=-1)
     outd, errd = sub.communicate(input_text)
-    if is_posix:
+    if set_sigpipe:
         signal.signal(signal.SIGPIPE, savedsh)
     return cmd_result.Result(ecode=sub.returncode, stdout=outd, stderr=errd)
 
+# console output is passed on at most this often (milliseconds)
+_CONSOLE_FLUSH_INTERVAL = 100
+_READ_SIZE = 65536
+
+class _ConsoleOutputCollector(object):
+    '''Collect a subprocess's output (as it becomes available) and pass it
+    on to the console in batches while keeping the GUI responsive'''
+    def __init__(self, console, sub):
+        self._console = console
+        self._outd = []
+        self._errd = []
+        self._pending = []
+        self._open_count = 2
+        self._loop = gobject.MainLoop()
+        condition = gobject.IO_IN | gobject.IO_HUP | gobject.IO_ERR
+        gobject.io_add_watch(sub.stdout.fileno(), condition, self._read_cb, self._outd, console.append_stdout)
+        gobject.io_add_watch(sub.stderr.fileno(), condition, self._read_cb, self._errd, console.append_stderr)
+        self._flush_id = gobject.timeout_add(_CONSOLE_FLUSH_INTERVAL, self._flush_cb)
+    def _read_cb(self, fdesc, _condition, chunks, append):
+        try:
+            data = os.read(fdesc, _READ_SIZE)
+        except OSError as edata:
+            if edata.errno == errno.EINTR:
+                return True
+            data = ''
+        if not data:
+            self._open_count -= 1
+            if self._open_count == 0:
+                self._loop.quit()
+            return False
+        chunks.append(data)
+        # keep stdout and stderr output in the order that it arrived
+        if self._pending and self._pending[-1][0] is append:
+            self._pending[-1][1].append(data)
+        else:
+            self._pending.append((append, [data]))
+        return True
+    def _flush(self):
+        pending, self._pending = self._pending, []
+        for append, chunks in pending:
+            append(''.join(chunks))
+    def _flush_cb(self):
+        self._flush()
+        return True
+    def run(self):
+        '''Wait for the subprocess to close its output and return
+        the (stdout, stderr) text'''
+        self._loop.run()
+        gobject.source_remove(self._flush_id)
+        self._flush()
+        return (''.join(self._outd), ''.join(self._errd))
+
 def run_cmd_in_console(console, cmd, input_text=None):
     """Run the given command in the given console and report the outcome as a
     cmd_result.Result tuple.
@@ -57,6 +124,9 @@ def run_cmd_in_console(console, cmd, input_text=None):
     console.start_cmd(' '.join(cmd) + "\n")
     while gtk.events_pending():
         gtk.main_iteration()
+    # console commands always get their own process (rather than using the
+    # command server) so that their output can be shown as it arrives
+    # without blocking the GUI or waiting for background commands
     try:
         # we need to catch OSError if command is unknown
         sub = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
@@ -65,30 +135,7 @@ def run_cmd_in_console(console, cmd, input_text=None):
             sub.stdin.write(input_text)
             console.append_stdin(input_text)
         sub.stdin.close()
-        stdout_eof = stderr_eof = False
-        outd = errd = ""
-        while True:
-            to_check_in = [sub.stdout] * (not stdout_eof) + \
-                          [sub.stderr] * (not stderr_eof)
-            ready = select.select(to_check_in, [], [], 0)
-            if sub.stdout in ready[0]:
-                ochunk = sub.stdout.readline()
-                if ochunk == '':
-                    stdout_eof = True
-                else:
-                    console.append_stdout(ochunk)
-                    outd += ochunk
-            if sub.stderr in ready[0]:
-                echunk = sub.stderr.readline()
-                if echunk == '':
-                    stderr_eof = True
-                else:
-                    console.append_stderr(echunk)
-                    errd += echunk
-            while gtk.events_pending():
-                gtk.main_iteration()
-            if stdout_eof and stderr_eof:
-                break
+        outd, errd = _ConsoleOutputCollector(console, sub).run()
         sub.wait()
         result = cmd_result.Result(ecode=sub.returncode, stdout=outd, stderr=errd)
     except OSError as edata:
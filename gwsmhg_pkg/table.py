@@ -27,6 +27,8 @@ from . import ws_event
 from . import tlview
 from . import icons
 from . import dialogue
+from . import cmd_result
+from . import bgnd
 
 ALWAYS_ON = 'table_always_on'
 MODIFIED = 'table_modified'
@@ -138,6 +140,10 @@ class Table(gtk.VBox):
 
 class TableView(tlview.ListView, ws_actions.AGandUIManager, dialogue.BusyIndicatorUser):
     PopUp = None
+    # Views whose _fetch_contents() doesn't touch GTK (and reports problems
+    # by raising cmd_result.Failure) should set this so that refreshes are
+    # done in the background.  The stale contents stay visible meanwhile.
+    BGND_FETCH = False
     def __init__(self, busy_indicator=None, size_req=None):
         tlview.ListView.__init__(self)
         dialogue.BusyIndicatorUser.__init__(self, busy_indicator)
@@ -146,6 +152,9 @@ class TableView(tlview.ListView, ws_actions.AGandUIManager, dialogue.BusyIndicat
             self.set_size_request(size_req[0], size_req[1])
         self.connect("button_press_event", self._handle_clear_selection_cb)
         self.connect("key_press_event", self._handle_clear_selection_cb)
+        self.connect("destroy", self._destroy_cb)
+    def _destroy_cb(self, _widget):
+        bgnd.cancel(self)
     def populate_action_groups(self):
         self.action_groups[actions.AC_DONT_CARE].add_actions(
             [
@@ -170,18 +179,39 @@ class TableView(tlview.ListView, ws_actions.AGandUIManager, dialogue.BusyIndicat
         return False
     def _fetch_contents(self):
         assert False, _("Must be defined in child")
-    def _set_contents(self):
+    def _safely_fetch_contents(self):
+        try:
+            return self._fetch_contents()
+        except cmd_result.Failure as failure:
+            dialogue.report_failure(failure)
+            return []
+    def _set_contents(self, contents=None):
         model = self.Model()
-        model.set_contents(self._fetch_contents())
+        model.set_contents(self._safely_fetch_contents() if contents is None else contents)
         self.set_model(model)
         self.columns_autosize()
         self.seln.unselect_all()
     def set_contents(self):
+        bgnd.cancel(self)
         self.show_busy()
         self._set_contents()
         self.unshow_busy()
     def refresh_contents(self):
-        self.show_busy()
+        if self.BGND_FETCH:
+            bgnd.submit(self, self._fetch_contents, self._refresh_with_contents, error_callback=self._bgnd_fetch_failed_cb)
+        else:
+            self.show_busy()
+            self._refresh_with_contents(self._safely_fetch_contents())
+            self.unshow_busy()
+    def _bgnd_fetch_failed_cb(self, exception):
+        if not isinstance(exception, cmd_result.Failure):
+            raise exception
+        dialogue.report_failure(exception)
+    def _refresh_with_contents(self, contents):
+        # changing the existing rows in place leaves selection and scroll
+        # position alone and only costs as much as the change
+        if self.model.update_contents(contents):
+            return
         selected_keys = self.get_selected_keys()
         visible_range = self.get_visible_range()
         if visible_range is not None:
@@ -192,7 +222,7 @@ class TableView(tlview.ListView, ws_actions.AGandUIManager, dialogue.BusyIndicat
             align = float(middle_offset) / float(length)
             middle = start + middle_offset
             middle_key = self.model.get_value(self.model.get_iter(middle), 0)
-        self._set_contents()
+        self._set_contents(contents)
         for key in selected_keys:
             model_iter = self.model.find_named(lambda x: x[0] == key)
             if model_iter is not None:
@@ -202,7 +232,6 @@ class TableView(tlview.ListView, ws_actions.AGandUIManager, dialogue.BusyIndicat
             if middle_iter is not None:
                 middle = self.model.get_path(middle_iter)
                 self.scroll_to_cell(middle, use_align=True, row_align=align)
-        self.unshow_busy()
     def _refresh_contents_acb(self, _action):
         self.refresh_contents()
     def get_contents(self):
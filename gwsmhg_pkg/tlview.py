@@ -19,6 +19,7 @@ them from templates and allow easier access to named contents.
 """
 
 import collections
+import array
 
 import gtk
 import gobject
@@ -69,6 +70,38 @@ class NamedTreeModel(gtk.TreeModel):
                 model_iter = self.iter_next(model_iter)
         return None
 
+def _update_list_contents(model, rows, key_index):
+    """
+    Make the list model's contents match rows by deleting, inserting
+    and changing only those rows that differ (rows are matched using
+    the values in their key_index column).  Return False, without
+    touching the model, if that isn't possible because the keys aren't
+    unique or the surviving rows' order has changed.
+    """
+    new_keys = [row[key_index] for row in rows]
+    new_key_set = set(new_keys)
+    if len(new_key_set) != len(new_keys):
+        return False
+    old_rows = [tuple(row) for row in model.named()]
+    old_keys = [row[key_index] for row in old_rows]
+    old_key_set = set(old_keys)
+    if len(old_key_set) != len(old_keys):
+        return False
+    kept_keys = [key for key in old_keys if key in new_key_set]
+    if kept_keys != [key for key in new_keys if key in old_key_set]:
+        return False
+    for index in reversed(range(len(old_keys))):
+        if old_keys[index] not in new_key_set:
+            model.delete_row(index)
+    old_rows_map = dict(zip(old_keys, old_rows))
+    for index, row in enumerate(rows):
+        old_row = old_rows_map.get(new_keys[index], None)
+        if old_row is None:
+            model.insert_row(index, row)
+        elif old_row != tuple(row):
+            model.update_row(index, row)
+    return True
+
 class NamedListStore(gtk.ListStore, NamedTreeModel):
     def __init__(self):
         gtk.ListStore.__init__(*[self] + list(self.types))
@@ -79,6 +112,119 @@ class NamedListStore(gtk.ListStore, NamedTreeModel):
         self.clear()
         for row in rows:
             self.append(row)
+    def delete_row(self, index):
+        self.remove(self.get_iter((index,)))
+    def insert_row(self, index, row):
+        self.insert(index, row)
+    def update_row(self, index, row):
+        self[index] = row
+    def update_contents(self, rows, key_index=0):
+        return _update_list_contents(self, rows, key_index)
+
+class NamedLazyListModel(gtk.GenericTreeModel, NamedTreeModel):
+    '''
+    A read only list model for large tables.  The data is held column
+    by column (integer columns in arrays) and values are only handed to
+    the view as it asks for them (i.e. for visible cells).
+    '''
+    def __init__(self):
+        gtk.GenericTreeModel.__init__(self)
+        # row references are indices and we keep those that are in use
+        # alive ourselves rather than leaking them
+        self.props.leak_references = False
+        self._rowrefs = {}
+        self._columns = self._new_columns([])
+        self._nrows = 0
+        self._queried = False
+    def _new_columns(self, rows):
+        col_lists = list(zip(*rows)) if rows else [()] * len(self.types)
+        columns = []
+        for col_type, col_list in zip(self.types, col_lists):
+            if col_type in (gobject.TYPE_INT, gobject.TYPE_LONG):
+                columns.append(array.array('l', col_list))
+            else:
+                columns.append(list(col_list))
+        return columns
+    def _rowref(self, index):
+        return self._rowrefs.setdefault(index, index)
+    def clear(self):
+        nrows = self._nrows
+        self._nrows = 0
+        if self._queried:
+            for index in reversed(range(nrows)):
+                self.row_deleted((index,))
+        self._columns = self._new_columns([])
+        self._rowrefs = {}
+    def append_contents(self, rows):
+        new_columns = self._new_columns(rows)
+        for column, new_column in zip(self._columns, new_columns):
+            column.extend(new_column)
+        first = self._nrows
+        self._nrows += len(rows)
+        if self._queried:
+            for index in range(first, self._nrows):
+                self.row_inserted((index,), self.get_iter((index,)))
+    def set_contents(self, rows):
+        self.clear()
+        self.append_contents(rows)
+    def delete_row(self, index):
+        for column in self._columns:
+            del column[index]
+        self._nrows -= 1
+        if self._queried:
+            self.row_deleted((index,))
+    def insert_row(self, index, row):
+        for column, value in zip(self._columns, row):
+            column.insert(index, value)
+        self._nrows += 1
+        if self._queried:
+            self.row_inserted((index,), self.get_iter((index,)))
+    def update_row(self, index, row):
+        for column, value in zip(self._columns, row):
+            column[index] = value
+        if self._queried:
+            self.row_changed((index,), self.get_iter((index,)))
+    def update_contents(self, rows, key_index=0):
+        return _update_list_contents(self, rows, key_index)
+    def named(self):
+        # straight from the columns rather than via iterators
+        for index in range(self._nrows):
+            yield self.Row(*[column[index] for column in self._columns])
+    def find_named(self, select_func):
+        for index, row in enumerate(self.named()):
+            if select_func(row):
+                return self.get_iter((index,))
+        return None
+    # GenericTreeModel interface
+    def on_get_flags(self):
+        return gtk.TREE_MODEL_LIST_ONLY
+    def on_get_n_columns(self):
+        return len(self.types)
+    def on_get_column_type(self, index):
+        return self.types[index]
+    def on_get_iter(self, path):
+        # until someone asks for an iterator there's no need for signals
+        self._queried = True
+        return self._rowref(path[0]) if path[0] < self._nrows else None
+    def on_get_path(self, rowref):
+        return (rowref,)
+    def on_get_value(self, rowref, column):
+        return self._columns[column][rowref]
+    def on_iter_next(self, rowref):
+        return self._rowref(rowref + 1) if rowref + 1 < self._nrows else None
+    def on_iter_children(self, parent):
+        self._queried = True
+        return self._rowref(0) if parent is None and self._nrows else None
+    def on_iter_has_child(self, rowref):
+        return False
+    def on_iter_n_children(self, rowref):
+        self._queried = True
+        return self._nrows if rowref is None else 0
+    def on_iter_nth_child(self, parent, index):
+        self._queried = True
+        return self._rowref(index) if parent is None and index < self._nrows else None
+    def on_iter_parent(self, child):
+        return None
 
 class NamedTreeStore(gtk.TreeStore, NamedTreeModel):
     def __init__(self):
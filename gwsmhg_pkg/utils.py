@@ -27,6 +27,16 @@ import zlib
 import gzip
 import bz2
 import shutil
+import mmap
+import contextlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
 
 import gtk
 import gobject
@@ -168,32 +178,70 @@ def get_first_in_envar(envar_list):
             continue
     return ''
 
+_DECOMPRESSORS = {
+    '.gz': gzip.GzipFile,
+    '.bz2': bz2.BZ2File,
+}
+if lzma is not None:
+    _DECOMPRESSORS['.xz'] = _DECOMPRESSORS['.lzma'] = lzma.LZMAFile
+_DECOMPRESS_CMDS = {
+    '.xz': ['xz', '-cd'],
+    '.lzma': ['lzma', '-cd'],
+}
+
+@contextlib.contextmanager
+def _decompressing_pipe(cmd, srcfile):
+    '''The (streamed) output of cmd run on srcfile'''
+    try:
+        sub = subprocess.Popen(cmd + [srcfile], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as edata:
+        raise IOError(edata.errno, edata.strerror, srcfile)
+    try:
+        yield sub.stdout
+    finally:
+        sub.stdout.close()
+        serr = sub.stderr.read()
+        if sub.wait() != 0:
+            sys.stderr.write(serr)
+
+@contextlib.contextmanager
+def open_file_source(srcfile, decompress=False):
+    '''
+    Yield a read only source (with read() and readline() methods) for
+    the (optionally decompressed as indicated by its suffix) contents
+    of srcfile.  Plain files are memory mapped so nothing is copied until
+    it's read and compressed files are decompressed as they're read.
+    '''
+    ext = os.path.splitext(srcfile)[1] if decompress else None
+    if ext in _DECOMPRESSORS:
+        with contextlib.closing(_DECOMPRESSORS[ext](srcfile, 'rb')) as source:
+            yield source
+    elif ext in _DECOMPRESS_CMDS:
+        with _decompressing_pipe(_DECOMPRESS_CMDS[ext], srcfile) as source:
+            yield source
+    else:
+        with open(srcfile, 'rb') as fobj:
+            try:
+                source = mmap.mmap(fobj.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError):
+                # e.g. empty files can't be mapped
+                yield fobj
+                return
+            try:
+                yield source
+            finally:
+                source.close()
+
 def get_file_contents(srcfile, decompress=False):
     '''
     Get the contents of filename to text after (optionally) applying
     decompression as indicated by filename's suffix.
     '''
-    if decompress:
-        _root, ext = os.path.splitext(srcfile)
-        res = 0
-        if ext == '.gz':
-            return gzip.open(srcfile).read()
-        elif ext == '.bz2':
-            bz2f = bz2.BZ2File(srcfile, 'r')
-            text = bz2f.read()
-            bz2f.close()
-            return text
-        elif ext == '.xz':
-            res, text, serr = run_cmd('xz -cd %s' % srcfile)
-        elif ext == '.lzma':
-            res, text, serr = run_cmd('lzma -cd %s' % srcfile)
-        else:
-            return open(srcfile).read()
-        if res != 0:
-            sys.stderr.write(serr)
-        return text
-    else:
-        return open(srcfile).read()
+    _root, ext = os.path.splitext(srcfile)
+    if decompress and (ext in _DECOMPRESSORS or ext in _DECOMPRESS_CMDS):
+        with open_file_source(srcfile, decompress=True) as source:
+            return source.read()
+    return open(srcfile).read()
 
 def set_file_contents(filename, text, compress=False):
     '''
@@ -217,10 +265,14 @@ def set_file_contents(filename, text, compress=False):
                 return True
             except IOError:
                 return False
-        elif ext == '.xz':
-            res, text, serr = run_cmd('xz -c', text)
-        elif ext == '.lzma':
-            res, text, serr = run_cmd('lzma -c', text)
+        elif ext in _DECOMPRESS_CMDS:
+            try:
+                sub = subprocess.Popen([_DECOMPRESS_CMDS[ext][0], '-c'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError as edata:
+                sys.stderr.write('{0}\n'.format(edata))
+                return False
+            text, serr = sub.communicate(text)
+            res = sub.returncode
         if res != 0:
             sys.stderr.write(serr)
             return False
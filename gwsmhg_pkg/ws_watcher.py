@@ -0,0 +1,201 @@
+### Copyright (C) 2013 Peter Williams <pwil3058@gmail.com>
+###
+### This program is free software; you can redistribute it and/or modify
+### it under the terms of the GNU General Public License as published by
+### the Free Software Foundation; version 2 of the License only.
+###
+### This program is distributed in the hope that it will be useful,
+### but WITHOUT ANY WARRANTY; without even the implied warranty of
+### MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+### GNU General Public License for more details.
+###
+### You should have received a copy of the GNU General Public License
+### along with this program; if not, write to the Free Software
+### Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+
+'''Watch a workspace (using inotify) and translate file system changes
+into the ws_event flags that describe them'''
+
+import os
+
+import gobject
+
+from . import ws_event
+from . import hg_mq_ifce
+
+try:
+    import pyinotify
+
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+# wait this long (milliseconds) after the first change so that a burst
+# of changes (e.g. "hg qpush") results in a single notification
+COALESCE_INTERVAL = 500
+
+_PATCH_FILE_EVENTS = ws_event.PATCH_REFRESH | ws_event.PATCH_MODIFY
+_OVERFLOW_EVENTS = ws_event.FILE_CHANGES | ws_event.REPO_MOD | ws_event.CHECKOUT | ws_event.PATCH_CHANGES
+
+# files in .hg/ that are of interest (anything else there is ignored)
+_HG_FILE_EVENTS = {
+    'dirstate': ws_event.FILE_MOD | ws_event.CHECKOUT,
+    'branch': ws_event.REPO_MOD | ws_event.CHECKOUT,
+    'bookmarks': ws_event.REPO_MOD,
+    'bookmarks.current': ws_event.REPO_MOD,
+    'localtags': ws_event.REPO_MOD,
+    'hgrc': ws_event.REPO_HGRC,
+    os.path.join('store', '00changelog.i'): ws_event.REPO_MOD,
+    os.path.join('store', 'phaseroots'): ws_event.REPO_MOD,
+    os.path.join('merge', 'state'): ws_event.FILE_MOD,
+    # switching to another patch queue
+    'patches.queue': ws_event.PATCH_CHANGES,
+}
+# files in the current patch queue's directory (.hg/patches or .hg/patches-<name>)
+_QUEUE_FILE_EVENTS = {
+    'series': ws_event.PATCH_CREATE | ws_event.PATCH_DELETE | ws_event.PATCH_MODIFY,
+    'status': ws_event.PATCH_PUSH | ws_event.PATCH_POP,
+    'guards': ws_event.PATCH_MODIFY,
+}
+_HG_SUBDIRS = ['store', 'merge']
+
+def get_patches_dir_name(hg_dir):
+    '''Return the name of the current patch queue's directory in hg_dir'''
+    return os.path.basename(hg_mq_ifce._QueueFiles.get_patches_dir(hg_dir))
+
+def hg_file_events(rel_path, patches_dir_name='patches'):
+    '''Return the events implied by a change to the file with the given
+    path (relative to .hg/) when patches_dir_name is the current patch
+    queue's directory'''
+    events = _HG_FILE_EVENTS.get(rel_path, 0)
+    if not events:
+        dir_name, base_name = os.path.split(rel_path)
+        if dir_name == patches_dir_name:
+            events = _QUEUE_FILE_EVENTS.get(base_name, 0)
+            # hg writes files via hidden temporaries so ignore those
+            if not events and not base_name.startswith('.'):
+                events = _PATCH_FILE_EVENTS
+    return events
+
+def ws_file_events(rel_path, mask):
+    '''Return the events implied by a change (described by mask) to the
+    working directory file with the given path'''
+    if mask & (pyinotify.IN_CREATE | pyinotify.IN_MOVED_TO):
+        events = ws_event.FILE_ADD
+    elif mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+        events = ws_event.FILE_DEL
+    else:
+        events = ws_event.FILE_MOD
+    if rel_path == '.hgignore':
+        events |= ws_event.FILE_HGIGNORE
+    elif rel_path == '.hgtags':
+        events |= ws_event.REPO_MOD
+    return events
+
+if AVAILABLE:
+    _MASK = pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_CLOSE_WRITE | \
+        pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO | pyinotify.IN_ATTRIB
+
+    class _EventHandler(pyinotify.ProcessEvent):
+        def my_init(self, watcher):
+            self._watcher = watcher
+        def process_default(self, event):
+            self._watcher.handle_event(event)
+
+class WatchError(Exception): pass
+
+class Watcher(object):
+    '''Watch the workspace at root and call callback(events) with the
+    accumulated ws_event flags once a burst of changes has subsided.
+    If callback returns False (e.g. because the application is busy)
+    the events are held over and delivered later.'''
+    def __init__(self, root, callback):
+        if not AVAILABLE:
+            raise WatchError(_('pyinotify is not available'))
+        self._root = os.path.abspath(root)
+        self._hg_dir = os.path.join(self._root, '.hg')
+        self._callback = callback
+        self._pending_events = 0
+        self._flush_id = None
+        self._wm = pyinotify.WatchManager()
+        self._notifier = pyinotify.Notifier(self._wm, _EventHandler(watcher=self), timeout=0)
+        self._io_id = None
+        self._patches_dir_name = get_patches_dir_name(self._hg_dir)
+        self._queue_wd = None
+        try:
+            self._add_watch(self._root, rec=True,
+                exclude_filter=lambda path: path == self._hg_dir or path.startswith(self._hg_dir + os.sep))
+            # NB this also covers patches.queue
+            self._add_watch(self._hg_dir)
+            for subdir in _HG_SUBDIRS:
+                path = os.path.join(self._hg_dir, subdir)
+                if os.path.isdir(path):
+                    self._add_watch(path)
+            self._watch_queue_dir()
+        except WatchError:
+            self.close()
+            raise
+        self._io_id = gobject.io_add_watch(self._wm.get_fd(), gobject.IO_IN, self._io_cb)
+    def _add_watch(self, path, rec=False, exclude_filter=None):
+        wdd = self._wm.add_watch(path, _MASK, rec=rec, auto_add=rec, exclude_filter=exclude_filter)
+        # running out of watches is the most likely cause of failure
+        if [wd for wd in wdd.values() if wd < 0]:
+            raise WatchError(_('unable to watch "{0}"').format(path))
+        return wdd
+    def _watch_queue_dir(self):
+        path = os.path.join(self._hg_dir, self._patches_dir_name)
+        if os.path.isdir(path):
+            self._queue_wd = self._add_watch(path)[path]
+    def _switch_queue(self):
+        patches_dir_name = get_patches_dir_name(self._hg_dir)
+        if patches_dir_name == self._patches_dir_name:
+            return
+        if self._queue_wd is not None:
+            self._wm.rm_watch(self._queue_wd, quiet=True)
+            self._queue_wd = None
+        self._patches_dir_name = patches_dir_name
+        try:
+            self._watch_queue_dir()
+        except WatchError:
+            pass
+    def close(self):
+        if self._io_id is not None:
+            gobject.source_remove(self._io_id)
+            self._io_id = None
+        if self._flush_id is not None:
+            gobject.source_remove(self._flush_id)
+            self._flush_id = None
+        self._notifier.stop()
+    def _io_cb(self, _fd, _condition):
+        if self._notifier.check_events(0):
+            self._notifier.read_events()
+            self._notifier.process_events()
+        return True
+    def handle_event(self, event):
+        if event.mask & pyinotify.IN_Q_OVERFLOW:
+            events = _OVERFLOW_EVENTS
+        elif event.pathname == self._hg_dir or event.pathname.startswith(self._hg_dir + os.sep):
+            rel_path = os.path.relpath(event.pathname, self._hg_dir)
+            if rel_path == 'patches.queue':
+                self._switch_queue()
+            elif event.dir and event.mask & pyinotify.IN_CREATE:
+                try:
+                    if rel_path in _HG_SUBDIRS:
+                        self._add_watch(event.pathname)
+                    elif rel_path == self._patches_dir_name and self._queue_wd is None:
+                        self._watch_queue_dir()
+                except WatchError:
+                    pass
+            events = hg_file_events(rel_path, self._patches_dir_name)
+        else:
+            events = ws_file_events(os.path.relpath(event.pathname, self._root), event.mask)
+        if events:
+            self._pending_events |= events
+            if self._flush_id is None:
+                self._flush_id = gobject.timeout_add(COALESCE_INTERVAL, self._flush_cb)
+    def _flush_cb(self):
+        if not self._callback(self._pending_events):
+            return True
+        self._pending_events = 0
+        self._flush_id = None
+        return False